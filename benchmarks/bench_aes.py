@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Decrypt a season's worth of subtitle payloads under each installed AES
+backend, and compare building the keys with and without the key cache
+
+Usage: PYTHONPATH=. python benchmarks/bench_aes.py [episodes] [languages] [events]
+"""
+
+import base64
+import hashlib
+import os
+import sys
+import time
+import zlib
+
+from tlslite.utils.cipherfactory import createAES
+
+from crunchyroll import aesbackend
+from crunchyroll.models import Subtitle
+from crunchyroll.subtitles import SubtitleDecrypter
+
+def _timestamp(seconds):
+    return '%d:%02d:%02d.00' % (seconds // 3600, seconds // 60 % 60,
+        seconds % 60)
+
+def make_script(subtitle_id, event_count):
+    events = ''.join(
+        '<event id="%d" start="%s" end="%s" style="Default" name="" '
+        'margin_l="0000" margin_r="0000" margin_v="0000" effect="" '
+        'text="{\\i1}Line %d of subtitle %d{\\i0}\\Nsecond line"/>' % (
+            i, _timestamp(i * 3), _timestamp(i * 3 + 2), i, subtitle_id) \
+        for i in range(event_count))
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+        '<subtitle_script id="%d" title="Episode" play_res_x="656" '
+        'play_res_y="368" lang_string="English (US)" '
+        'created="2013-04-01T08:00:00-07:00" wrap_style="0"><styles/>'
+        '<events>%s</events></subtitle_script>' % (subtitle_id, events)
+        ).encode('utf-8')
+
+def make_subtitle(subtitle_id, event_count):
+    data = zlib.compress(make_script(subtitle_id, event_count))
+    data += b'\x00' * (-len(data) % 16)
+    iv = os.urandom(16)
+    key = SubtitleDecrypter()._build_encryption_key(subtitle_id)
+    encrypted = bytes(createAES(bytearray(key), bytearray(iv)).encrypt(
+        bytearray(data)))
+    return Subtitle('<subtitle id="%d"><iv>%s</iv><data>%s</data></subtitle>' % (
+        subtitle_id, base64.b64encode(iv).decode('ascii'),
+        base64.b64encode(encrypted).decode('ascii')))
+
+def uncached_key(decrypter, subtitle_id):
+    """How `_build_encryption_key` used to work: the secret and the hash were
+    rebuilt for every subtitle
+    """
+    sha1_hash = hashlib.sha1(
+        decrypter._build_hash_secret((1, 2)).encode('latin-1') +
+        decrypter._build_hash_magic(subtitle_id).encode('ascii')).digest()
+    return (sha1_hash + b'\x00' * 12)[:32]
+
+def main(episode_count=24, language_count=6, event_count=400):
+    subtitle_ids = [100000 + i for i in range(episode_count * language_count)]
+    subtitles = [make_subtitle(subtitle_id, event_count) \
+        for subtitle_id in subtitle_ids]
+    payload_size = sum(len(base64.b64decode(subtitle['data'][0].text)) \
+        for subtitle in subtitles)
+    print('%d subtitles (%d episodes x %d languages), %d KiB encrypted' % (
+        len(subtitles), episode_count, language_count, payload_size // 1024))
+
+    decrypter = SubtitleDecrypter()
+    rounds = 200
+    start = time.time()
+    for _ in range(rounds):
+        for subtitle_id in subtitle_ids:
+            uncached_key(decrypter, subtitle_id)
+    uncached = (time.time() - start) / rounds
+    start = time.time()
+    for _ in range(rounds):
+        for subtitle_id in subtitle_ids:
+            decrypter._build_encryption_key(subtitle_id)
+    cached = (time.time() - start) / rounds
+    print('keys: %7.3fms rebuilt, %7.3fms cached' % (uncached * 1000,
+        cached * 1000))
+
+    for name in aesbackend.PREFERENCE:
+        try:
+            decrypter = SubtitleDecrypter(name)
+        except ImportError:
+            print('%-13s not installed' % name)
+            continue
+        start = time.time()
+        for subtitle in subtitles:
+            decrypter.decrypt_subtitle(subtitle)
+        elapsed = time.time() - start
+        print('%-13s %8.1fms  %6.2f MiB/s' % (name, elapsed * 1000,
+            payload_size / elapsed / 1024 / 1024))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:4]])
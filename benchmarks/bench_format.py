@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Peak memory and time of formatting a parsed subtitle document into a string
+with `format` and into a file with `format_to`, and the time of making every
+format from one compiled document against compiling it for each format
+
+Usage: PYTHONPATH=. python benchmarks/bench_format.py [events...]
+"""
+
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+from bench_xml import make_styled_subtitle
+
+from crunchyroll.models import StyledSubtitle
+from crunchyroll.subtitles import FORMATTERS
+
+def measure(func):
+    tracemalloc.start()
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+def main(event_counts=(1000, 4000, 16000)):
+    for event_count in event_counts:
+        document = make_styled_subtitle(event_count)
+        # compiled up front, so only the output side is measured
+        subtitle = StyledSubtitle(document).compile()
+        for name in sorted(FORMATTERS):
+            formatter = FORMATTERS[name]()
+            with tempfile.TemporaryFile() as output:
+                string_time, string_peak = measure(
+                    lambda: output.write(formatter.format(subtitle)))
+                output.seek(0)
+                output.truncate()
+                stream_time, stream_peak = measure(
+                    lambda: formatter.format_to(subtitle, output))
+            print('%6d events %-4s format: %7.1fms %7d KiB peak  '
+                'format_to: %7.1fms %7d KiB peak' % (event_count, name,
+                    string_time * 1000, string_peak // 1024,
+                    stream_time * 1000, stream_peak // 1024))
+        formats = sorted(FORMATTERS)
+        separate = min(timeit.repeat(lambda: [FORMATTERS[name]().format(
+            StyledSubtitle(document)) for name in formats], number=1, repeat=3))
+        together = min(timeit.repeat(lambda: StyledSubtitle(
+            document).get_formatted(formats), number=1, repeat=3))
+        print('%6d events %d formats, compiled for each: %7.1fms  '
+            'compiled once: %7.1fms' % (event_count, len(formats),
+                separate * 1000, together * 1000))
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or (1000, 4000, 16000))
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Compare requests' Response.json() against the JSON backends decoding the raw
+body, on Android API style list_series and list_media payloads
+
+Usage: PYTHONPATH=. python benchmarks/bench_json.py [series count] [media count]
+"""
+
+import json
+import sys
+import timeit
+
+import requests
+
+from crunchyroll import jsonbackend
+
+def make_image(prefix, i):
+    return dict(('%s_url' % size,
+            'http://img1.ak.crunchyroll.com/i/spire%d/%s_%d_%s.jpg' % (
+                i % 4, prefix, i, size)) \
+        for size in ('thumb', 'small', 'medium', 'large', 'full', 'wide',
+            'widestar', 'fwide', 'fwidestar'))
+
+def wrap_response(data):
+    return json.dumps({
+        'data':     data,
+        'error':    False,
+        'code':     'ok',
+    }).encode('utf-8')
+
+def make_series_payload(count):
+    return wrap_response([{
+        'class':            'series',
+        'series_id':        str(270000 + i),
+        'etype':            'series',
+        'name':             u'Series %d ☆' % i,
+        'description':      u'A show about something. ' * 12,
+        'url':              'http://www.crunchyroll.com/series-%d' % i,
+        'media_type':       'anime',
+        'media_count':      i % 50 + 1,
+        'publisher_name':   'Publisher %d' % (i % 20),
+        'year':             2000 + i % 14,
+        'in_queue':         False,
+        'landscape_image':  make_image('landscape', i),
+        'portrait_image':   make_image('portrait', i),
+    } for i in range(count)])
+
+def make_media_payload(count):
+    return wrap_response([{
+        'class':            'media',
+        'media_id':         str(600000 + i),
+        'collection_id':    '21000',
+        'series_id':        '260000',
+        'etype':            'media',
+        'name':             u'Episode %d ☆' % i,
+        'description':      u'Something happens in this episode. ' * 6,
+        'url':              'http://www.crunchyroll.com/show/episode-%d' % i,
+        'episode_number':   str(i + 1),
+        'duration':         1420.5,
+        'playhead':         0,
+        'available':        True,
+        'free_available':   i % 3 == 0,
+        'premium_available': True,
+        'available_time':   '2013-04-01T08:00:00-07:00',
+        'clip':             False,
+        'screenshot_image': make_image('screenshot', i),
+    } for i in range(count)])
+
+def make_response(content):
+    resp = requests.Response()
+    resp.status_code = 200
+    resp.headers['Content-Type'] = 'application/json'
+    resp._content = content
+    return resp
+
+def time_call(func, number=20):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+def main(series_count=500, media_count=1000):
+    payloads = [
+        ('%d series' % series_count, make_series_payload(series_count)),
+        ('%d media' % media_count, make_media_payload(media_count)),
+    ]
+    backends = []
+    for name in jsonbackend.PREFERENCE:
+        try:
+            backends.append(jsonbackend.make_backend(name))
+        except ImportError:
+            print('%-12s not installed' % name)
+    for label, content in payloads:
+        print('%s (%d KiB)' % (label, len(content) // 1024))
+        baseline = time_call(lambda: make_response(content).json())
+        print('  %-22s %7.2fms' % ('Response.json()', baseline * 1000))
+        for backend in backends:
+            elapsed = time_call(lambda: backend.loads(content))
+            print('  %-22s %7.2fms  %5.2fx' % (backend.name + '.loads(bytes)',
+                elapsed * 1000, baseline / elapsed))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
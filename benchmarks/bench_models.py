@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Compare the compiled (slotted) models against plain DictModel wrappers, and
+with value interning on
+
+Usage: PYTHONPATH=. python benchmarks/bench_models.py [count]
+"""
+
+import gc
+import json
+import sys
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from crunchyroll import interning
+from crunchyroll.models import DictModel, Media
+
+class LegacyMedia(DictModel):
+    """What Media used to be
+    """
+    pass
+
+def make_media_json(count):
+    return json.dumps([{
+        'media_id':         str(600000 + i),
+        'collection_id':    '21000',
+        'series_id':        '260000',
+        'etype':            'media',
+        'name':             'Episode %d' % i,
+        'description':      'Something happens in episode %d.' % i,
+        'url':              'http://www.crunchyroll.com/show/episode-%d' % i,
+        'media_type':       'anime',
+        'episode_number':   str(i),
+        'duration':         1420,
+        'playhead':         0,
+        'free_available':   True,
+        'premium_available': True,
+        'available_time':   '2013-04-01T08:00:00-07:00',
+        'screenshot_image': {
+            'thumb_url':    'http://img1.ak.crunchyroll.com/i/%d_thumb.jpg' % i,
+            'full_url':     'http://img1.ak.crunchyroll.com/i/%d_full.jpg' % i,
+            'width':        '640',
+            'height':       '360',
+        },
+    } for i in range(count)])
+
+def read_fields(models):
+    total = 0
+    for media in models:
+        total += len(media.media_id) + len(media.name)
+        total += len(media.screenshot_image.full_url)
+    return total
+
+def get_overhead(model):
+    """Bytes used by the model itself and the containers it keeps alive,
+    not counting the field values
+    """
+    size = sys.getsizeof(model)
+    if hasattr(model, '__dict__'):
+        size += sys.getsizeof(model.__dict__)
+    data = getattr(model, '_data', None)
+    if data is not None:
+        size += sys.getsizeof(data)
+        nested = data.get('screenshot_image')
+    else:
+        nested = getattr(model, '_n_screenshot_image', None)
+    if isinstance(nested, DictModel):
+        size += get_overhead(nested)
+    elif nested is not None:
+        size += sys.getsizeof(nested)
+    return size
+
+def measure_memory(model_cls, raw_json):
+    """Memory held by the models once the decoded JSON has been dropped
+    """
+    gc.collect()
+    tracemalloc.start()
+    models = [model_cls(item) for item in json.loads(raw_json)]
+    read_fields(models)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, models
+
+def main(count=10000):
+    raw_json = make_media_json(count)
+    data = json.loads(raw_json)
+    print('%d media objects' % count)
+    for model_cls in (LegacyMedia, Media):
+        name = model_cls.__name__
+        build_time = min(timeit.repeat(
+            lambda: [model_cls(item) for item in data], number=1, repeat=5))
+        models = [model_cls(item) for item in data]
+        read_fields(models)
+        read_time = min(timeit.repeat(lambda: read_fields(models),
+            number=1, repeat=5))
+        print('%-12s build: %7.2fms  read 3 fields x %d: %7.2fms' % (
+            name, build_time * 1000, count, read_time * 1000))
+        print('%-12s overhead: %7.1f bytes/object' % (name,
+            float(sum(map(get_overhead, models))) / count))
+        if tracemalloc is not None:
+            size, _ = measure_memory(model_cls, raw_json)
+            print('%-12s retained: %7.1f bytes/object (including values)' % (
+                name, float(size) / count))
+
+    table = interning.enable()
+    try:
+        build_time = min(timeit.repeat(
+            lambda: [Media(item) for item in data], number=1, repeat=5))
+        print('%-12s build: %7.2fms' % ('interned', build_time * 1000))
+        if tracemalloc is not None:
+            # the table itself counts towards what's retained
+            table = interning.enable()
+            size, _ = measure_memory(Media, raw_json)
+            print('%-12s retained: %7.1f bytes/object (including values)' % (
+                'interned', float(size) / count))
+            stats = table.get_stats()
+            print('%-12s %d entries, %d hits, ~%d bytes saved, table %d bytes'
+                % ('interned', stats['entries'], stats['hits'],
+                    stats['bytes_saved'], stats['table_bytes']))
+    finally:
+        interning.disable()
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Compare the XML backends on a VideoPlayer_GetStandardConfig response and a
+decrypted subtitle document
+
+Usage: PYTHONPATH=. python benchmarks/bench_xml.py [subtitle events]
+"""
+
+import sys
+import timeit
+
+from crunchyroll import xmlbackend
+from crunchyroll.models import MediaStream, StyledSubtitle
+
+def make_stream_config(subtitle_count=12):
+    subtitles = ''.join(
+        '<subtitle id="%d" title="[Language %d] Language %d" default="%d" '
+        'link="http://www.crunchyroll.com/xml/?req=RpcApiSubtitle_GetXml'
+        '&amp;subtitle_script_id=%d"/>' % (i, i, i, int(i == 0), i) \
+            for i in range(subtitle_count))
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+        '<config xmlns:default="default"><default:preload>'
+        '<stream_info><media_id>600001</media_id><video_format>106</video_format>'
+        '<host>rtmpe://cp150756.edgefcs.net/ondemand/</host>'
+        '<file>mp4:c10/s/1a2b3c4d/video.mp4</file>'
+        '<token>c3RyZWFtIHRva2VuIHN0cmVhbSB0b2tlbg==</token>'
+        '<metadata><width>1280</width><height>720</height>'
+        '<duration>1420.3</duration></metadata></stream_info>'
+        '<subtitle id="0"><iv>aXZpdml2aXZpdml2aXY=</iv><data>%s</data></subtitle>'
+        '<subtitles>%s</subtitles>'
+        '</default:preload></config>') % ('ZGF0YQ==' * 2000, subtitles)
+
+def _timestamp(seconds):
+    return '%d:%02d:%02d.00' % (seconds // 3600, seconds // 60 % 60,
+        seconds % 60)
+
+def make_styled_subtitle(event_count):
+    events = ''.join(
+        '<event id="%d" start="%s" end="%s" style="Default" name="" '
+        'margin_l="0000" margin_r="0000" margin_v="0000" effect="" '
+        'text="{\\i1}Line %d{\\i0}\\Nsecond line"/>' % (
+            i, _timestamp(i * 3), _timestamp(i * 3 + 2), i) \
+        for i in range(event_count))
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+        '<subtitle_script id="7" title="Episode 1" play_res_x="656" '
+        'play_res_y="368" lang_string="English (US)" '
+        'created="2013-04-01T08:00:00-07:00" wrap_style="0"><styles>'
+        '<style id="1" name="Default" font_name="Arial" font_size="20" '
+        'primary_colour="&amp;H00FFFFFF" secondary_colour="&amp;H000000FF" '
+        'outline_colour="&amp;H00000000" back_colour="&amp;H00000000" bold="0" '
+        'italic="0" underline="0" strikeout="0" scale_x="100" scale_y="100" '
+        'spacing="0" angle="0" border_style="1" outline="2" shadow="1" '
+        'alignment="2" margin_l="20" margin_r="20" margin_v="20" '
+        'encoding="0"/></styles><events>%s</events></subtitle_script>') % events
+
+def read_stream(config):
+    stream = MediaStream(config)
+    info = stream.stream_info
+    return (info.rtmp_data, info.duration, info.resolution,
+        stream.default_subtitles.id,
+        [stub.language for stub in stream.subtitle_stubs])
+
+def format_subtitle(document):
+    subtitle = StyledSubtitle(document)
+    return (subtitle.get_srt_formatted(), subtitle.get_ass_formatted())
+
+def main(event_count=2000):
+    config = make_stream_config()
+    document = make_styled_subtitle(event_count)
+    print('stream config: %d bytes, subtitle: %d events, %d bytes' % (
+        len(config), event_count, len(document)))
+    for name in sorted(xmlbackend.BACKENDS):
+        try:
+            xmlbackend.set_backend(name)
+        except ImportError:
+            print('%-6s not installed' % name)
+            continue
+        parse_time = min(timeit.repeat(lambda: MediaStream(config),
+            number=100, repeat=5)) / 100
+        stream_time = min(timeit.repeat(lambda: read_stream(config),
+            number=100, repeat=5)) / 100
+        sub_parse_time = min(timeit.repeat(lambda: StyledSubtitle(document),
+            number=5, repeat=3)) / 5
+        sub_time = min(timeit.repeat(lambda: format_subtitle(document),
+            number=5, repeat=3)) / 5
+        print('%-6s config parse: %7.3fms  parse+read: %7.3fms  '
+            'subtitle parse: %7.2fms  parse+format: %7.2fms' % (name,
+                parse_time * 1000, stream_time * 1000, sub_parse_time * 1000,
+                sub_time * 1000))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
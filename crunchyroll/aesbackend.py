@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+AES-CBC backends for decrypting subtitles
+
+The fastest installed library is used by default, in the order cryptography,
+pycryptodome, then tlslite. tlslite only uses native code if it finds
+m2crypto or pycrypto, otherwise it's pure Python and a lot slower. Every
+backend returns the decrypted bytes with the padding left on, the zlib stream
+inside doesn't care.
+
+Example usage:
+    >>> from crunchyroll import aesbackend
+    >>> aesbackend.set_backend('tlslite')
+    >>> decrypter = SubtitleDecrypter(aes_backend='pycryptodome')
+"""
+
+import logging
+
+logger = logging.getLogger('crunchyroll.aesbackend')
+
+class CryptographyBackend(object):
+    name = 'cryptography'
+
+    def __init__(self):
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives.ciphers import Cipher, \
+            algorithms, modes
+        self._backend = default_backend()
+        self._cipher = Cipher
+        self._aes = algorithms.AES
+        self._cbc = modes.CBC
+
+    def decrypt(self, key, iv, data):
+        decryptor = self._cipher(self._aes(key), self._cbc(iv),
+            backend=self._backend).decryptor()
+        return decryptor.update(data) + decryptor.finalize()
+
+class PycryptodomeBackend(object):
+    name = 'pycryptodome'
+
+    def __init__(self):
+        try:
+            # pycryptodomex, installed alongside pycrypto
+            from Cryptodome.Cipher import AES
+        except ImportError:
+            from Crypto.Cipher import AES
+        self._aes = AES
+
+    def decrypt(self, key, iv, data):
+        return self._aes.new(key, self._aes.MODE_CBC, iv).decrypt(data)
+
+class TlsliteBackend(object):
+    name = 'tlslite'
+
+    def __init__(self):
+        from tlslite.utils.cipherfactory import createAES
+        self._create_aes = createAES
+
+    def decrypt(self, key, iv, data):
+        return bytes(self._create_aes(bytearray(key), bytearray(iv)).decrypt(
+            bytearray(data)))
+
+BACKENDS = {
+    CryptographyBackend.name:   CryptographyBackend,
+    PycryptodomeBackend.name:   PycryptodomeBackend,
+    TlsliteBackend.name:        TlsliteBackend,
+}
+
+# fastest first
+PREFERENCE = ('cryptography', 'pycryptodome', 'tlslite')
+
+def make_backend(backend):
+    """Get a backend instance
+
+    @param str|object backend   one of BACKENDS or a backend instance
+    @return object
+    @raises ImportError if the backend's library isn't installed
+    """
+    if not isinstance(backend, str):
+        return backend
+    try:
+        backend_cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError('Unknown AES backend: {0}'.format(backend))
+    return backend_cls()
+
+def _find_default_backend():
+    for name in PREFERENCE:
+        try:
+            return make_backend(name)
+        except ImportError:
+            continue
+
+_backend = _find_default_backend()
+
+def get_backend():
+    """
+    @return object  the backend used by decrypters that weren't given one
+    """
+    return _backend
+
+def set_backend(backend):
+    """Change the default backend
+
+    @param str|object backend   one of BACKENDS or a backend instance
+    @return object              the previous backend
+    """
+    global _backend
+    previous = _backend
+    _backend = make_backend(backend)
+    logger.debug('Using %s AES backend', _backend.name)
+    return previous
@@ -17,6 +17,7 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 import logging
+import time
 
 logger = logging.getLogger('crunchyroll.apis')
 
@@ -30,11 +31,35 @@ try:
 except Exception as err:
     logger.info('Couldnt disable urllib3 warnings: %s', err)
 
+from crunchyroll.apis.ratelimit import monotonic
+from crunchyroll.apis.deadline import get_remaining, check_deadline
+from crunchyroll.apis.errors import ApiTimeoutException, ApiNetworkException
+from crunchyroll.apis.streaming import JsonListStream, STREAM_CHUNK_SIZE
+from crunchyroll.jsonbackend import get_backend as get_json_backend
+
 class ApiInterface(object):
     """This will be the basis for the shared API interfaces once the Ajax and
     Web APIs have been implemented
     """
 
+    # crunchyroll.apis.pool.ConnectionPool shared between APIs, if any
+    _pool = None
+    # crunchyroll.apis.cache.ResponseCache for API method results, if any
+    _cache = None
+    # crunchyroll.apis.cache.HttpCache for raw responses, if any
+    _http_cache = None
+    # crunchyroll.apis.ratelimit.RateLimiter shared between APIs, if any
+    _rate_limiter = None
+    # the RateLimiter.FAMILY_* this API's requests count against
+    RATE_LIMIT_FAMILY = None
+    # crunchyroll.apis.retry.RetryPolicy for failed requests, if any
+    _retry_policy = None
+    # crunchyroll.apis.retry.CircuitBreaker shared between APIs, if any
+    _circuit_breaker = None
+    # crunchyroll.jsonbackend backend for this API's responses, None to use
+    # the current default
+    _json_backend = None
+
     @property
     def session_started(self):
         """Check if the API session has started
@@ -58,3 +83,245 @@ class ApiInterface(object):
         again
         """
         raise NotImplemented
+
+    def _get_cache_key(self, api_method, req_url, params):
+        """Get the response cache key for an API method request, or None if
+        the result shouldn't be cached
+        """
+        if self._cache is None or self._cache.get_ttl(api_method) is None:
+            return None
+        full_params = self._get_base_params()
+        full_params.update(params)
+        return self._cache.make_key(req_url, full_params)
+
+    def _cache_response(self, api_method, cache_key, response, size=0):
+        """Store an API method result in the response cache
+
+        @param str api_method
+        @param tuple cache_key
+        @param mixed response
+        @param int size     bytes of the response body the result came from
+        """
+        self._cache.set(cache_key, response,
+            self._cache.get_ttl(api_method), size)
+
+    def _decode_json(self, resp):
+        """Decode a JSON response straight from its body bytes, the result is
+        kept on the response so checking it before it goes in the HTTP cache
+        and handling it afterwards only decode it once
+
+        @param requests.Response resp
+        @return mixed
+        @raises ValueError if the body isn't valid JSON
+        """
+        try:
+            return resp._decoded_json
+        except AttributeError:
+            pass
+        backend = self._json_backend if self._json_backend is not None \
+            else get_json_backend()
+        resp._decoded_json = backend.loads(resp.content)
+        return resp._decoded_json
+
+    def _send_request(self, method, url, params=None, data=None, headers=None,
+            api_method=None, rate_limit_family=None, idempotent=None,
+            stream=False):
+        """Send a request with the connector, going through the HTTP cache if
+        the API method's responses can be cached
+
+        @param str method
+        @param str url
+        @param dict params
+        @param dict data
+        @param dict headers
+        @param str api_method   name of the API method the request is for
+        @param str rate_limit_family    overrides RATE_LIMIT_FAMILY
+        @param bool idempotent  if the request can be retried, None to go by
+                                    the HTTP method
+        @param bool stream      don't read the body before returning, the
+                                    HTTP cache is skipped
+        @return requests.Response
+        """
+        http_cache = self._http_cache
+        ttl = None if http_cache is None or stream \
+            else http_cache.get_ttl(api_method)
+        if ttl is None:
+            return self._send_uncached_request(method, url, params, data,
+                headers, rate_limit_family, idempotent, stream)
+
+        cache_key = http_cache.make_key(method, url,
+            params if data is None else data)
+        entry = http_cache.get(cache_key)
+        if entry is not None:
+            if entry.is_fresh:
+                return entry.to_response()
+            headers = dict(headers or {})
+            headers.update(entry.get_conditional_headers())
+        resp = self._send_uncached_request(method, url, params, data, headers,
+            rate_limit_family, idempotent)
+        if resp.status_code == 304 and entry is not None:
+            return http_cache.revalidated(cache_key, entry, ttl).to_response()
+        if resp.ok and self._is_cacheable_response(resp):
+            http_cache.set(cache_key, resp, ttl)
+        return resp
+
+    def _is_cacheable_response(self, resp):
+        """Check a successful response before it's stored in the HTTP cache,
+        APIs that report errors in the body should leave those out since the
+        cache is shared between sessions
+
+        @param requests.Response resp
+        @return bool
+        """
+        return True
+
+    def _send_uncached_request(self, method, url, params, data, headers,
+            rate_limit_family=None, idempotent=None, stream=False):
+        """Send a request with the connector, retrying transient failures if
+        the retry policy and the current deadline allow it
+
+        @return requests.Response
+        """
+        policy = self._retry_policy
+        can_retry = policy is not None and policy.can_retry(method, idempotent)
+        breaker = self._circuit_breaker
+        started = monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            check_deadline()
+            # the breaker sees each logical request once, not every attempt
+            if breaker is not None and attempt == 1:
+                breaker.before_request(url)
+            try:
+                resp = self._send_limited_request(method, url, params, data,
+                    headers, rate_limit_family, stream)
+            except requests.RequestException as err:
+                delay = self._get_retry_delay(can_retry, attempt, started)
+                if delay is None:
+                    timed_out = isinstance(err, requests.Timeout)
+                    self._record_failure(url, timed_out)
+                    if timed_out:
+                        raise ApiTimeoutException(err)
+                    raise
+                logger.info('Retrying %s %s in %.2fs after error: %s',
+                    method, url, delay, err)
+            else:
+                if not (can_retry and \
+                        policy.should_retry_status(resp.status_code)):
+                    if breaker is not None:
+                        breaker.record_response(url, resp.status_code)
+                    return resp
+                delay = self._get_retry_delay(can_retry, attempt, started,
+                    resp.headers.get('Retry-After'))
+                if delay is None:
+                    if breaker is not None:
+                        breaker.record_response(url, resp.status_code)
+                    return resp
+                logger.info('Retrying %s %s in %.2fs after response code: %d',
+                    method, url, delay, resp.status_code)
+                # let the connection go back to the pool
+                resp.close()
+            time.sleep(delay)
+
+    def _record_failure(self, url, timed_out=False):
+        """Tell the circuit breaker a request failed after its retries,
+        timeouts that only happened because the caller's deadline cut the
+        request short say nothing about the host so they aren't counted
+
+        @param str url
+        @param bool timed_out
+        """
+        breaker = self._circuit_breaker
+        if breaker is None:
+            return
+        if timed_out:
+            remaining = get_remaining()
+            if remaining is not None and remaining <= 0:
+                return
+        breaker.record_failure(url)
+
+    def _get_retry_delay(self, can_retry, attempt, started, retry_after=None):
+        """Get how long to wait before retrying, None if there isn't enough
+        time left before the current deadline
+        """
+        if not can_retry:
+            return None
+        delay = self._retry_policy.get_delay(attempt, monotonic() - started,
+            retry_after)
+        remaining = get_remaining()
+        if delay is not None and remaining is not None and delay >= remaining:
+            return None
+        return delay
+
+    def _get_request_timeout(self):
+        """Get the timeout for the next request, whatever is left of the
+        current deadline capped by the pool's own timeouts
+
+        @return float|tuple|None
+        @raises ApiTimeoutException if the deadline has already passed
+        """
+        remaining = check_deadline()
+        pool_timeout = None if self._pool is None else self._pool.timeout
+        if remaining is None or pool_timeout is None:
+            return remaining if remaining is not None else pool_timeout
+        return tuple(remaining if t is None else min(t, remaining) \
+            for t in pool_timeout)
+
+    def _send_limited_request(self, method, url, params, data, headers,
+            rate_limit_family=None, stream=False):
+        """Send a request with the connector, waiting on the rate limiter
+        first if there is one
+
+        A streamed request gives its concurrency slot back once the headers
+        have arrived, reading the body isn't limited.
+
+        @return requests.Response
+        """
+        if self._rate_limiter is None:
+            return self._connector.request(method, url, params=params,
+                data=data, headers=headers, timeout=self._get_request_timeout(),
+                stream=stream)
+        with self._rate_limiter.limit(rate_limit_family or \
+                self.RATE_LIMIT_FAMILY, get_remaining()) as slot:
+            resp = self._connector.request(method, url, params=params,
+                data=data, headers=headers, timeout=self._get_request_timeout(),
+                stream=stream)
+            slot.status_code = resp.status_code
+        return resp
+
+    def _send_stream_request(self, method, url, params=None, headers=None,
+            api_method=None):
+        """Send a request for a listing and parse the response as it's read
+
+        The request is sent right away, the returned iterator reads the body.
+
+        @return generator   elements of the response's data list
+        @raises ApiNetworkException
+        """
+        logger.debug('Sending streamed %s request "%s" with params: %r',
+            method, url, params)
+        try:
+            resp = self._send_request(method, url, params=params,
+                headers=headers, api_method=api_method, stream=True)
+        except requests.RequestException as err:
+            raise ApiNetworkException(err)
+        self._last_response = resp
+        return self._iter_stream(resp)
+
+    def _iter_stream(self, resp):
+        stream = JsonListStream(resp.iter_content(STREAM_CHUNK_SIZE))
+        try:
+            for item in stream:
+                yield item
+        except requests.RequestException as err:
+            raise ApiNetworkException(err)
+        finally:
+            resp.close()
+        # the list itself isn't kept, what's left of the envelope is
+        self._do_post_request_tasks(stream.envelope)
+
+    def _do_post_request_tasks(self, response_data):
+        """Handle actions that need to be done with every response
+        """
+        pass
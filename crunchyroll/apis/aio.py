@@ -0,0 +1,968 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+asyncio versions of the API classes
+
+The async classes are generated from the method declarations of the blocking
+API classes so they share method names, parameters and error handling, the
+only difference is that every API method is a coroutine. Requires python 3.5+
+and aiohttp.
+
+Example usage:
+    >>> async with AsyncMetaApi() as api:
+    ...     series = (await api.search_anime_series('Space Brothers'))[0]
+    ...     episodes = await api.list_media(series)
+"""
+
+import asyncio
+import functools
+import json
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+
+from crunchyroll.apis.android import AndroidApi
+from crunchyroll.apis.ajax import AjaxApi, is_read_only_method
+from crunchyroll.apis.android_manga import AndroidMangaApi
+from crunchyroll.apis.scraper import ScraperApi
+from crunchyroll.apis.meta import MetaApi
+from crunchyroll.apis.pipeline import SubtitlePipeline
+from crunchyroll.apis.cache import CachedResponse
+from crunchyroll.apis.ratelimit import RateLimiter, RateLimitSlot, monotonic
+from crunchyroll.apis.deadline import Deadline, check_deadline, \
+    get_remaining
+from crunchyroll.apis.singleflight import AsyncSingleFlight, make_request_key
+from crunchyroll.constants import META, AJAX, ANDROID, SCRAPER
+from crunchyroll.apis.errors import *
+from crunchyroll.columnar import MediaCollection
+from crunchyroll.models import *
+from crunchyroll.util import iteritems, decrypt_image_chunk, to_collection
+
+logger = logging.getLogger('crunchyroll.apis.aio')
+
+async def async_rate_limit(rate_limiter, family):
+    """Async version of `RateLimiter.limit`, waits without blocking the
+    event loop
+
+    @param crunchyroll.apis.ratelimit.RateLimiter rate_limiter
+    @param str family
+    @return crunchyroll.apis.ratelimit.RateLimitSlot
+    """
+    controller = rate_limiter.get_controller(family)
+    await controller.acquire_async()
+    try:
+        delay = rate_limiter.get_bucket(family).reserve(get_remaining())
+        if delay is None:
+            raise ApiTimeoutException(
+                'Timed out waiting for the {0} request rate'.format(family))
+        if delay > 0:
+            await asyncio.sleep(delay)
+    except BaseException:
+        controller.release()
+        raise
+    return RateLimitSlot(controller)
+
+class AsyncResponse(CachedResponse):
+    """The parts of requests.Response that the response handling shared with
+    the blocking APIs needs, built after the body has been read
+    """
+    pass
+
+class AsyncConnectorMixin(object):
+    """Manage the aiohttp session for an async API class
+
+    The aiohttp session has to be created inside a running event loop so it
+    is created on the first request, cookies loaded before then are held
+    until the session exists.
+    """
+
+    def __init__(self, *pargs, **kwargs):
+        self._pending_cookies = {}
+        # the HTTP cache is SQLite, its calls are run on this instead of
+        # blocking the event loop
+        self._cache_executor = None
+        super(AsyncConnectorMixin, self).__init__(*pargs, **kwargs)
+        self._single_flight = AsyncSingleFlight()
+
+    def _create_connector(self):
+        return None
+
+    def _get_connector(self):
+        if self._connector is None or self._connector.closed:
+            if self._pool is None:
+                self._connector = aiohttp.ClientSession()
+            else:
+                self._connector = aiohttp.ClientSession(
+                    connector=self._pool.get_async_connector(),
+                    connector_owner=False,
+                    timeout=self._pool.get_async_timeout())
+            if self._pending_cookies:
+                self._connector.cookie_jar.update_cookies(self._pending_cookies)
+        return self._connector
+
+    def _get_cookies(self):
+        if self._connector is None:
+            return dict(self._pending_cookies)
+        return dict((cookie.key, cookie.value) \
+            for cookie in self._connector.cookie_jar)
+
+    def _update_cookies(self, cookies):
+        if self._connector is None:
+            self._pending_cookies.update(cookies)
+        else:
+            self._connector.cookie_jar.update_cookies(cookies)
+
+    def _stringify_params(self, params):
+        """aiohttp is pickier than requests about param values
+        """
+        if params is None:
+            return None
+        return dict((k, v if isinstance(v, str) else str(v)) \
+            for k, v in iteritems(params) if v is not None)
+
+    async def _run_cache_call(self, func, *pargs):
+        if self._cache_executor is None:
+            # one thread, so only one database connection per API
+            self._cache_executor = ThreadPoolExecutor(max_workers=1)
+        return await asyncio.get_event_loop().run_in_executor(
+            self._cache_executor, functools.partial(func, *pargs))
+
+    async def _send_request(self, method, url, params=None, data=None,
+            headers=None, api_method=None, rate_limit_family=None,
+            idempotent=None):
+        """Send a request and read the whole response, going through the HTTP
+        cache if the API method's responses can be cached
+
+        @return AsyncResponse
+        """
+        http_cache = self._http_cache
+        ttl = None if http_cache is None else http_cache.get_ttl(api_method)
+        if ttl is None:
+            return await self._send_uncached_request(method, url, params,
+                data, headers, rate_limit_family, idempotent)
+
+        cache_key = http_cache.make_key(method, url,
+            params if data is None else data)
+        entry = await self._run_cache_call(http_cache.get, cache_key)
+        if entry is not None:
+            if entry.is_fresh:
+                return entry.to_response()
+            headers = dict(headers or {})
+            headers.update(entry.get_conditional_headers())
+        resp = await self._send_uncached_request(method, url, params, data,
+            headers, rate_limit_family, idempotent)
+        if resp.status_code == 304 and entry is not None:
+            entry = await self._run_cache_call(http_cache.revalidated,
+                cache_key, entry, ttl)
+            return entry.to_response()
+        if resp.ok and self._is_cacheable_response(resp):
+            await self._run_cache_call(http_cache.set, cache_key, resp, ttl)
+        return resp
+
+    async def _send_uncached_request(self, method, url, params, data, headers,
+            rate_limit_family=None, idempotent=None):
+        """Async version of `ApiInterface._send_uncached_request`
+        """
+        policy = self._retry_policy
+        can_retry = policy is not None and policy.can_retry(method, idempotent)
+        breaker = self._circuit_breaker
+        started = monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            # the deadline itself is enforced by `async_with_deadline`
+            check_deadline()
+            if breaker is not None and attempt == 1:
+                breaker.before_request(url)
+            try:
+                resp = await self._send_limited_request(method, url, params,
+                    data, headers, rate_limit_family)
+            except ApiNetworkException as err:
+                delay = self._get_retry_delay(can_retry, attempt, started)
+                if delay is None:
+                    self._record_failure(url,
+                        isinstance(err, ApiTimeoutException))
+                    raise
+                logger.info('Retrying %s %s in %.2fs after error: %s',
+                    method, url, delay, err)
+            else:
+                if not (can_retry and \
+                        policy.should_retry_status(resp.status_code)):
+                    if breaker is not None:
+                        breaker.record_response(url, resp.status_code)
+                    return resp
+                delay = self._get_retry_delay(can_retry, attempt, started,
+                    resp.headers.get('Retry-After'))
+                if delay is None:
+                    if breaker is not None:
+                        breaker.record_response(url, resp.status_code)
+                    return resp
+                logger.info('Retrying %s %s in %.2fs after response code: %d',
+                    method, url, delay, resp.status_code)
+            await asyncio.sleep(delay)
+
+    async def _send_limited_request(self, method, url, params, data, headers,
+            rate_limit_family=None):
+        if self._rate_limiter is None:
+            return await self._read_response(method, url, params, data,
+                headers)
+        with await async_rate_limit(self._rate_limiter,
+                rate_limit_family or self.RATE_LIMIT_FAMILY) as slot:
+            resp = await self._read_response(method, url, params, data,
+                headers)
+            slot.status_code = resp.status_code
+        return resp
+
+    async def _read_response(self, method, url, params, data, headers):
+        connector = self._get_connector()
+        try:
+            async with connector.request(method, url,
+                    params=self._stringify_params(params),
+                    data=self._stringify_params(data),
+                    headers=headers) as resp:
+                content = await resp.read()
+        except asyncio.TimeoutError as err:
+            # aiohttp's timeouts are TimeoutErrors, same exception as a
+            # timed out requests.Response in the blocking APIs
+            raise ApiTimeoutException(err)
+        except aiohttp.ClientError as err:
+            raise ApiNetworkException(err)
+        logger.debug('Received response code: %d', resp.status)
+        return AsyncResponse(resp.status, resp.headers, content)
+
+    async def close(self):
+        if self._connector is not None:
+            await self._connector.close()
+        if self._cache_executor is not None:
+            await self._run_cache_call(self._http_cache.close)
+            self._cache_executor.shutdown(wait=False)
+            self._cache_executor = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+def build_async_api_methods(async_cls, method_factory):
+    """Add async versions of every API method declared on `async_cls`'s
+    blocking parent class(es)
+
+    @param type async_cls
+    @param callable method_factory  async version of the API method decorator
+    @return type
+    """
+    for base_cls in reversed(async_cls.__mro__[1:]):
+        for name, attr in iteritems(vars(base_cls)):
+            method_args = getattr(attr, 'api_method_args', None)
+            if method_args is not None:
+                setattr(async_cls, name,
+                    method_factory(*method_args)(attr.api_method_func))
+    return async_cls
+
+def _check_stream_kwarg(streamable, kwargs):
+    """Streamed listings aren't supported by the async APIs, make sure a
+    `stream` kwarg doesn't get sent along as a request param instead
+    """
+    if streamable and kwargs.pop('stream', False):
+        raise ValueError('Streamed listings are not supported by the '
+            'async APIs')
+
+def make_async_android_api_method(req_method, secure=True, version=0,
+        streamable=False):
+    """Async version of `make_android_api_method`
+    """
+    def outer_func(func):
+        @functools.wraps(func)
+        async def inner_func(self, **kwargs):
+            _check_stream_kwarg(streamable, kwargs)
+            req_url = self._build_request_url(secure, func.__name__, version)
+            cache_key = self._get_cache_key(func.__name__, req_url, kwargs)
+            if cache_key is not None:
+                try:
+                    return self._cache.get(cache_key)
+                except KeyError:
+                    pass
+            req_func = self._build_request(req_method, req_url, params=kwargs,
+                api_method=func.__name__)
+            if req_method == self.METHOD_GET:
+                # identical concurrent reads can share a single request
+                response, size = await self._single_flight.do(
+                    make_request_key(req_url, kwargs), req_func)
+            else:
+                response, size = await req_func()
+            func(self, response)
+            if cache_key is not None:
+                self._cache_response(func.__name__, cache_key, response,
+                    size)
+            return response
+        return inner_func
+    return outer_func
+
+def make_async_ajax_api_method(req_method, secure=False):
+    """Async version of `make_ajax_api_method`
+    """
+    def outer_func(func):
+        read_only = is_read_only_method(func.__name__)
+        @functools.wraps(func)
+        async def inner_func(self, **kwargs):
+            kwargs['req'] = 'RpcApi' + func.__name__
+            kwargs['current_page'] = AJAX.API_CURRENT_PAGE
+            req_url = self._build_request_url(secure)
+            req_func = self._build_request(req_method, req_url, secure,
+                params=kwargs, api_method=func.__name__)
+            if read_only:
+                # identical concurrent reads can share a single response
+                resp = await self._single_flight.do(
+                    make_request_key(req_url, kwargs), req_func)
+            else:
+                resp = await req_func()
+            # the declared method only needs something to call that gives
+            # it the response, it has already been fetched by now
+            response = func(self, lambda: resp)
+            self._last_response = response
+            return self._handle_response(response)
+        return inner_func
+    return outer_func
+
+def make_async_manga_api_method(req_method, secure=False, method_name=None,
+        streamable=False):
+    """Async version of `build_api_method`
+    """
+    def outer_func(func):
+        @functools.wraps(func)
+        async def inner_func(self, **kwargs):
+            _check_stream_kwarg(streamable, kwargs)
+            api_method = method_name if method_name is not None else func.__name__
+            req_url = self._build_request_url(secure, api_method)
+            cache_key = self._get_cache_key(api_method, req_url, kwargs)
+            if cache_key is not None:
+                try:
+                    return self._cache.get(cache_key)
+                except KeyError:
+                    pass
+            req_func = self._build_request(req_method, req_url, params=kwargs,
+                api_method=api_method)
+            if req_method == self.METHOD_GET:
+                # identical concurrent reads can share a single request
+                response, size = await self._single_flight.do(
+                    make_request_key(req_url, kwargs), req_func)
+            else:
+                response, size = await req_func()
+            func(self, response)
+            if cache_key is not None:
+                self._cache_response(api_method, cache_key, response, size)
+            return response
+        return inner_func
+    return outer_func
+
+class AsyncAndroidApi(AsyncConnectorMixin, AndroidApi):
+    """asyncio version of `AndroidApi`
+    """
+
+    def _build_request(self, method, url, params=None, api_method=None):
+        full_params = self._get_base_params()
+        if params is not None:
+            full_params.update(params)
+
+        async def do_request():
+            logger.debug('Sending %s request "%s" with params: %r',
+                method, url, full_params)
+            resp = await self._send_request(method, url, params=full_params,
+                headers=self._request_headers, api_method=api_method)
+            try:
+                resp_json = self._decode_json(resp)
+            except ValueError:
+                raise ApiBadResponseException(resp.content)
+            data = self._handle_response_json(resp_json, resp.content)
+            self._last_response = resp
+            return data, len(resp.content)
+        return do_request
+
+    def get_state(self):
+        state = {
+            'state_params': self._state_params,
+            'cookies': self._get_cookies(),
+            'user_data': self._user_data,
+        }
+        return json.dumps(state)
+
+    def set_state(self, state):
+        loaded_state = json.loads(state)
+        self._state_params.update(loaded_state['state_params'])
+        self._update_cookies(loaded_state['cookies'])
+        self._user_data = loaded_state['user_data']
+
+build_async_api_methods(AsyncAndroidApi, make_async_android_api_method)
+
+class AsyncAjaxApi(AsyncConnectorMixin, AjaxApi):
+    """asyncio version of `AjaxApi`
+    """
+
+    def _build_request(self, req_method, req_url, secure, params,
+            api_method=None):
+        async def req_func():
+            logger.debug('Sending %s request to "%s" with params: %r',
+                req_method, req_url, params)
+            if secure and req_method == self.METHOD_POST:
+                # wouldn't make sense to send data on a GET request
+                return await self._send_request(req_method, req_url,
+                    data=params, api_method=api_method, idempotent=False)
+            else:
+                return await self._send_request(req_method, req_url,
+                    params=params, api_method=api_method,
+                    idempotent=is_read_only_method(api_method))
+        return req_func
+
+    @property
+    def logged_in(self):
+        return AJAX.COOKIE_USERID in self._get_cookies()
+
+    def get_state(self):
+        state_string = json.dumps(self._get_cookies())
+        logger.debug('Generated state: %s', state_string)
+        return state_string
+
+    def set_state(self, state):
+        logger.debug('Loading state: %s', state)
+        self._update_cookies(json.loads(state))
+
+build_async_api_methods(AsyncAjaxApi, make_async_ajax_api_method)
+
+class AsyncAndroidMangaApi(AsyncConnectorMixin, AndroidMangaApi):
+    """asyncio version of `AndroidMangaApi`
+    """
+
+    def _build_request(self, method, url, params=None, api_method=None):
+        full_params = self._get_base_params()
+        if params is not None:
+            full_params.update(params)
+
+        async def do_request():
+            logger.debug('Sending %s request "%s" with params: %r',
+                method, url, full_params)
+            resp = await self._send_request(method, url, params=full_params,
+                headers=self._request_headers, api_method=api_method)
+            try:
+                resp_json = self._decode_json(resp)
+            except ValueError:
+                raise ApiBadResponseException(resp.content)
+            data = self._handle_response_json(resp_json, resp.content, method)
+            self._last_response = resp
+            return data, len(resp.content)
+        return do_request
+
+    get_state = AsyncAndroidApi.get_state
+    set_state = AsyncAndroidApi.set_state
+
+build_async_api_methods(AsyncAndroidMangaApi, make_async_manga_api_method)
+
+class AsyncScraperApi(ScraperApi):
+    """asyncio version of `ScraperApi`, `connector` should be an async API
+    instance to borrow the HTTP session from
+    """
+
+    async def get_media_formats(self, media_id):
+        url = self._build_media_url(media_id)
+        formats = {}
+
+        for format, param in iteritems(SCRAPER.VIDEO.FORMAT_PARAMS):
+            resp = await self._connector._send_request('GET', url,
+                params={param: '1'},
+                rate_limit_family=RateLimiter.FAMILY_SCRAPER)
+            if not resp.ok:
+                continue
+            match = self._search_media_format(resp)
+            if match:
+                formats[format] = match
+        return formats
+
+def async_with_deadline(func):
+    """Async version of `with_deadline`, the whole call is cancelled once
+    the time is up
+    """
+    @functools.wraps(func)
+    async def inner_func(self, *pargs, **kwargs):
+        timeout = kwargs.pop('timeout', None)
+        if timeout is None:
+            timeout = self._timeout
+        with Deadline(timeout):
+            if timeout is None:
+                return await func(self, *pargs, **kwargs)
+            try:
+                return await asyncio.wait_for(func(self, *pargs, **kwargs),
+                    timeout)
+            except asyncio.TimeoutError:
+                raise ApiTimeoutException(
+                    '{0} timed out after {1}s'.format(func.__name__, timeout))
+    return inner_func
+
+def async_require_session_started(func):
+    """Async version of `require_session_started`
+    """
+    @functools.wraps(func)
+    async def inner_func(self, *pargs, **kwargs):
+        if not self.session_started:
+            logger.info('Starting session for required meta method')
+            # concurrent calls on a new API share one session
+            await self._session_flight.do('start_session',
+                self.start_session)
+        return await func(self, *pargs, **kwargs)
+    return inner_func
+
+def async_require_android_logged_in(func):
+    """Async version of `require_android_logged_in`
+    """
+    @functools.wraps(func)
+    @async_require_session_started
+    async def inner_func(self, *pargs, **kwargs):
+        if not self._android_api.logged_in:
+            logger.info('Logging into android API for required meta method')
+            if not self.has_credentials:
+                raise ApiLoginFailure(
+                    'Login is required but no credentials were provided')
+            await self._session_flight.do('android_login',
+                lambda: self._android_api.login(
+                    account=self._state['username'],
+                    password=self._state['password']))
+        return await func(self, *pargs, **kwargs)
+    return inner_func
+
+def async_optional_android_logged_in(func):
+    """Async version of `optional_android_logged_in`
+    """
+    @functools.wraps(func)
+    @async_require_session_started
+    async def inner_func(self, *pargs, **kwargs):
+        if not self._android_api.logged_in and self.has_credentials:
+            logger.info('Logging into android API for optional meta method')
+            await self._session_flight.do('android_login',
+                lambda: self._android_api.login(
+                    account=self._state['username'],
+                    password=self._state['password']))
+        return await func(self, *pargs, **kwargs)
+    return inner_func
+
+def async_optional_manga_logged_in(func):
+    """Async version of `optional_manga_logged_in`
+    """
+    @functools.wraps(func)
+    @async_require_session_started
+    async def inner_func(self, *pargs, **kwargs):
+        if not self._manga_api.logged_in and self.has_credentials:
+            logger.info('Logging into android manga API for optional meta method')
+            await self._session_flight.do('manga_login',
+                lambda: self._manga_api.cr_login(
+                    account=self._state['username'],
+                    password=self._state['password']))
+        return await func(self, *pargs, **kwargs)
+    return inner_func
+
+def async_optional_ajax_logged_in(func):
+    """Async version of `optional_ajax_logged_in`
+    """
+    @functools.wraps(func)
+    async def inner_func(self, *pargs, **kwargs):
+        if not self._ajax_api.logged_in and self.has_credentials:
+            logger.info('Logging into AJAX API for optional meta method')
+            await self._session_flight.do('ajax_login',
+                lambda: self._ajax_api.User_Login(
+                    name=self._state['username'],
+                    password=self._state['password']))
+        return await func(self, *pargs, **kwargs)
+    return inner_func
+
+def async_return_collection(collection_type):
+    """Async version of `return_collection`
+    """
+    def outer_func(func):
+        @functools.wraps(func)
+        async def inner_func(self, *pargs, **kwargs):
+            result = await func(self, *pargs, **kwargs)
+            return to_collection(collection_type, result)
+        return inner_func
+    return outer_func
+
+async def async_iter_pages(fetch_page, page_size, limit=None, prefetch=True):
+    """Async version of `crunchyroll.util.iter_pages`, the next page is
+    fetched as a separate task while the current one is being consumed
+    """
+    def get_page_size(offset):
+        if limit is None:
+            return page_size
+        return min(page_size, limit - offset)
+
+    offset = 0
+    if get_page_size(offset) <= 0:
+        return
+    page = await fetch_page(offset, get_page_size(offset))
+    next_page = None
+    try:
+        while page:
+            requested = get_page_size(offset)
+            offset += len(page)
+            next_page = None
+            if len(page) >= requested and get_page_size(offset) > 0:
+                next_page = fetch_page(offset, get_page_size(offset))
+                if prefetch:
+                    next_page = asyncio.ensure_future(next_page)
+            for item in page:
+                yield item
+            if next_page is None:
+                break
+            page = await next_page
+            next_page = None
+    finally:
+        if next_page is not None:
+            if prefetch:
+                next_page.cancel()
+            else:
+                next_page.close()
+
+class AsyncMetaApi(MetaApi):
+    """asyncio version of `MetaApi`, every method that talks to the network is
+    a coroutine
+    """
+
+    _ajax_api_class     = AsyncAjaxApi
+    _android_api_class  = AsyncAndroidApi
+    _manga_api_class    = AsyncAndroidMangaApi
+
+    def __init__(self, *pargs, **kwargs):
+        # session starts and logins, shared by the calls that need them
+        self._session_flight = AsyncSingleFlight()
+        super(AsyncMetaApi, self).__init__(*pargs, **kwargs)
+
+    async def close(self):
+        await asyncio.gather(
+            self._ajax_api.close(),
+            self._android_api.close(),
+            self._manga_api.close())
+        if self._pool.async_connector is not None:
+            await self._pool.async_connector.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @async_with_deadline
+    @async_optional_android_logged_in
+    async def is_premium(self, media_type):
+        return self._android_api.is_premium(media_type)
+
+    @async_with_deadline
+    async def start_session(self):
+        await asyncio.gather(
+            self._android_api.start_session(),
+            self._manga_api.cr_start_session())
+        return self.session_started
+
+    @async_with_deadline
+    @async_require_session_started
+    async def login(self, username, password):
+        state_snapshot = self._state.copy()
+        try:
+            await self._ajax_api.User_Login(name=username, password=password)
+            await self._android_api.login(account=username, password=password)
+            await self._manga_api.cr_login(account=username, password=password)
+        except Exception as err:
+            # something went wrong, rollback
+            self._state = state_snapshot
+            raise err
+        self._state['username'] = username
+        self._state['password'] = password
+        return self.logged_in
+
+    @async_with_deadline
+    @async_optional_android_logged_in
+    @async_return_collection(Series)
+    async def list_anime_series(self, sort=META.SORT_ALPHA, limit=META.MAX_SERIES, offset=0,
+            fields=None):
+        result = await self._android_api.list_series(
+            media_type=ANDROID.MEDIA_TYPE_ANIME,
+            filter=sort,
+            limit=limit,
+            offset=offset,
+            **self._get_fields_param(fields))
+        return self._project(Series, result, fields)
+
+    @async_with_deadline
+    @async_optional_android_logged_in
+    @async_return_collection(Series)
+    async def list_drama_series(self, sort=META.SORT_ALPHA, limit=META.MAX_SERIES, offset=0,
+            fields=None):
+        result = await self._android_api.list_series(
+            media_type=ANDROID.MEDIA_TYPE_DRAMA,
+            filter=sort,
+            limit=limit,
+            offset=offset,
+            **self._get_fields_param(fields))
+        return self._project(Series, result, fields)
+
+    def iter_anime_series(self, sort=META.SORT_ALPHA, page_size=META.PAGE_SIZE,
+            limit=None, prefetch=True, timeout=None, fields=None):
+        return async_iter_pages(
+            lambda offset, limit: self.list_anime_series(sort=sort,
+                limit=limit, offset=offset, timeout=timeout, fields=fields),
+            page_size, limit, prefetch)
+
+    def iter_drama_series(self, sort=META.SORT_ALPHA, page_size=META.PAGE_SIZE,
+            limit=None, prefetch=True, timeout=None, fields=None):
+        return async_iter_pages(
+            lambda offset, limit: self.list_drama_series(sort=sort,
+                limit=limit, offset=offset, timeout=timeout, fields=fields),
+            page_size, limit, prefetch)
+
+    @async_with_deadline
+    @async_require_session_started
+    @async_return_collection(Series)
+    async def list_manga_series(self, filter=None, content_type='jp_manga'):
+        return await self._manga_api.list_series(filter=filter,
+            content_type=content_type)
+
+    @async_with_deadline
+    @async_optional_android_logged_in
+    @async_return_collection(Series)
+    async def search_anime_series(self, query_string, fields=None):
+        result = await self._android_api.list_series(
+            media_type=ANDROID.MEDIA_TYPE_ANIME,
+            filter=ANDROID.FILTER_PREFIX + query_string,
+            **self._get_fields_param(fields))
+        return self._project(Series, result, fields)
+
+    @async_with_deadline
+    @async_optional_android_logged_in
+    @async_return_collection(Series)
+    async def search_drama_series(self, query_string, fields=None):
+        result = await self._android_api.list_series(
+            media_type=ANDROID.MEDIA_TYPE_DRAMA,
+            filter=ANDROID.FILTER_PREFIX + query_string,
+            **self._get_fields_param(fields))
+        return self._project(Series, result, fields)
+
+    @async_with_deadline
+    @async_optional_manga_logged_in
+    @async_return_collection(Series)
+    async def search_manga_series(self, query_string):
+        result = await self._manga_api.list_series()
+        return [series for series in result \
+            if series['locale']['enUS']['name'].lower().startswith(
+                query_string.lower())]
+
+    @async_with_deadline
+    @async_optional_android_logged_in
+    @async_return_collection(Media)
+    async def list_media(self, series, sort=META.SORT_DESC, limit=META.MAX_MEDIA, offset=0,
+            fields=None):
+        params = {
+            'sort': sort,
+            'offset': offset,
+            'limit': limit,
+        }
+        params.update(self._get_series_query_dict(series))
+        params.update(self._get_fields_param(fields))
+        result = await self._android_api.list_media(**params)
+        return self._project(Media, result, fields)
+
+    @async_with_deadline
+    @async_optional_android_logged_in
+    async def list_media_collection(self, series, sort=META.SORT_DESC,
+            limit=META.MAX_MEDIA, offset=0, fields=None):
+        params = {
+            'sort': sort,
+            'offset': offset,
+            'limit': limit,
+        }
+        params.update(self._get_series_query_dict(series))
+        params.update(self._get_fields_param(fields))
+        return MediaCollection(await self._android_api.list_media(**params))
+
+    def iter_media(self, series, sort=META.SORT_DESC, page_size=META.PAGE_SIZE,
+            limit=None, prefetch=True, timeout=None, fields=None):
+        return async_iter_pages(
+            lambda offset, limit: self.list_media(series, sort=sort,
+                limit=limit, offset=offset, timeout=timeout, fields=fields),
+            page_size, limit, prefetch)
+
+    @async_with_deadline
+    @async_optional_manga_logged_in
+    @async_return_collection(Chapter)
+    async def list_chapters(self, series):
+        if self.logged_in:
+            result = await self._manga_api.list_chapters(
+                series_id=series.series_id, user_id=self._manga_api._user_data['user_id'])
+        else:
+            result = await self._manga_api.list_chapters(series_id=series.series_id)
+        return result['chapters']
+
+    @async_with_deadline
+    @async_optional_manga_logged_in
+    @async_return_collection(Page)
+    async def list_pages(self, chapter):
+        result = await self._manga_api.list_chapter(chapter_id=chapter.chapter_id)
+        return result['pages']
+
+    @async_with_deadline
+    @async_optional_manga_logged_in
+    async def get_page_stream(self, page, locale='enUS'):
+        """Get the decrypted page image
+
+        @return bytes
+        """
+        resp = await self._manga_api._send_request('GET',
+            page.locale[locale].encrypted_composed_image_url)
+        return decrypt_image_chunk(resp.content)
+
+    @async_with_deadline
+    @async_optional_android_logged_in
+    @async_return_collection(Media)
+    async def search_media(self, series, query_string, fields=None):
+        params = {
+            'sort': ANDROID.FILTER_PREFIX + query_string,
+        }
+        params.update(self._get_series_query_dict(series))
+        params.update(self._get_fields_param(fields))
+        result = await self._android_api.list_media(**params)
+        return self._project(Media, result, fields)
+
+    @async_with_deadline
+    @async_optional_ajax_logged_in
+    async def get_media_stream(self, media_item, format, quality):
+        result = await self._ajax_api.VideoPlayer_GetStandardConfig(
+            media_id=media_item.media_id,
+            video_format=format,
+            video_quality=quality)
+        return MediaStream(result)
+
+    @async_with_deadline
+    @async_optional_ajax_logged_in
+    async def get_stream_info(self, media_item, format, quality):
+        result = await self._ajax_api.VideoEncode_GetStreamInfo(
+            media_id=media_item.media_id,
+            video_format=format,
+            video_encode_quality=quality)
+        return StreamInfo(result)
+
+    @async_with_deadline
+    @async_return_collection(SubtitleStub)
+    async def get_subtitle_stubs(self, media_item):
+        result = await self._ajax_api.Subtitle_GetListing(media_id=media_item.media_id)
+        return XmlModel(result)['subtitle']
+
+    @async_with_deadline
+    async def unfold_subtitle_stub(self, subtitle_stub):
+        return Subtitle(await self._ajax_api.Subtitle_GetXml(
+            subtitle_script_id=int(subtitle_stub.id)))
+
+    @async_with_deadline
+    @async_optional_ajax_logged_in
+    async def get_stream_formats(self, media_item):
+        scraper = AsyncScraperApi(self._ajax_api)
+        return await scraper.get_media_formats(media_item.media_id)
+
+    @async_with_deadline
+    @async_require_android_logged_in
+    @async_return_collection(Series)
+    async def list_queue(self, media_types=[META.TYPE_ANIME, META.TYPE_DRAMA]):
+        result = await self._android_api.queue(media_types='|'.join(media_types))
+        return [queue_item['series'] for queue_item in result]
+
+    @async_with_deadline
+    @async_require_android_logged_in
+    async def add_to_queue(self, series):
+        return await self._android_api.add_to_queue(series_id=series.series_id)
+
+    @async_with_deadline
+    @async_require_android_logged_in
+    async def remove_from_queue(self, series):
+        return await self._android_api.remove_from_queue(series_id=series.series_id)
+
+    async def iter_subtitles(self, media_items, languages=None,
+            formats=('srt',), fetch_workers=META.SUBTITLE_FETCH_WORKERS,
+            processes=None, max_pending=META.SUBTITLE_MAX_PENDING,
+            store=None):
+        """Async version of `MetaApi.iter_subtitles`, an async generator
+
+        The pipeline runs the same way, on its own threads and worker
+        processes, and its threads run the requests on this event loop.
+
+        Example usage:
+            >>> async for result in api.iter_subtitles(episodes):
+            ...     save(result.media, result.subtitles['srt'])
+
+        @param iterable<crunchyroll.models.Media> media_items   not an async
+                                            iterable, it's read on the
+                                            pipeline's thread
+        """
+        loop = asyncio.get_event_loop()
+        def on_loop(coroutine_func):
+            def call(arg):
+                return asyncio.run_coroutine_threadsafe(coroutine_func(arg),
+                    loop).result()
+            return call
+        results = SubtitlePipeline(on_loop(self.get_subtitle_stubs),
+            on_loop(self.unfold_subtitle_stub), formats=formats,
+            languages=languages, fetch_workers=fetch_workers,
+            processes=processes, max_pending=max_pending,
+            store=store).run(media_items)
+        # one thread, so the pipeline is never resumed and closed at once
+        driver = ThreadPoolExecutor(max_workers=1)
+        finished = object()
+        try:
+            while True:
+                result = await loop.run_in_executor(driver, next, results,
+                    finished)
+                if result is finished:
+                    break
+                yield result
+        finally:
+            driver.submit(results.close)
+            driver.shutdown(wait=False)
+
+    def _project(self, model_cls, items, fields):
+        # reading an attribute can't wait for a request here, so the models
+        # raise FieldNotLoadedError until they're passed to `hydrate`
+        if fields is None:
+            return items
+        loaded_fields = model_cls.get_loaded_fields(
+            self._with_id_fields(fields))
+        return [model_cls(item, loaded_fields) for item in items]
+
+    @async_with_deadline
+    @async_optional_android_logged_in
+    async def hydrate(self, models):
+        """Fill in all the fields of models that were fetched with a field set,
+        `hydrate_workers` of them at a time
+
+        @param list<crunchyroll.models.Media|crunchyroll.models.Series> models
+        @return list    the same models
+        """
+        semaphore = asyncio.Semaphore(max(1, self._hydrate_workers))
+        async def hydrate_model(model):
+            async with semaphore:
+                data = await self._android_api.info(
+                    **self._get_info_params(model))
+            model._set_fields(data)
+        await asyncio.gather(*[hydrate_model(model) for model in models \
+            if model.loaded_fields is not None])
+        return models
@@ -18,34 +18,58 @@
 
 import json
 import logging
+import functools
 
 import requests
 
 from crunchyroll.apis import ApiInterface
 from crunchyroll.constants import AJAX
 from crunchyroll.apis.errors import *
+from crunchyroll.apis.ratelimit import RateLimiter
+from crunchyroll.apis.retry import RetryPolicy, CircuitBreaker
+from crunchyroll.apis.singleflight import SingleFlight, make_request_key
 
 logger = logging.getLogger('crunchyroll.apis.ajax')
 
+# actions (the part after the class name in `<Class>_<Action>`) that only read
+READ_ONLY_ACTION_PREFIXES = ('Get', 'List')
+
+def is_read_only_method(api_method):
+    """Check if an AJAX API method only reads, the endpoints are all POSTs so
+    the HTTP method doesn't say whether a request is safe to retry or share
+    with identical concurrent requests
+
+    @param str api_method   like "Subtitle_GetXml"
+    @return bool
+    """
+    if api_method is None:
+        return False
+    return api_method.partition('_')[2].startswith(READ_ONLY_ACTION_PREFIXES)
+
 def make_ajax_api_method(req_method, secure=False):
     def outer_func(func):
+        read_only = is_read_only_method(func.__name__)
+        @functools.wraps(func)
         def inner_func(self, **kwargs):
             kwargs['req'] = 'RpcApi' + func.__name__
             kwargs['current_page'] = AJAX.API_CURRENT_PAGE
             req_url = self._build_request_url(secure)
-            req_func = self._build_request(req_method, req_url, secure, params=kwargs)
-            try:
-                response = func(self, req_func)
-                self._last_response = response
-            except ApiLoginFailure as err:
-                raise err
-            except Exception as err: # TODO: make this more specific
-                logger.warn('Caught exception of class: %s', err.__class__.__name__)
-                raise ApiNetworkException(err)
-            if not (response.ok and response.headers['Content-Type'] == 'text/xml'):
-                raise ApiBadResponseException(response)
-            else:
-                return response.content
+            req_func = self._build_request(req_method, req_url, secure,
+                params=kwargs, api_method=func.__name__)
+            if read_only:
+                # identical concurrent reads can share a single response
+                req_func = functools.partial(self._single_flight.do,
+                    make_request_key(req_url, kwargs), req_func)
+            # network errors have already been turned into
+            # ApiNetworkException by the request func, anything else is
+            # either an API error or a bug and should be left alone
+            response = func(self, req_func)
+            self._last_response = response
+            return self._handle_response(response)
+        # keep the declaration around so other request styles (like the
+        # asyncio APIs) can build their own version of the method from it
+        inner_func.api_method_args = (req_method, secure)
+        inner_func.api_method_func = func
         return inner_func
     return outer_func
 
@@ -56,30 +80,63 @@ class AjaxApi(ApiInterface):
     METHOD_POST = 'POST'
     METHOD_GET  = 'GET'
 
-    def __init__(self, state=None):
-        self._connector = requests.Session()
+    RATE_LIMIT_FAMILY = RateLimiter.FAMILY_AJAX
+
+    def __init__(self, state=None, pool=None, http_cache=None,
+            rate_limiter=None, retry_policy=None, circuit_breaker=None):
+        self._pool = pool
+        self._http_cache = http_cache
+        self._rate_limiter = rate_limiter
+        self._retry_policy = retry_policy if retry_policy is not None \
+            else RetryPolicy()
+        self._circuit_breaker = circuit_breaker if circuit_breaker is not None \
+            else CircuitBreaker()
+        self._single_flight = SingleFlight()
+        self._connector = self._create_connector()
         self._last_response = None
         if state is not None:
             self.set_state(state)
 
+    def _create_connector(self):
+        """Create the HTTP session used for requests
+        """
+        session = requests.Session()
+        if self._pool is not None:
+            self._pool.mount(session)
+        return session
+
     def _build_request_url(self, secure):
         proto = AJAX.PROTOCOL_SECURE if secure else AJAX.PROTOCOL_INSECURE
         return AJAX.API_URL.format(protocol=proto)
 
-    def _build_request(self, req_method, req_url, secure, params):
+    def _handle_response(self, response):
+        """Make sure we actually got an XML document back
+
+        @param requests.Response response
+        @return str
+        """
+        if not (response.ok and response.headers['Content-Type'] == 'text/xml'):
+            raise ApiBadResponseException(response)
+        return response.content
+
+    def _is_cacheable_response(self, resp):
+        # error pages aren't XML
+        return resp.headers.get('Content-Type') == 'text/xml'
+
+    def _build_request(self, req_method, req_url, secure, params,
+            api_method=None):
         def req_func():
             logger.debug('Sending %s request to "%s" with params: %r',
                 req_method, req_url, params)
-            try:
-                func = getattr(self._connector, req_method.lower())
-            except AttributeError:
-                raise ApiException('Invalid request method')
             try:
                 if secure and req_method == self.METHOD_POST:
                     # wouldn't make sense to send data on a GET request
-                    resp = func(req_url, data=params)
+                    resp = self._send_request(req_method, req_url, data=params,
+                        api_method=api_method, idempotent=False)
                 else:
-                    resp = func(req_url, params=params)
+                    resp = self._send_request(req_method, req_url,
+                        params=params, api_method=api_method,
+                        idempotent=is_read_only_method(api_method))
             except requests.RequestException as err:
                 raise ApiNetworkException(err)
             logger.debug('Received response code: %d', resp.status_code)
@@ -19,28 +19,65 @@
 import locale
 import json
 import logging
+import functools
 
 import requests
 
 from crunchyroll.apis import ApiInterface
 from crunchyroll.constants import ANDROID
 from crunchyroll.apis.errors import *
+from crunchyroll.apis.ratelimit import RateLimiter
+from crunchyroll.apis.retry import RetryPolicy, CircuitBreaker
+from crunchyroll.apis.singleflight import SingleFlight, make_request_key
+from crunchyroll.jsonbackend import make_backend as make_json_backend
 from crunchyroll.util import iteritems
 
 logger = logging.getLogger('crunchyroll.apis.android')
 
-def make_android_api_method(req_method, secure=True, version=0):
+def make_android_api_method(req_method, secure=True, version=0,
+        streamable=False):
     """Turn an AndroidApi's method into a function that builds the request,
     sends it, then passes the response to the actual method. Should be used
     as a decorator.
+
+    Streamable methods return a list, and also take a `stream` kwarg: if it's
+    true they return an iterator over the items instead, parsed as the
+    response is read (see crunchyroll.apis.streaming), without going through
+    the caches. An error response raises ApiError from the iterator, possibly
+    after some items have already been yielded.
     """
     def outer_func(func):
+        @functools.wraps(func)
         def inner_func(self, **kwargs):
             req_url = self._build_request_url(secure, func.__name__, version)
-            req_func = self._build_request(req_method, req_url, params=kwargs)
-            response = req_func()
+            if streamable and kwargs.pop('stream', False):
+                return self._send_stream_request(req_method, req_url,
+                    params=self._get_full_params(kwargs),
+                    headers=self._request_headers, api_method=func.__name__)
+            cache_key = self._get_cache_key(func.__name__, req_url, kwargs)
+            if cache_key is not None:
+                try:
+                    return self._cache.get(cache_key)
+                except KeyError:
+                    pass
+            req_func = self._build_request(req_method, req_url, params=kwargs,
+                api_method=func.__name__)
+            if req_method == self.METHOD_GET:
+                # identical concurrent reads can share a single request
+                response, size = self._single_flight.do(
+                    make_request_key(req_url, kwargs), req_func)
+            else:
+                response, size = req_func()
             func(self, response)
+            if cache_key is not None:
+                self._cache_response(func.__name__, cache_key, response,
+                    size)
             return response
+        # keep the declaration around so other request styles (like the
+        # asyncio APIs) can build their own version of the method from it
+        inner_func.api_method_args = (req_method, secure, version,
+            streamable)
+        inner_func.api_method_func = func
         return inner_func
     return outer_func
 
@@ -60,11 +97,43 @@ class AndroidApi(ApiInterface):
     METHOD_GET      = 'GET'
     METHOD_POST     = 'POST'
 
-    def __init__(self, state=None):
+    RATE_LIMIT_FAMILY = RateLimiter.FAMILY_ANDROID
+
+    def __init__(self, state=None, pool=None, cache=None, http_cache=None,
+            rate_limiter=None, retry_policy=None, circuit_breaker=None,
+            json_backend=None):
         """Init object, optionally with previously stored session and/or auth
         tokens
-        """
-        self._connector = requests.Session()
+
+        @param str state
+        @param crunchyroll.apis.pool.ConnectionPool pool    share connections
+                                                                with other APIs
+        @param crunchyroll.apis.cache.ResponseCache cache   cache results of
+                                                                catalog methods
+        @param crunchyroll.apis.cache.HttpCache http_cache   persistent cache
+                                                                of responses
+        @param crunchyroll.apis.ratelimit.RateLimiter rate_limiter
+        @param crunchyroll.apis.retry.RetryPolicy retry_policy  a default
+                                                                policy is used
+                                                                if not given
+        @param crunchyroll.apis.retry.CircuitBreaker circuit_breaker
+        @param str|object json_backend  name of a crunchyroll.jsonbackend
+                                            backend (or an instance) to decode
+                                            responses with, None for the
+                                            default
+        """
+        self._pool = pool
+        self._cache = cache
+        self._http_cache = http_cache
+        self._rate_limiter = rate_limiter
+        self._retry_policy = retry_policy if retry_policy is not None \
+            else RetryPolicy()
+        self._circuit_breaker = circuit_breaker if circuit_breaker is not None \
+            else CircuitBreaker()
+        self._json_backend = None if json_backend is None \
+            else make_json_backend(json_backend)
+        self._single_flight = SingleFlight()
+        self._connector = self._create_connector()
         self._request_headers = {
             'X-Android-Device-Manufacturer':
                 ANDROID.DEVICE_MANUFACTURER,
@@ -95,6 +164,14 @@ class AndroidApi(ApiInterface):
             self.set_state(state)
         logger.info('Initialized state: %r', self._state_params)
 
+    def _create_connector(self):
+        """Create the HTTP session used for requests
+        """
+        session = requests.Session()
+        if self._pool is not None:
+            self._pool.mount(session)
+        return session
+
     def _get_locale(self):
         """Get the current locale with dashes (-) and underscores (_) removed
 
@@ -130,20 +207,24 @@ class AndroidApi(ApiInterface):
         else:
             self._session_ops.extend(sess_ops)
 
-    def _build_request(self, method, url, params=None):
+    def _get_full_params(self, params=None):
+        full_params = self._get_base_params()
+        if params is not None:
+            full_params.update(params)
+        return full_params
+
+    def _build_request(self, method, url, params=None, api_method=None):
         """Build a function to do an API request
 
         "We have to go deeper" or "It's functions all the way down!"
+
+        @return callable    sends the request, gives the response data and
+                                the size of the response body
         """
-        full_params = self._get_base_params()
-        if params is not None:
-            full_params.update(params)
-        try:
-            request_func = lambda u, d: \
-                getattr(self._connector, method.lower())(u, params=d,
-                    headers=self._request_headers)
-        except AttributeError:
-            raise ApiException('Invalid request method')
+        full_params = self._get_full_params(params)
+        request_func = lambda u, d: \
+            self._send_request(method, u, params=d,
+                headers=self._request_headers, api_method=api_method)
         # TODO: need to catch a network here and raise as ApiNetworkException
 
         def do_request():
@@ -155,22 +236,45 @@ class AndroidApi(ApiInterface):
             except requests.RequestException as err:
                 raise ApiNetworkException(err)
             try:
-                resp_json = resp.json()
-            except TypeError:
-                resp_json = resp.json
-            try:
-                is_error = resp_json['error']
-            except TypeError:
+                resp_json = self._decode_json(resp)
+            except ValueError:
+                # error pages (like a 503 that retrying didn't get past)
+                # aren't JSON
                 raise ApiBadResponseException(resp.content)
-            if is_error:
-                raise ApiError('%s: %s' % (resp_json['code'], resp_json['message']))
-            else:
-                self._last_response = resp
-                data = resp_json['data']
-                self._do_post_request_tasks(data)
-                return data
+            data = self._handle_response_json(resp_json, resp.content)
+            self._last_response = resp
+            # the size goes along with the data, the last response may
+            # already be another thread's by the time it's cached
+            return data, len(resp.content)
         return do_request
 
+    def _is_cacheable_response(self, resp):
+        # errors like bad_session come back as 200s, replaying one to other
+        # sessions from the HTTP cache would break them too
+        try:
+            resp_json = self._decode_json(resp)
+        except ValueError:
+            return False
+        return isinstance(resp_json, dict) and \
+            resp_json.get('error', True) is False
+
+    def _handle_response_json(self, resp_json, resp_content):
+        """Check the decoded response for an error and pull out the data
+
+        @param dict resp_json       decoded response body
+        @param str resp_content     raw response body, for error reporting
+        @return mixed
+        """
+        try:
+            is_error = resp_json['error']
+        except TypeError:
+            raise ApiBadResponseException(resp_content)
+        if is_error:
+            raise ApiError('%s: %s' % (resp_json['code'], resp_json['message']))
+        data = resp_json['data']
+        self._do_post_request_tasks(data)
+        return data
+
     def _build_request_url(self, secure, api_method, version):
         """Build a URL for a API method request
         """
@@ -271,7 +375,7 @@ class AndroidApi(ApiInterface):
         """
         pass
 
-    @make_android_api_method(METHOD_GET)
+    @make_android_api_method(METHOD_GET, streamable=True)
     def list_series(self, response):
         """
         Get the list of series, default limit seems to be 20.
@@ -288,7 +392,7 @@ class AndroidApi(ApiInterface):
         """
         pass
 
-    @make_android_api_method(METHOD_GET)
+    @make_android_api_method(METHOD_GET, streamable=True)
     def list_media(self, response):
         """
         Get the list of videos for a series
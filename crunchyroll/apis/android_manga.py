@@ -25,22 +25,50 @@ import requests
 from crunchyroll.apis import ApiInterface
 from crunchyroll.constants import ANDROID_MANGA
 from crunchyroll.apis.errors import *
+from crunchyroll.apis.ratelimit import RateLimiter
+from crunchyroll.apis.retry import RetryPolicy, CircuitBreaker
+from crunchyroll.apis.singleflight import SingleFlight, make_request_key
+from crunchyroll.jsonbackend import make_backend as make_json_backend
 from crunchyroll.util import iteritems
 
 logger = logging.getLogger('crunchyroll.apis.android_manga')
 
-def build_api_method(req_method, secure=False, method_name=None):
+def build_api_method(req_method, secure=False, method_name=None,
+        streamable=False):
+    """See `crunchyroll.apis.android.make_android_api_method`
+    """
     def outer_func(func):
         @functools.wraps(func)
         def inner_func(self, **kwargs):
-            if method_name is not None:
-                req_url = self._build_request_url(secure, method_name)
+            api_method = method_name if method_name is not None else func.__name__
+            req_url = self._build_request_url(secure, api_method)
+            if streamable and kwargs.pop('stream', False):
+                return self._send_stream_request(req_method, req_url,
+                    params=self._get_full_params(kwargs),
+                    headers=self._request_headers, api_method=api_method)
+            cache_key = self._get_cache_key(api_method, req_url, kwargs)
+            if cache_key is not None:
+                try:
+                    return self._cache.get(cache_key)
+                except KeyError:
+                    pass
+            req_func = self._build_request(req_method, req_url, params=kwargs,
+                api_method=api_method)
+            if req_method == self.METHOD_GET:
+                # identical concurrent reads can share a single request
+                response, size = self._single_flight.do(
+                    make_request_key(req_url, kwargs), req_func)
             else:
-                req_url = self._build_request_url(secure, func.__name__)
-            req_func = self._build_request(req_method, req_url, params=kwargs)
-            response = req_func()
+                response, size = req_func()
             func(self, response)
+            if cache_key is not None:
+                self._cache_response(api_method, cache_key, response, size)
             return response
+        # keep the declaration around so other request styles (like the
+        # asyncio APIs) can build their own version of the method from it
+        inner_func.api_method_args = (req_method, secure, method_name,
+            streamable)
+        inner_func.api_method_func = func
         return inner_func
     return outer_func
 
@@ -51,11 +79,26 @@ class AndroidMangaApi(ApiInterface):
     METHOD_GET          = 'GET'
     METHOD_POST         = 'POST'
 
-    def __init__(self, state=None):
+    RATE_LIMIT_FAMILY   = RateLimiter.FAMILY_MANGA
+
+    def __init__(self, state=None, pool=None, cache=None, http_cache=None,
+            rate_limiter=None, retry_policy=None, circuit_breaker=None,
+            json_backend=None):
         """
         """
 
-        self._connector = requests.Session()
+        self._pool = pool
+        self._cache = cache
+        self._http_cache = http_cache
+        self._rate_limiter = rate_limiter
+        self._retry_policy = retry_policy if retry_policy is not None \
+            else RetryPolicy()
+        self._circuit_breaker = circuit_breaker if circuit_breaker is not None \
+            else CircuitBreaker()
+        self._json_backend = None if json_backend is None \
+            else make_json_backend(json_backend)
+        self._single_flight = SingleFlight()
+        self._connector = self._create_connector()
         self._request_headers = {}
         self._state_params = {
             'session_id':   None,
@@ -71,6 +114,14 @@ class AndroidMangaApi(ApiInterface):
         logger.info('Initialized state: %r', self._state_params)
 
 
+    def _create_connector(self):
+        """Create the HTTP session used for requests
+        """
+        session = requests.Session()
+        if self._pool is not None:
+            self._pool.mount(session)
+        return session
+
     def _get_base_params(self):
         """
         """
@@ -104,20 +155,23 @@ class AndroidMangaApi(ApiInterface):
         else:
             self._session_ops.extend(sess_ops)
 
-    def _build_request(self, method, url, params=None):
+    def _get_full_params(self, params=None):
+        full_params = self._get_base_params()
+        if params is not None:
+            full_params.update(params)
+        return full_params
+
+    def _build_request(self, method, url, params=None, api_method=None):
         """Build a function to do an API request
 
         "We have to go deeper" or "It's functions all the way down!"
+
+        @return callable    see `crunchyroll.apis.android.AndroidApi._build_request`
         """
-        full_params = self._get_base_params()
-        if params is not None:
-            full_params.update(params)
-        try:
-            request_func = lambda u, d: \
-                getattr(self._connector, method.lower())(u, params=d,
-                    headers=self._request_headers)
-        except AttributeError:
-            raise ApiException('Invalid request method')
+        full_params = self._get_full_params(params)
+        request_func = lambda u, d: \
+            self._send_request(method, u, params=d,
+                headers=self._request_headers, api_method=api_method)
         # TODO: need to catch a network here and raise as ApiNetworkException
 
         def do_request():
@@ -130,35 +184,58 @@ class AndroidMangaApi(ApiInterface):
                 raise ApiNetworkException(err)
 
             try:
-                resp_json = resp.json()
-            except TypeError:
-                resp_json = resp.json
+                resp_json = self._decode_json(resp)
+            except ValueError:
+                # error pages (like a 503 that retrying didn't get past)
+                # aren't JSON
+                raise ApiBadResponseException(resp.content)
+            data = self._handle_response_json(resp_json, resp.content, method)
+            self._last_response = resp
+            return data, len(resp.content)
+        return do_request
 
-            method_returns_list = False
+    def _is_cacheable_response(self, resp):
+        # errors come back as 200s, some methods return a bare list or map
+        # without the envelope though
+        try:
+            resp_json = self._decode_json(resp)
+        except ValueError:
+            return False
+        return not (isinstance(resp_json, dict) and resp_json.get('error'))
+
+    def _handle_response_json(self, resp_json, resp_content, method):
+        """Check the decoded response for an error and pull out the data, some
+        of the manga API methods return a bare list or map instead of the usual
+        response envelope
+
+        @param mixed resp_json      decoded response body
+        @param str resp_content     raw response body, for error reporting
+        @param str method           request method, for logging
+        @return mixed
+        """
+        method_returns_list = False
+        try:
+            resp_json['error']
+        except TypeError:
+            logger.warn('Api method did not return map: %s', method)
+            method_returns_list = True
+        except KeyError:
+            logger.warn('Api method did not return map with error key: %s', method)
+
+        if method_returns_list is None:
+            raise ApiBadResponseException(resp_content)
+        elif method_returns_list:
+            data = resp_json
+        else:
             try:
-                resp_json['error']
-            except TypeError:
-                logger.warn('Api method did not return map: %s', method)
-                method_returns_list = True
+                if resp_json['error']:
+                    raise ApiError('%s: %s' % (resp_json['code'], resp_json['message']))
             except KeyError:
-                logger.warn('Api method did not return map with error key: %s', method)
-
-            if method_returns_list is None:
-                raise ApiBadResponseException(resp.content)
-            elif method_returns_list:
                 data = resp_json
             else:
-                try:
-                    if resp_json['error']:
-                        raise ApiError('%s: %s' % (resp_json['code'], resp_json['message']))
-                except KeyError:
-                    data = resp_json
-                else:
-                    data = resp_json['data']
-                    self._do_post_request_tasks(data)
-            self._last_response = resp
-            return data
-        return do_request
+                data = resp_json['data']
+                self._do_post_request_tasks(data)
+        return data
 
     def _build_request_url(self, secure, api_method):
         """Build a URL for a API method request
@@ -329,7 +406,7 @@ class AndroidMangaApi(ApiInterface):
         """
         pass
 
-    @build_api_method(METHOD_GET)
+    @build_api_method(METHOD_GET, streamable=True)
     def list_series(self, response):
         """
         Get the list of series
@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from requests.structures import CaseInsensitiveDict
+
+from crunchyroll.util import iteritems
+
+logger = logging.getLogger('crunchyroll.apis.cache')
+
+# fields whose values depend on the user or session, a request for any of
+# them can't share a cached response with other users or sessions
+USER_FIELDS = frozenset(['media.playhead', 'media.stream_data',
+    'series.in_queue'])
+
+def _get_key_params(params, volatile_params):
+    """Get the params that identify a cached response, sorted
+
+    @param dict params
+    @param frozenset volatile_params    left out, unless per-user fields were
+                                            asked for
+    @return list<tuple>
+    """
+    fields = (params or {}).get('fields') or ''
+    if not USER_FIELDS.isdisjoint(str(fields).split(',')):
+        volatile_params = frozenset()
+    return sorted((k, str(v)) for k, v in iteritems(params or {}) \
+        if k not in volatile_params and v is not None)
+
+class ResponseCache(object):
+    """In-memory cache of API method results with per-method TTLs and LRU
+    eviction once either the entry count or the size limit is hit
+
+    Only methods with a TTL are cached. Cached results are shared between
+    callers so they should be treated as read-only.
+    """
+
+    # catalog methods, these change slowly enough that a few minutes of
+    # staleness doesn't matter
+    DEFAULT_TTLS = {
+        'list_series':      10 * 60,
+        'list_media':       5 * 60,
+        'categories':       60 * 60,
+        'list_chapters':    5 * 60,
+        'list_chapter':     60 * 60,
+        'list_filters':     60 * 60,
+    }
+
+    # params that change between sessions/users without changing the result,
+    # `info` isn't cached at all since it's mostly used for the per-user
+    # stream data and playhead
+    VOLATILE_PARAMS = frozenset(['session_id', 'auth'])
+
+    def __init__(self, ttls=None, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        """
+        @param dict ttls            {api_method: seconds}, replaces DEFAULT_TTLS
+        @param int max_entries
+        @param int max_bytes        limit on the (raw response) size of
+                                        cached results
+        """
+        self._ttls = dict(self.DEFAULT_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits':         0,
+            'misses':       0,
+            'expired':      0,
+            'evictions':    0,
+        }
+
+    def get_ttl(self, api_method):
+        """Get the TTL for an API method, None if it shouldn't be cached
+
+        @param str api_method
+        @return int|None
+        """
+        return self._ttls.get(api_method)
+
+    def set_ttl(self, api_method, ttl):
+        if ttl is None:
+            self._ttls.pop(api_method, None)
+        else:
+            self._ttls[api_method] = ttl
+
+    def make_key(self, req_url, params):
+        """Build the cache key for a request, leaving out the volatile params
+
+        @param str req_url
+        @param dict params
+        @return tuple
+        """
+        return (req_url, tuple(_get_key_params(params, self.VOLATILE_PARAMS)))
+
+    def get(self, key):
+        """Get a cached result
+
+        @param tuple key
+        @return mixed
+        @raises KeyError if there is no fresh result for `key`
+        """
+        with self._lock:
+            try:
+                expires, size, value = self._entries.pop(key)
+            except KeyError:
+                self._stats['misses'] += 1
+                raise
+            if expires < time.time():
+                self._size -= size
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                raise KeyError(key)
+            # re-insert to mark as most recently used
+            self._entries[key] = (expires, size, value)
+            self._stats['hits'] += 1
+            return value
+
+    def set(self, key, value, ttl, size=0):
+        """Cache a result
+
+        @param tuple key
+        @param mixed value
+        @param int ttl      seconds
+        @param int size     approximate size of `value` in bytes
+        """
+        if size > self.max_bytes:
+            logger.debug('Not caching result larger than cache: %d bytes', size)
+            return
+        with self._lock:
+            try:
+                self._size -= self._entries.pop(key)[1]
+            except KeyError:
+                pass
+            self._entries[key] = (time.time() + ttl, size, value)
+            self._size += size
+            while len(self._entries) > self.max_entries or \
+                    self._size > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def get_stats(self):
+        """Get the hit/miss counts and current size
+
+        @return dict
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._size
+        return stats
+
+    def __len__(self):
+        return len(self._entries)
+
+class CachedResponse(object):
+    """The parts of requests.Response the API classes use, for responses that
+    have already been read
+    """
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+class HttpCacheEntry(object):
+    def __init__(self, status_code, headers, content, expires):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.expires = expires
+
+    @property
+    def is_fresh(self):
+        return self.expires >= time.time()
+
+    def get_conditional_headers(self):
+        """Get the headers to revalidate this entry with, if the server gave
+        us anything to revalidate with
+
+        @return dict
+        """
+        headers = {}
+        if 'ETag' in self.headers:
+            headers['If-None-Match'] = self.headers['ETag']
+        if 'Last-Modified' in self.headers:
+            headers['If-Modified-Since'] = self.headers['Last-Modified']
+        return headers
+
+    def to_response(self):
+        return CachedResponse(self.status_code, self.headers, self.content)
+
+class HttpCache(object):
+    """Persistent cache of raw API responses in a SQLite database
+
+    Responses are served from the database without touching the network
+    until their TTL runs out, after that they are revalidated with
+    If-None-Match/If-Modified-Since if the server sent an ETag or
+    Last-Modified header. Bodies are stored zlib compressed. The database can
+    be shared by multiple processes.
+    """
+
+    DEFAULT_TTLS = {
+        # android + manga
+        'list_series':          60 * 60,
+        'list_media':           30 * 60,
+        'categories':           24 * 60 * 60,
+        'list_chapters':        30 * 60,
+        'list_chapter':         24 * 60 * 60,
+        'list_filters':         24 * 60 * 60,
+        # ajax
+        'Subtitle_GetListing':  60 * 60,
+        'Subtitle_GetXml':      7 * 24 * 60 * 60,
+    }
+
+    # see ResponseCache, `info` is left out of the TTLs for the same reason
+    VOLATILE_PARAMS = ResponseCache.VOLATILE_PARAMS
+
+    # only keep the headers we actually use
+    STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key             TEXT PRIMARY KEY,
+            status_code     INTEGER NOT NULL,
+            headers         TEXT NOT NULL,
+            content         BLOB NOT NULL,
+            size            INTEGER NOT NULL,
+            expires         REAL NOT NULL,
+            accessed        REAL NOT NULL
+        )
+    """
+    # least recently used first, for pruning
+    INDEX_SCHEMA = """
+        CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)
+    """
+
+    # a hit only updates the response's access time if it's older than this,
+    # so reads mostly don't need the database's write lock
+    ACCESS_RESOLUTION = 60
+    # the total size is only checked after this many stores, or this
+    # fraction of max_bytes, since the last check
+    PRUNE_INTERVAL = 64
+    PRUNE_FRACTION = 16
+
+    def __init__(self, path, ttls=None, max_bytes=256 * 1024 * 1024,
+            compress_level=6):
+        """
+        @param str path         database file
+        @param dict ttls        {api_method: seconds}, replaces DEFAULT_TTLS
+        @param int max_bytes    limit on the (compressed) size of stored
+                                    responses, least recently used responses
+                                    are dropped past this. It's checked every
+                                    so often rather than on every store, so
+                                    it can be overshot by a little
+        @param int compress_level
+        """
+        self.path = path
+        self._ttls = dict(self.DEFAULT_TTLS if ttls is None else ttls)
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        self._local = threading.local()
+        # the database has its own locking, this is only for the stats and
+        # the prune counters
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits':         0,
+            'misses':       0,
+            'expired':      0,
+            'revalidated':  0,
+        }
+        # stores and stored bytes since the size was last checked
+        self._unchecked_sets = 0
+        self._unchecked_bytes = 0
+        db = self._get_db()
+        db.execute(self.SCHEMA)
+        db.execute(self.INDEX_SCHEMA)
+
+    def _get_db(self):
+        """sqlite connections can't be shared between threads so each thread
+        gets its own
+        """
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+        return db
+
+    def get_ttl(self, api_method):
+        return self._ttls.get(api_method)
+
+    def make_key(self, method, url, params):
+        key_params = _get_key_params(params, self.VOLATILE_PARAMS)
+        return hashlib.sha1(json.dumps([method.upper(), url, key_params]) \
+            .encode('utf-8')).hexdigest()
+
+    def _count(self, *names):
+        with self._lock:
+            for name in names:
+                self._stats[name] += 1
+
+    def get(self, key):
+        """Get a stored response, fresh or not
+
+        A stale response counts as a miss, since the request has to be sent
+        to revalidate it.
+
+        @param str key
+        @return HttpCacheEntry|None
+        """
+        db = self._get_db()
+        row = db.execute('SELECT status_code, headers, content, expires, '
+            'accessed FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self._count('misses')
+            return None
+        status_code, headers, content, expires, accessed = row
+        now = time.time()
+        if now - accessed > self.ACCESS_RESOLUTION:
+            db.execute('UPDATE responses SET accessed = ? WHERE key = ?',
+                (now, key))
+        entry = HttpCacheEntry(status_code, CaseInsensitiveDict(json.loads(headers)),
+            zlib.decompress(content), expires)
+        if entry.is_fresh:
+            self._count('hits')
+        else:
+            self._count('expired', 'misses')
+        return entry
+
+    def set(self, key, response, ttl):
+        """Store a response
+
+        @param str key
+        @param requests.Response response
+        @param int ttl
+        """
+        headers = dict((h, response.headers[h]) \
+            for h in self.STORED_HEADERS if h in response.headers)
+        content = zlib.compress(response.content, self.compress_level)
+        now = time.time()
+        db = self._get_db()
+        db.execute('INSERT OR REPLACE INTO responses (key, status_code, '
+            'headers, content, size, expires, accessed) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (key, response.status_code, json.dumps(headers),
+                sqlite3.Binary(content), len(content), now + ttl, now))
+        with self._lock:
+            self._unchecked_sets += 1
+            self._unchecked_bytes += len(content)
+            if self._unchecked_sets < self.PRUNE_INTERVAL and \
+                    self._unchecked_bytes < self.max_bytes // self.PRUNE_FRACTION:
+                return
+            self._unchecked_sets = 0
+            self._unchecked_bytes = 0
+        self._prune(db)
+
+    def revalidated(self, key, entry, ttl):
+        """Mark a stored response as still good after a 304
+
+        @param str key
+        @param HttpCacheEntry entry
+        @param int ttl
+        @return HttpCacheEntry
+        """
+        self._count('revalidated')
+        entry.expires = time.time() + ttl
+        self._get_db().execute('UPDATE responses SET expires = ? WHERE key = ?',
+            (entry.expires, key))
+        return entry
+
+    def _prune(self, db):
+        total_size = db.execute('SELECT SUM(size) FROM responses').fetchone()[0]
+        if total_size is None or total_size <= self.max_bytes:
+            return
+        while total_size > self.max_bytes:
+            rows = db.execute('SELECT key, size FROM responses '
+                'ORDER BY accessed ASC LIMIT 64').fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                total_size -= size
+                if total_size <= self.max_bytes:
+                    break
+
+    def clear(self):
+        self._get_db().execute('DELETE FROM responses')
+
+    def close(self):
+        """Close the calling thread's database connection, it's reopened if
+        the cache is used again
+        """
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def get_stats(self):
+        """Get the hit/miss counts and current size, `expired` and
+        `revalidated` are the misses that found a stale response and the ones
+        the server then said were still good
+
+        @return dict
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        row = self._get_db().execute(
+            'SELECT COUNT(*), SUM(size) FROM responses').fetchone()
+        stats['entries'] = row[0]
+        stats['bytes'] = row[1] or 0
+        return stats
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Deadlines for API calls that make several requests
+
+The current deadline is ambient: every request sent while a `Deadline` is
+active gets whatever is left of it as its timeout, so a MetaApi method's
+budget covers the implicit session start/login and every request it makes
+without having to pass it around.
+"""
+
+import functools
+import threading
+
+try:
+    import contextvars
+except ImportError:
+    # py2, no asyncio to worry about so thread locals are enough
+    contextvars = None
+
+from crunchyroll.apis.errors import ApiTimeoutException
+from crunchyroll.apis.ratelimit import monotonic
+
+if contextvars is not None:
+    _current_deadline = contextvars.ContextVar('crunchyroll_deadline',
+        default=None)
+
+    def _get_deadline():
+        return _current_deadline.get()
+
+    def _set_deadline(expires):
+        return _current_deadline.set(expires)
+
+    def _reset_deadline(token):
+        _current_deadline.reset(token)
+else:
+    _local = threading.local()
+
+    def _get_deadline():
+        return getattr(_local, 'expires', None)
+
+    def _set_deadline(expires):
+        token = _get_deadline()
+        _local.expires = expires
+        return token
+
+    def _reset_deadline(token):
+        _local.expires = token
+
+class Deadline(object):
+    """Limit how long everything done inside the block can take
+
+    Nested deadlines can only shorten the current one.
+
+    Example usage:
+        >>> with Deadline(5.0):
+        ...     api.list_media(series)
+    """
+
+    def __init__(self, timeout):
+        """
+        @param float timeout    seconds, None for no limit
+        """
+        self.timeout = timeout
+        self._token = None
+
+    def __enter__(self):
+        expires = _get_deadline()
+        if self.timeout is not None:
+            own_expires = monotonic() + self.timeout
+            if expires is None or own_expires < expires:
+                expires = own_expires
+        self._token = _set_deadline(expires)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _reset_deadline(self._token)
+
+def carry_deadline(func):
+    """Have a function run on another thread keep the current deadline,
+    threads don't inherit it (nor do executors copy contexts)
+
+    The deadline is read now, when the work is handed off.
+
+    Example usage:
+        >>> executor.submit(carry_deadline(fetch), item)
+
+    @param callable func
+    @return callable
+    """
+    expires = _get_deadline()
+    if expires is None:
+        return func
+    @functools.wraps(func)
+    def inner_func(*pargs, **kwargs):
+        token = _set_deadline(expires)
+        try:
+            return func(*pargs, **kwargs)
+        finally:
+            _reset_deadline(token)
+    return inner_func
+
+def get_remaining():
+    """Get the seconds left before the current deadline
+
+    @return float|None  None if there is no deadline
+    """
+    expires = _get_deadline()
+    if expires is None:
+        return None
+    return expires - monotonic()
+
+def check_deadline():
+    """Make sure the current deadline hasn't passed yet
+
+    @return float|None  seconds left
+    @raises ApiTimeoutException
+    """
+    remaining = get_remaining()
+    if remaining is not None and remaining <= 0:
+        raise ApiTimeoutException('Deadline exceeded')
+    return remaining
@@ -27,6 +27,16 @@ class ApiNetworkException(ApiException):
     """
     pass
 
+class ApiCircuitOpenException(ApiNetworkException):
+    """The API's host has been failing so the request wasn't even tried
+    """
+    pass
+
+class ApiTimeoutException(ApiNetworkException):
+    """The call's deadline ran out before the API answered
+    """
+    pass
+
 class ApiBadResponseException(ApiException):
     """We got a response from the API but it didn't make any sense or we don't
     know how to handle it
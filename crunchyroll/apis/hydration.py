@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Lazy hydration of models fetched with a thin field set
+
+Every model from one listing shares a Hydrator. Reading a field the model
+wasn't loaded with fetches the full object, along with the next few models of
+the listing that are still thin so a loop over the listing costs one round of
+concurrent requests per batch instead of one request per item.
+"""
+
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from crunchyroll.apis.deadline import carry_deadline
+from crunchyroll.constants import META
+
+logger = logging.getLogger('crunchyroll.apis.hydration')
+
+class Hydrator(object):
+    """Fills in the fields of the models from one listing on demand
+
+    Example usage:
+        >>> media = api.list_media(series, fields=META.FIELDS_IDS)
+        >>> media[0].description    # fetches media[0:10]
+        >>> media[5].stream_data    # already there
+    """
+
+    def __init__(self, fetch, batch_size=META.HYDRATE_BATCH_SIZE,
+            max_workers=META.HYDRATE_WORKERS):
+        """
+        @param callable fetch   called with a model, should return the dict of
+                                    all of its fields
+        @param int batch_size   models fetched together when one of them is
+                                    read, 1 to only fetch the one being read
+        @param int max_workers  concurrent requests
+        """
+        self._fetch = fetch
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max(1, max_workers)
+        self._models = []
+        self._positions = {}
+        self._lock = threading.Lock()
+        # {id(model): threading.Event} for models being fetched right now
+        self._in_flight = {}
+
+    def add(self, models):
+        """Have models be hydrated by this hydrator, in listing order
+
+        @param list<crunchyroll.models.CompiledModel> models
+        """
+        with self._lock:
+            for model in models:
+                self._positions[id(model)] = len(self._models)
+                self._models.append(model)
+                model._hydrator = self
+
+    def hydrate(self, model):
+        """Fetch the fields of a model along with the next thin models of its
+        listing, waits for it if another thread is already fetching it
+
+        @param crunchyroll.models.CompiledModel model
+        """
+        while model._loaded is not None:
+            with self._lock:
+                done = self._in_flight.get(id(model))
+                if done is None:
+                    batch = self._take_batch(model)
+            if done is not None:
+                done.wait()
+                # check again, its fetch might have failed
+                continue
+            self._fetch_batch(batch)
+
+    def hydrate_many(self, models):
+        """Fetch the fields of every thin model, at most `max_workers` at a
+        time
+
+        @param list<crunchyroll.models.CompiledModel> models
+        """
+        with self._lock:
+            batch = [model for model in models if model._loaded is not None \
+                and id(model) not in self._in_flight]
+            self._mark_in_flight(batch)
+        if batch:
+            self._fetch_batch(batch, raise_errors=True)
+        # models another thread was already fetching
+        for model in models:
+            self.hydrate(model)
+
+    def _take_batch(self, model):
+        """Pick the model and the thin models after it that nothing is
+        fetching yet, should be called with the lock held
+        """
+        batch = [model]
+        start = self._positions.get(id(model), len(self._models)) + 1
+        for other in self._models[start:]:
+            if len(batch) >= self.batch_size:
+                break
+            if other._loaded is not None and id(other) not in self._in_flight:
+                batch.append(other)
+        self._mark_in_flight(batch)
+        return batch
+
+    def _mark_in_flight(self, batch):
+        done = threading.Event()
+        for model in batch:
+            self._in_flight[id(model)] = done
+
+    def _fetch_batch(self, batch, raise_errors=False):
+        """Fetch and fill in a batch of models concurrently
+
+        A failure for the first model (the one being read) is raised, the
+        rest are only logged and stay thin so they're retried the next time
+        they're read, unless `raise_errors` is set.
+        """
+        error = None
+        try:
+            if len(batch) == 1:
+                results = [self._call_fetch(batch[0])]
+            else:
+                with ThreadPoolExecutor(
+                        max_workers=min(self.max_workers, len(batch))) as executor:
+                    results = list(executor.map(
+                        carry_deadline(self._call_fetch), batch))
+            for i, (model, (data, err)) in enumerate(zip(batch, results)):
+                if err is None:
+                    model._set_fields(data)
+                elif error is None and (i == 0 or raise_errors):
+                    error = err
+                else:
+                    logger.warning('Failed to hydrate %r: %s', model, err)
+        finally:
+            with self._lock:
+                done = self._in_flight.get(id(batch[0]))
+                for model in batch:
+                    self._in_flight.pop(id(model), None)
+            if done is not None:
+                done.set()
+        if error is not None:
+            raise error
+
+    def _call_fetch(self, model):
+        try:
+            return (self._fetch(model), None)
+        except Exception as err:
+            return (None, err)
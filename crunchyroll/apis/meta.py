@@ -20,18 +20,41 @@ import functools
 import json
 import logging
 
+import requests
+
 from crunchyroll.apis import ApiInterface
 from crunchyroll.apis.android import AndroidApi
 from crunchyroll.apis.ajax import AjaxApi
 from crunchyroll.apis.scraper import ScraperApi
 from crunchyroll.apis.android_manga import AndroidMangaApi
+from crunchyroll.apis.pool import ConnectionPool
+from crunchyroll.apis.deadline import Deadline
+from crunchyroll.apis.retry import RetryPolicy, CircuitBreaker
+from crunchyroll.apis.hydration import Hydrator
+from crunchyroll.apis.pipeline import SubtitlePipeline
 from crunchyroll.constants import META, AJAX, ANDROID
 from crunchyroll.apis.errors import *
+from crunchyroll.columnar import MediaCollection
 from crunchyroll.models import *
-from crunchyroll.util import return_collection, decrypt_image_stream
+from crunchyroll.util import return_collection, decrypt_image_stream, \
+    iter_pages, iteritems
 
 logger = logging.getLogger('crunchyroll.apis.meta')
 
+def with_deadline(func):
+    """Let the method take a `timeout` kwarg (seconds) that covers every
+    request made for it, including starting sessions and logging in. Should be
+    the outermost decorator. Falls back to the MetaApi's default timeout.
+    """
+    @functools.wraps(func)
+    def inner_func(self, *pargs, **kwargs):
+        timeout = kwargs.pop('timeout', None)
+        if timeout is None:
+            timeout = self._timeout
+        with Deadline(timeout):
+            return func(self, *pargs, **kwargs)
+    return inner_func
+
 def require_session_started(func):
     """Check if API sessions are started and start them if not
     """
@@ -119,14 +142,86 @@ class MetaApi(ApiInterface):
     """High level interface to crunchyroll
     """
 
-    def __init__(self, username=None, password=None, state=None):
+    # the underlying API classes, the asyncio version swaps these out
+    _ajax_api_class     = AjaxApi
+    _android_api_class  = AndroidApi
+    _manga_api_class    = AndroidMangaApi
+
+    def __init__(self, username=None, password=None, state=None, pool=None,
+            cache=None, http_cache=None, rate_limiter=None, retry_policy=None,
+            circuit_breaker=None, timeout=None, json_backend=None,
+            hydrate_batch_size=META.HYDRATE_BATCH_SIZE,
+            hydrate_workers=META.HYDRATE_WORKERS):
+        """
+        @param str username
+        @param str password
+        @param str state                                from `get_state`
+        @param crunchyroll.apis.pool.ConnectionPool pool  connection pool shared
+                                                            by the underlying
+                                                            APIs, a default one
+                                                            is used if not given
+        @param crunchyroll.apis.cache.ResponseCache cache cache for catalog
+                                                            method results,
+                                                            disabled if not given
+        @param crunchyroll.apis.cache.HttpCache http_cache  persistent response
+                                                            cache, disabled if
+                                                            not given
+        @param crunchyroll.apis.ratelimit.RateLimiter rate_limiter  request
+                                                            rate/concurrency
+                                                            limits, disabled if
+                                                            not given
+        @param crunchyroll.apis.retry.RetryPolicy retry_policy  for transient
+                                                            failures, a default
+                                                            one is used if not
+                                                            given
+        @param crunchyroll.apis.retry.CircuitBreaker circuit_breaker  shared by
+                                                            the underlying APIs,
+                                                            a default one is
+                                                            used if not given
+        @param float timeout                            default time limit for
+                                                            each method call,
+                                                            can be overridden
+                                                            with the method's
+                                                            `timeout` kwarg
+        @param str|object json_backend                  crunchyroll.jsonbackend
+                                                            backend for the
+                                                            Android and manga
+                                                            APIs, the default
+                                                            one if not given
+        @param int hydrate_batch_size                   models from the same
+                                                            listing to fill in
+                                                            at once when a
+                                                            field that wasn't
+                                                            fetched is read
+        @param int hydrate_workers                      concurrent requests
+                                                            for filling in
+                                                            models
+        """
+        self._timeout = timeout
+        self._hydrate_batch_size = hydrate_batch_size
+        self._hydrate_workers = hydrate_workers
         self._state = {
             'username': username,
             'password': password,
         }
-        self._ajax_api = AjaxApi()
-        self._android_api = AndroidApi()
-        self._manga_api = AndroidMangaApi()
+        self._pool = pool if pool is not None else ConnectionPool()
+        self._rate_limiter = rate_limiter
+        self._retry_policy = retry_policy if retry_policy is not None \
+            else RetryPolicy()
+        self._circuit_breaker = circuit_breaker if circuit_breaker is not None \
+            else CircuitBreaker()
+        api_args = {
+            'pool':             self._pool,
+            'http_cache':       http_cache,
+            'rate_limiter':     rate_limiter,
+            'retry_policy':     self._retry_policy,
+            'circuit_breaker':  self._circuit_breaker,
+        }
+        self._ajax_api = self._ajax_api_class(**api_args)
+        self._android_api = self._android_api_class(cache=cache,
+            json_backend=json_backend, **api_args)
+        self._manga_api = self._manga_api_class(cache=cache,
+            json_backend=json_backend, **api_args)
         if state is not None:
             self.set_state(state)
 
@@ -146,6 +241,38 @@ class MetaApi(ApiInterface):
         return self._state['username'] is not None and \
             self._state['password'] is not None
 
+    @property
+    def pool(self):
+        return self._pool
+
+    @property
+    def cache(self):
+        return self._android_api._cache
+
+    def get_connection_stats(self):
+        """Get the connection reuse counts of the shared connection pool
+
+        @return dict
+        """
+        return self._pool.get_stats()
+
+    def get_rate_limit_stats(self):
+        """Get the current rate/concurrency limits and queue depth of each
+        endpoint family, or None if there is no rate limiter
+
+        @return dict|None
+        """
+        if self._rate_limiter is None:
+            return None
+        return self._rate_limiter.get_stats()
+
+    def get_circuit_stats(self):
+        """Get the circuit breaker state of every host that has failed
+
+        @return dict
+        """
+        return self._circuit_breaker.get_stats()
+
     def get_state(self):
         return json.dumps({
             'meta':     self._state,
@@ -162,6 +289,7 @@ class MetaApi(ApiInterface):
         self._android_api.set_state(decoded_state['android'])
         self._manga_api.set_state(decoded_state['manga'])
 
+    @with_deadline
     @optional_android_logged_in
     def is_premium(self, media_type):
         """Get if the user is premium for a given media type
@@ -171,6 +299,7 @@ class MetaApi(ApiInterface):
         """
         return self._android_api.is_premium(media_type)
 
+    @with_deadline
     def start_session(self):
         """Start the underlying APIs sessions
 
@@ -183,6 +312,7 @@ class MetaApi(ApiInterface):
         self._manga_api.cr_start_session()
         return self.session_started
 
+    @with_deadline
     @require_session_started
     def login(self, username, password):
         """Login with the given username/email and password
@@ -208,9 +338,11 @@ class MetaApi(ApiInterface):
         self._state['password'] = password
         return self.logged_in
 
+    @with_deadline
     @optional_android_logged_in
     @return_collection(Series)
-    def list_anime_series(self, sort=META.SORT_ALPHA, limit=META.MAX_SERIES, offset=0):
+    def list_anime_series(self, sort=META.SORT_ALPHA, limit=META.MAX_SERIES, offset=0,
+            fields=None):
         """Get a list of anime series
 
         @param str sort     pick how results should be sorted, should be one
@@ -218,18 +350,23 @@ class MetaApi(ApiInterface):
         @param int limit    limit number of series to return, there doesn't
                                 seem to be an upper bound
         @param int offset   list series starting from this offset, for pagination
+        @param list<str> fields ANDROID.FIELD.* to fetch, like one of
+                                    META.FIELDS_*, all of them if not given
         @return list<crunchyroll.models.Series>
         """
         result = self._android_api.list_series(
             media_type=ANDROID.MEDIA_TYPE_ANIME,
             filter=sort,
             limit=limit,
-            offset=offset)
-        return result
+            offset=offset,
+            **self._get_fields_param(fields))
+        return self._project(Series, result, fields)
 
+    @with_deadline
     @optional_android_logged_in
     @return_collection(Series)
-    def list_drama_series(self, sort=META.SORT_ALPHA, limit=META.MAX_SERIES, offset=0):
+    def list_drama_series(self, sort=META.SORT_ALPHA, limit=META.MAX_SERIES, offset=0,
+            fields=None):
         """Get a list of drama series
 
         @param str sort     pick how results should be sorted, should be one
@@ -237,15 +374,49 @@ class MetaApi(ApiInterface):
         @param int limit    limit number of series to return, there doesn't
                                 seem to be an upper bound
         @param int offset   list series starting from this offset, for pagination
+        @param list<str> fields ANDROID.FIELD.* to fetch, like one of
+                                    META.FIELDS_*, all of them if not given
         @return list<crunchyroll.models.Series>
         """
         result = self._android_api.list_series(
             media_type=ANDROID.MEDIA_TYPE_DRAMA,
             filter=sort,
             limit=limit,
-            offset=offset)
-        return result
+            offset=offset,
+            **self._get_fields_param(fields))
+        return self._project(Series, result, fields)
+
+    def iter_anime_series(self, sort=META.SORT_ALPHA, page_size=META.PAGE_SIZE,
+            limit=None, prefetch=True, timeout=None, fields=None):
+        """Iterate over the anime series, fetching them a page at a time
+
+        @param str sort         one of META.SORT_*
+        @param int page_size    number of series to request at once
+        @param int limit        stop after this many series, None for all of them
+        @param bool prefetch    fetch the next page in the background while the
+                                    current one is being consumed
+        @param float timeout    time limit for fetching each page
+        @param list<str> fields see `list_anime_series`
+        @return generator<crunchyroll.models.Series>
+        """
+        return iter_pages(
+            lambda offset, limit: self.list_anime_series(sort=sort,
+                limit=limit, offset=offset, timeout=timeout, fields=fields),
+            page_size, limit, prefetch)
+
+    def iter_drama_series(self, sort=META.SORT_ALPHA, page_size=META.PAGE_SIZE,
+            limit=None, prefetch=True, timeout=None, fields=None):
+        """Iterate over the drama series, fetching them a page at a time, see
+        `iter_anime_series`
+
+        @return generator<crunchyroll.models.Series>
+        """
+        return iter_pages(
+            lambda offset, limit: self.list_drama_series(sort=sort,
+                limit=limit, offset=offset, timeout=timeout, fields=fields),
+            page_size, limit, prefetch)
 
+    @with_deadline
     @require_session_started
     @return_collection(Series)
     def list_manga_series(self, filter=None, content_type='jp_manga'):
@@ -255,9 +426,10 @@ class MetaApi(ApiInterface):
         result = self._manga_api.list_series(filter, content_type)
         return result
 
+    @with_deadline
     @optional_android_logged_in
     @return_collection(Series)
-    def search_anime_series(self, query_string):
+    def search_anime_series(self, query_string, fields=None):
         """Search anime series list by series name, case-sensitive
 
         @param str query_string     string to search for, note that the search
@@ -265,16 +437,19 @@ class MetaApi(ApiInterface):
                                         the start of the series name, ex) search
                                         for "space" matches "Space Brothers" but
                                         wouldn't match "Brothers Space"
+        @param list<str> fields     same as `list_anime_series`
         @return list<crunchyroll.models.Series>
         """
         result = self._android_api.list_series(
             media_type=ANDROID.MEDIA_TYPE_ANIME,
-            filter=ANDROID.FILTER_PREFIX + query_string)
-        return result
+            filter=ANDROID.FILTER_PREFIX + query_string,
+            **self._get_fields_param(fields))
+        return self._project(Series, result, fields)
 
+    @with_deadline
     @optional_android_logged_in
     @return_collection(Series)
-    def search_drama_series(self, query_string):
+    def search_drama_series(self, query_string, fields=None):
         """Search drama series list by series name, case-sensitive
 
         @param str query_string     string to search for, note that the search
@@ -282,13 +457,16 @@ class MetaApi(ApiInterface):
                                         the start of the series name, ex) search
                                         for "space" matches "Space Brothers" but
                                         wouldn't match "Brothers Space"
+        @param list<str> fields     same as `list_anime_series`
         @return list<crunchyroll.models.Series>
         """
         result = self._android_api.list_series(
             media_type=ANDROID.MEDIA_TYPE_DRAMA,
-            filter=ANDROID.FILTER_PREFIX + query_string)
-        return result
+            filter=ANDROID.FILTER_PREFIX + query_string,
+            **self._get_fields_param(fields))
+        return self._project(Series, result, fields)
 
+    @with_deadline
     @optional_manga_logged_in
     @return_collection(Series)
     def search_manga_series(self, query_string):
@@ -304,9 +482,11 @@ class MetaApi(ApiInterface):
             if series['locale']['enUS']['name'].lower().startswith(
                 query_string.lower())]
 
+    @with_deadline
     @optional_android_logged_in
     @return_collection(Media)
-    def list_media(self, series, sort=META.SORT_DESC, limit=META.MAX_MEDIA, offset=0):
+    def list_media(self, series, sort=META.SORT_DESC, limit=META.MAX_MEDIA, offset=0,
+            fields=None):
         """List media for a given series or collection
 
         @param crunchyroll.models.Series series the series to search for
@@ -316,6 +496,9 @@ class MetaApi(ApiInterface):
         @param int limit                        limit size of results
         @param int offset                       start results from this index,
                                                     for pagination
+        @param list<str> fields                 ANDROID.FIELD.* to fetch, like
+                                                    one of META.FIELDS_*, all
+                                                    of them if not given
         @return list<crunchyroll.models.Media>
         """
         params = {
@@ -324,9 +507,44 @@ class MetaApi(ApiInterface):
             'limit': limit,
         }
         params.update(self._get_series_query_dict(series))
+        params.update(self._get_fields_param(fields))
         result = self._android_api.list_media(**params)
-        return result
+        return self._project(Media, result, fields)
 
+    @with_deadline
+    @optional_android_logged_in
+    def list_media_collection(self, series, sort=META.SORT_DESC,
+            limit=META.MAX_MEDIA, offset=0, fields=None):
+        """Same as `list_media` but the result is a column oriented
+        collection that can be filtered and sorted without building a `Media`
+        object for every episode, columns that weren't in `fields` are all
+        None
+
+        @return crunchyroll.columnar.MediaCollection
+        """
+        params = {
+            'sort': sort,
+            'offset': offset,
+            'limit': limit,
+        }
+        params.update(self._get_series_query_dict(series))
+        params.update(self._get_fields_param(fields))
+        return MediaCollection(self._android_api.list_media(**params))
+
+    def iter_media(self, series, sort=META.SORT_DESC, page_size=META.PAGE_SIZE,
+            limit=None, prefetch=True, timeout=None, fields=None):
+        """Iterate over the media for a series or collection, fetching them a
+        page at a time, see `iter_anime_series`
+
+        @param crunchyroll.models.Series series
+        @return generator<crunchyroll.models.Media>
+        """
+        return iter_pages(
+            lambda offset, limit: self.list_media(series, sort=sort,
+                limit=limit, offset=offset, timeout=timeout, fields=fields),
+            page_size, limit, prefetch)
+
+    @with_deadline
     @optional_manga_logged_in
     @return_collection(Chapter)
     def list_chapters(self, series):
@@ -339,6 +557,7 @@ class MetaApi(ApiInterface):
             result = self._manga_api.list_chapters(series_id=series.series_id)
         return result['chapters']
 
+    @with_deadline
     @optional_manga_logged_in
     @return_collection(Page)
     def list_pages(self, chapter):
@@ -348,29 +567,37 @@ class MetaApi(ApiInterface):
         result = self._manga_api.list_chapter(chapter_id=chapter.chapter_id)
         return result['pages']
 
+    @with_deadline
     @optional_manga_logged_in
     def get_page_stream(self, page, locale='enUS'):
-        req = self._manga_api._connector.get(
-            page.locale[locale].encrypted_composed_image_url, stream=True)
-        return decrypt_image_stream(req)
+        try:
+            resp = self._manga_api._send_request('GET',
+                page.locale[locale].encrypted_composed_image_url, stream=True)
+        except requests.RequestException as err:
+            raise ApiNetworkException(err)
+        return decrypt_image_stream(resp)
 
+    @with_deadline
     @optional_android_logged_in
     @return_collection(Media)
-    def search_media(self, series, query_string):
+    def search_media(self, series, query_string, fields=None):
         """Search for media from a series starting with query_string, case-sensitive
 
         @param crunchyroll.models.Series series     the series to search in
         @param str query_string                     the search query, same restrictions
                                                         as `search_anime_series`
+        @param list<str> fields                     same as `list_media`
         @return list<crunchyroll.models.Media>
         """
         params = {
             'sort': ANDROID.FILTER_PREFIX + query_string,
         }
         params.update(self._get_series_query_dict(series))
+        params.update(self._get_fields_param(fields))
         result = self._android_api.list_media(**params)
-        return result
+        return self._project(Media, result, fields)
 
+    @with_deadline
     @optional_ajax_logged_in
     def get_media_stream(self, media_item, format, quality):
         """Get the stream data for a given media item
@@ -386,6 +613,7 @@ class MetaApi(ApiInterface):
             video_quality=quality)
         return MediaStream(result)
 
+    @with_deadline
     @optional_ajax_logged_in
     def get_stream_info(self, media_item, format, quality):
         result = self._ajax_api.VideoEncode_GetStreamInfo(
@@ -394,11 +622,13 @@ class MetaApi(ApiInterface):
             video_encode_quality=quality)
         return StreamInfo(result)
 
+    @with_deadline
     @return_collection(SubtitleStub)
     def get_subtitle_stubs(self, media_item):
         result = self._ajax_api.Subtitle_GetListing(media_id=media_item.media_id)
         return XmlModel(result)['subtitle']
 
+    @with_deadline
     def unfold_subtitle_stub(self, subtitle_stub):
         """Turn a SubtitleStub into a full Subtitle object
 
@@ -408,6 +638,45 @@ class MetaApi(ApiInterface):
         return Subtitle(self._ajax_api.Subtitle_GetXml(
             subtitle_script_id=int(subtitle_stub.id)))
 
+    def iter_subtitles(self, media_items, languages=None, formats=('srt',),
+            fetch_workers=META.SUBTITLE_FETCH_WORKERS, processes=None,
+            max_pending=META.SUBTITLE_MAX_PENDING, store=None):
+        """Fetch, decrypt and format the subtitles of many media items at
+        once, see crunchyroll.apis.pipeline
+
+        Requests run concurrently while the subtitles that already arrived
+        are decrypted and formatted in worker processes. A failure only
+        affects its own result. Subtitles already in `store` aren't fetched
+        at all.
+
+        Example usage:
+            >>> for result in api.iter_subtitles(episodes, ['English (US)'],
+            ...         formats=['ass', 'srt']):
+            ...     if result.error is None:
+            ...         save(result.media, result.subtitles['srt'])
+
+        @param iterable<crunchyroll.models.Media> media_items
+        @param list<str> languages      SubtitleStub.language values, all of
+                                            them if not given
+        @param list<str> formats        crunchyroll.subtitles.FORMATTERS names
+        @param int fetch_workers        concurrent requests
+        @param int processes            worker processes, the number of CPUs if
+                                            not given, 0 to format on the fetch
+                                            threads instead
+        @param int max_pending          most subtitles in progress or waiting
+                                            to be handed back at once
+        @param crunchyroll.subtitlestore.SubtitleStore|str store
+                                        on-disk store of subtitles, can be
+                                            shared between processes
+        @return generator<crunchyroll.apis.pipeline.SubtitleResult>  in the
+                                            order they complete
+        """
+        return SubtitlePipeline(self.get_subtitle_stubs,
+            self.unfold_subtitle_stub, formats=formats, languages=languages,
+            fetch_workers=fetch_workers, processes=processes,
+            max_pending=max_pending, store=store).run(media_items)
+
+    @with_deadline
     @optional_ajax_logged_in
     def get_stream_formats(self, media_item):
         """Get the available media formats for a given media item
@@ -415,10 +684,13 @@ class MetaApi(ApiInterface):
         @param crunchyroll.models.Media
         @return dict
         """
-        scraper = ScraperApi(self._ajax_api._connector)
+        scraper = ScraperApi(self._ajax_api._connector,
+            rate_limiter=self._rate_limiter, retry_policy=self._retry_policy,
+            circuit_breaker=self._circuit_breaker)
         formats = scraper.get_media_formats(media_item.media_id)
         return formats
 
+    @with_deadline
     @require_android_logged_in
     @return_collection(Series)
     def list_queue(self, media_types=[META.TYPE_ANIME, META.TYPE_DRAMA]):
@@ -431,6 +703,7 @@ class MetaApi(ApiInterface):
         result = self._android_api.queue(media_types='|'.join(media_types))
         return [queue_item['series'] for queue_item in result]
 
+    @with_deadline
     @require_android_logged_in
     def add_to_queue(self, series):
         """Add a series to the queue
@@ -441,6 +714,7 @@ class MetaApi(ApiInterface):
         result = self._android_api.add_to_queue(series_id=series.series_id)
         return result
 
+    @with_deadline
     @require_android_logged_in
     def remove_from_queue(self, series):
         """Remove a series from the queue
@@ -451,6 +725,97 @@ class MetaApi(ApiInterface):
         result = self._android_api.remove_from_queue(series_id=series.series_id)
         return result
 
+    def _get_fields_param(self, fields):
+        """Build the Android API `fields` param
+
+        @param list<str> fields     None for the default fields
+        @return dict
+        """
+        if fields is None:
+            return {}
+        return {'fields': ','.join(self._with_id_fields(fields))}
+
+    def _with_id_fields(self, fields):
+        """Add the ids to a field set, hydrating a model needs its id
+
+        @param list<str> fields
+        @return list<str>
+        """
+        fields = list(fields)
+        fields.extend([field for field in META.FIELDS_IDS \
+            if field not in fields])
+        return fields
+
+    def _project(self, model_cls, items, fields):
+        """Build models that know which fields they were fetched with and
+        share a Hydrator to fetch the rest, the items are left for
+        `return_collection` if there's no field set
+
+        @param type model_cls
+        @param list<dict> items
+        @param list<str> fields
+        @return list
+        """
+        if fields is None:
+            return items
+        loaded_fields = model_cls.get_loaded_fields(
+            self._with_id_fields(fields))
+        models = [model_cls(item, loaded_fields) for item in items]
+        Hydrator(self._get_full_fields, self._hydrate_batch_size,
+            self._hydrate_workers).add(models)
+        return models
+
+    def _get_info_params(self, model):
+        # the model is being hydrated, reading a missing id the normal way
+        # would wait on that same hydration
+        if isinstance(model, Media):
+            return {
+                'media_id': model._get_loaded('media_id'),
+                'fields':   ','.join(Media.get_full_fields()),
+            }
+        return {
+            'series_id':    model._get_loaded('series_id'),
+            'fields':       ','.join(Series.get_full_fields()),
+        }
+
+    @with_deadline
+    @optional_android_logged_in
+    def _get_full_fields(self, model):
+        """Fetch every field of a model that was fetched with a field set
+
+        @param crunchyroll.models.Media|crunchyroll.models.Series model
+        @return dict
+        """
+        return self._android_api.info(**self._get_info_params(model))
+
+    @with_deadline
+    def hydrate(self, models):
+        """Fill in all the fields of models that were fetched with a field set,
+        `hydrate_workers` of them at a time, instead of waiting for each one
+        to be read
+
+        @param list<crunchyroll.models.Media|crunchyroll.models.Series> models
+        @return list    the same models
+        """
+        by_hydrator = {}
+        for model in models:
+            hydrator = getattr(model, '_hydrator', None)
+            if hydrator is None:
+                if model.loaded_fields is not None:
+                    # not from a listing, like an unpickled model
+                    by_hydrator.setdefault(None, []).append(model)
+                continue
+            by_hydrator.setdefault(hydrator, []).append(model)
+        orphans = by_hydrator.pop(None, None)
+        if orphans:
+            hydrator = Hydrator(self._get_full_fields, self._hydrate_batch_size,
+                self._hydrate_workers)
+            hydrator.add(orphans)
+            by_hydrator[hydrator] = orphans
+        for hydrator, thin_models in iteritems(by_hydrator):
+            hydrator.hydrate_many(thin_models)
+        return models
+
     def _get_series_query_dict(self, series):
         """Pick between collection_id and series_id params in series models for the
         Android API
@@ -458,7 +823,7 @@ class MetaApi(ApiInterface):
         @param crunchyroll.models.Series series
         @return dict
         """
-        if hasattr(series, 'series_id'):
+        if series.series_id is not None:
             return {'series_id': series.series_id}
         else:
             return {'collection_id': series.collection_id}
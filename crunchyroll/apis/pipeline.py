@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Bulk subtitle fetching
+
+Subtitle listings and Subtitle_GetXml requests run on a thread pool while the
+subtitles that have already arrived are decrypted, decompressed and formatted
+on a process pool, so the network and CPU work overlap. Results are handed
+back as they complete, and at most `max_pending` subtitles are in flight or
+waiting to be handed back at once no matter how many media items there are.
+Given a crunchyroll.subtitlestore.SubtitleStore, subtitles it already has are
+handed back without being fetched, and new ones are added to it.
+"""
+
+import base64
+import collections
+import logging
+import multiprocessing
+import sqlite3
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, \
+    wait, FIRST_COMPLETED
+
+from crunchyroll.apis.deadline import carry_deadline
+from crunchyroll.constants import META
+from crunchyroll.models import StyledSubtitle
+from crunchyroll.subtitles import SubtitleDecrypter, get_formatter
+from crunchyroll.subtitlestore import SubtitleStore
+
+logger = logging.getLogger('crunchyroll.apis.pipeline')
+
+# `stub` and `language` are None if listing the media's subtitles failed,
+# `subtitles` is {format: bytes} and None if `error` is set
+SubtitleResult = collections.namedtuple('SubtitleResult',
+    ['media', 'stub', 'language', 'subtitles', 'error'])
+
+def decrypt_and_format(subtitle_id, iv, data, formats):
+    """Turn an encrypted subtitle into formatted subtitles, runs in a worker
+    process so it only takes and returns plain values
+
+    @param int subtitle_id
+    @param str iv               base64
+    @param str data             base64
+    @param list<str> formats    crunchyroll.subtitles.FORMATTERS names
+    @return tuple               (decrypted script bytes, {format: bytes})
+    """
+    decrypter = SubtitleDecrypter()
+    script = decrypter.decrypt(decrypter._build_encryption_key(subtitle_id),
+        base64.b64decode(iv), base64.b64decode(data))
+    return format_script(script, formats)
+
+def format_script(script, formats):
+    """Format a decrypted subtitle script, runs in a worker process
+
+    @param bytes script
+    @param list<str> formats    crunchyroll.subtitles.FORMATTERS names
+    @return tuple               (script, {format: bytes})
+    """
+    return (script, StyledSubtitle(script).get_formatted(formats))
+
+def _make_process_pool(processes):
+    """Worker processes are spawned rather than forked, forking while the
+    fetch threads hold locks can leave the children deadlocked
+    """
+    try:
+        context = multiprocessing.get_context('spawn')
+    except AttributeError:
+        # py2, whose futures backport can only fork
+        return ProcessPoolExecutor(max_workers=processes)
+    return ProcessPoolExecutor(max_workers=processes, mp_context=context)
+
+class _InlineExecutor(object):
+    """Runs the CPU work on the fetch threads when there's no process pool
+    """
+
+    def __init__(self, executor):
+        self._executor = executor
+
+    def submit(self, func, *pargs):
+        return self._executor.submit(func, *pargs)
+
+    def shutdown(self, wait=True):
+        pass
+
+class SubtitlePipeline(object):
+    """Fetch, decrypt and format the subtitles of many media items
+
+    Example usage:
+        >>> pipeline = SubtitlePipeline(api.get_subtitle_stubs,
+        ...     api.unfold_subtitle_stub, formats=['srt'])
+        >>> for result in pipeline.run(media_items):
+        ...     print(result.media.media_id, result.language, result.error)
+    """
+
+    def __init__(self, list_stubs, fetch_subtitle, formats=('srt',),
+            languages=None, fetch_workers=META.SUBTITLE_FETCH_WORKERS,
+            processes=None, max_pending=META.SUBTITLE_MAX_PENDING,
+            store=None):
+        """
+        @param callable list_stubs      called with a media item, should
+                                            return its SubtitleStubs
+        @param callable fetch_subtitle  called with a SubtitleStub, should
+                                            return the Subtitle
+        @param list<str> formats        crunchyroll.subtitles.FORMATTERS names
+        @param list<str> languages      SubtitleStub.language values to fetch,
+                                            all of them if not given
+        @param int fetch_workers        concurrent requests
+        @param int processes            worker processes for decrypting and
+                                            formatting, the number of CPUs if
+                                            not given, 0 to do it on the fetch
+                                            threads
+        @param int max_pending          subtitles being fetched, decrypted or
+                                            waiting to be handed back
+        @param crunchyroll.subtitlestore.SubtitleStore|str store
+                                        where to look for subtitles before
+                                            fetching them and keep the ones
+                                            that were fetched, a path opens a
+                                            SubtitleStore there
+        """
+        for name in formats:
+            get_formatter(name)
+        self._list_stubs = list_stubs
+        self._fetch_subtitle = fetch_subtitle
+        self.formats = list(formats)
+        self.languages = None if languages is None else frozenset(languages)
+        self.fetch_workers = max(1, fetch_workers)
+        self.processes = processes
+        self.max_pending = max(1, max_pending)
+        if isinstance(store, str):
+            store = SubtitleStore(store)
+        self.store = store
+
+    def _fetch(self, stub):
+        subtitle = self._fetch_subtitle(stub)
+        # only plain values go to the worker process
+        return (int(subtitle.id), subtitle['iv'][0].text,
+            subtitle['data'][0].text)
+
+    def _get_stored(self, stub):
+        """
+        @return dict    {kind: bytes} of what the store has for the subtitle
+        """
+        if self.store is None:
+            return {}
+        try:
+            stored = self.store.get(stub.id, self.formats)
+            if len(stored) < len(self.formats):
+                # the script is only worth reading if it has to be formatted
+                stored.update(self.store.get(stub.id, [SubtitleStore.SCRIPT]))
+            return stored
+        except sqlite3.Error as err:
+            logger.warning('Failed to read subtitle %s from the store: %s',
+                stub.id, err)
+            return {}
+
+    def _put_stored(self, stub, script, formatted, fetched=True):
+        if self.store is None:
+            return
+        try:
+            self.store.put(stub.id, script, formatted, fetched)
+        except sqlite3.Error as err:
+            logger.warning('Failed to store subtitle %s: %s', stub.id, err)
+
+    def _wanted(self, stubs):
+        return [stub for stub in stubs \
+            if self.languages is None or stub.language in self.languages]
+
+    def run(self, media_items):
+        """Fetch the subtitles for every media item
+
+        @param iterable media_items     can be a generator, it's only read as
+                                            fast as there's room for more
+                                            subtitles
+        @return generator<SubtitleResult>   in the order they complete
+        """
+        fetch_executor = ThreadPoolExecutor(max_workers=self.fetch_workers)
+        if self.processes == 0:
+            cpu_executor = _InlineExecutor(fetch_executor)
+        else:
+            cpu_executor = _make_process_pool(self.processes)
+        # (media, stub) waiting for a fetch slot
+        queued = collections.deque()
+        # results from the store waiting to be handed back
+        ready = collections.deque()
+        # {future: (stage, media, stub)}
+        pending = {}
+        state = {'media_items': iter(media_items), 'listing': 0}
+
+        def submit_more():
+            while True:
+                in_flight = len(pending) - state['listing'] + len(ready)
+                if queued and in_flight < self.max_pending:
+                    media, stub = queued.popleft()
+                    stored = self._get_stored(stub)
+                    script = stored.pop(SubtitleStore.SCRIPT, None)
+                    if len(stored) == len(self.formats):
+                        ready.append(SubtitleResult(media, stub,
+                            stub.language, stored, None))
+                    elif script is not None:
+                        # only the formatting is missing
+                        pending[cpu_executor.submit(format_script, script,
+                            self.formats)] = ('reformat', media, stub)
+                    else:
+                        pending[fetch_executor.submit(
+                            carry_deadline(self._fetch), stub)] = \
+                            ('fetch', media, stub)
+                    continue
+                # only list more media once their stubs would have room
+                if state['media_items'] is None or \
+                        len(queued) + in_flight >= self.max_pending or \
+                        state['listing'] >= self.fetch_workers:
+                    return
+                try:
+                    media = next(state['media_items'])
+                except StopIteration:
+                    state['media_items'] = None
+                    return
+                state['listing'] += 1
+                pending[fetch_executor.submit(
+                    carry_deadline(self._list_stubs), media)] = \
+                    ('list', media, None)
+
+        try:
+            while True:
+                submit_more()
+                if ready:
+                    while ready:
+                        yield ready.popleft()
+                    continue
+                if not pending:
+                    return
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, media, stub = pending.pop(future)
+                    if stage == 'list':
+                        state['listing'] -= 1
+                    try:
+                        value = future.result()
+                    except Exception as err:
+                        logger.warning('Failed to %s subtitles for %r: %s',
+                            stage, media, err)
+                        yield SubtitleResult(media, stub,
+                            None if stub is None else stub.language, None, err)
+                        continue
+                    if stage == 'list':
+                        queued.extend((media, wanted_stub) \
+                            for wanted_stub in self._wanted(value))
+                    elif stage == 'fetch':
+                        pending[cpu_executor.submit(decrypt_and_format,
+                            *(value + (self.formats,)))] = ('format', media, stub)
+                    else:
+                        script, formatted = value
+                        self._put_stored(stub, script, formatted,
+                            stage != 'reformat')
+                        yield SubtitleResult(media, stub, stub.language,
+                            formatted, None)
+        finally:
+            for future in pending:
+                future.cancel()
+            cpu_executor.shutdown(wait=False)
+            fetch_executor.shutdown(wait=False)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('crunchyroll.apis.pool')
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default timeout to requests that don't
+    specify one
+    """
+
+    def __init__(self, timeout=None, **kwargs):
+        self._default_timeout = timeout
+        super(TimeoutHTTPAdapter, self).__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self._default_timeout
+        return super(TimeoutHTTPAdapter, self).send(request, timeout=timeout,
+            **kwargs)
+
+class ConnectionPool(object):
+    """HTTP connection pool config that can be shared between API instances
+
+    Each API keeps its own session (and cookies), but sessions mounted on the
+    same pool share the underlying connections so a connection to a host
+    opened by one API can be reused by the others.
+    """
+
+    POOL_FULL_BLOCK     = 'block'
+    POOL_FULL_DISCARD   = 'discard'
+
+    def __init__(self, pool_connections=4, pool_maxsize=10,
+            pool_full=POOL_FULL_DISCARD, keep_alive=True, connect_timeout=None,
+            read_timeout=None):
+        """
+        @param int pool_connections number of per-host pools to keep around
+        @param int pool_maxsize     max number of connections kept per host
+        @param str pool_full        what to do when all of a host's connections
+                                        are in use, either POOL_FULL_BLOCK to
+                                        wait for a free one or POOL_FULL_DISCARD
+                                        to open an extra connection and throw it
+                                        away after use
+        @param bool keep_alive      keep connections open between requests
+        @param float connect_timeout
+        @param float read_timeout
+        """
+        if pool_full not in (self.POOL_FULL_BLOCK, self.POOL_FULL_DISCARD):
+            raise ValueError('Invalid pool full policy: %r' % pool_full)
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_full = pool_full
+        self.keep_alive = keep_alive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._adapter = TimeoutHTTPAdapter(
+            timeout=self.timeout,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=(pool_full == self.POOL_FULL_BLOCK))
+        self._async_connector = None
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        """Timeout in the form requests wants it
+
+        @return tuple|None
+        """
+        if self.connect_timeout is None and self.read_timeout is None:
+            return None
+        return (self.connect_timeout, self.read_timeout)
+
+    def mount(self, session):
+        """Make a session use this pool for all its connections
+
+        @param requests.Session session
+        @return requests.Session
+        """
+        session.mount('http://', self._adapter)
+        session.mount('https://', self._adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def create_session(self):
+        """Create a new session using this pool
+
+        @return requests.Session
+        """
+        return self.mount(requests.Session())
+
+    @property
+    def async_connector(self):
+        """The aiohttp connector if it has been created yet
+        """
+        return self._async_connector
+
+    def get_async_connector(self):
+        """Get the aiohttp connector matching this config, it is created on
+        the first call which must be done inside a running event loop
+
+        @return aiohttp.TCPConnector
+        """
+        import aiohttp
+
+        with self._lock:
+            if self._async_connector is None or self._async_connector.closed:
+                self._async_connector = aiohttp.TCPConnector(
+                    limit=0 if self.pool_full == self.POOL_FULL_DISCARD \
+                        else self.pool_maxsize * self.pool_connections,
+                    limit_per_host=0 if self.pool_full == self.POOL_FULL_DISCARD \
+                        else self.pool_maxsize,
+                    force_close=not self.keep_alive)
+        return self._async_connector
+
+    def get_async_timeout(self):
+        """Get the aiohttp timeout matching this config
+
+        @return aiohttp.ClientTimeout
+        """
+        import aiohttp
+
+        return aiohttp.ClientTimeout(sock_connect=self.connect_timeout,
+            sock_read=self.read_timeout)
+
+    def get_stats(self):
+        """Get the connection reuse counts for each host with an open pool
+
+        Only the blocking (requests) connections are counted, and a host's
+        counts are dropped when its pool is evicted to make room for another
+        host's.
+
+        @return dict    {host: {'requests': int, 'connections': int,
+                            'reused': int}}
+        """
+        stats = {}
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host_stats = stats.setdefault(
+                '%s://%s:%s' % (pool.scheme, pool.host, pool.port),
+                {'requests': 0, 'connections': 0, 'reused': 0})
+            host_stats['requests'] += pool.num_requests
+            host_stats['connections'] += pool.num_connections
+            host_stats['reused'] += max(pool.num_requests - pool.num_connections, 0)
+        return stats
+
+    def close(self):
+        self._adapter.close()
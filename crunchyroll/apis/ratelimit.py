@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import collections
+import logging
+import threading
+import time
+
+from crunchyroll.apis.errors import ApiTimeoutException
+from crunchyroll.util import iteritems
+
+logger = logging.getLogger('crunchyroll.apis.ratelimit')
+
+# time.monotonic is py3.3+
+monotonic = getattr(time, 'monotonic', time.time)
+
+class TokenBucket(object):
+    """Classic token bucket, `rate` tokens are added per second up to `burst`
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self._tokens = self.burst
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst,
+            self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, max_delay=None):
+        """Take a token, going into debt if there are none left
+
+        @param float max_delay  don't take the token if it couldn't be used
+                                    within this many seconds, None to always
+                                    take it
+        @return float|None      seconds to wait before the token can be used,
+                                    None if it wasn't taken
+        """
+        with self._lock:
+            self._refill(monotonic())
+            delay = max(0.0, (1 - self._tokens) / self.rate)
+            if max_delay is not None and delay > max_delay:
+                return None
+            self._tokens -= 1
+            return delay
+
+    def acquire(self):
+        """Take a token, sleeping until it can be used
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    @property
+    def tokens(self):
+        with self._lock:
+            self._refill(monotonic())
+            return self._tokens
+
+class AimdController(object):
+    """Adaptive concurrency limit
+
+    The limit grows by `increase` per limit's worth of healthy requests
+    (additive increase) and is multiplied by `decrease_factor` when a request
+    fails, gets a 429/5xx response or latency climbs past `latency_tolerance`
+    times the best of the last `latency_window` latencies (multiplicative
+    decrease), so the baseline follows the server if it gets slower for good
+    instead of holding the limit down forever. Decreases happen
+    at most once per `cooldown` seconds so a burst of failures from requests
+    that were already in flight only counts once.
+    """
+
+    def __init__(self, initial_limit=8, min_limit=1, max_limit=64,
+            increase=1.0, decrease_factor=0.5, latency_tolerance=2.0,
+            cooldown=1.0, latency_window=100):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._queued = 0
+        self._latencies = collections.deque(maxlen=latency_window)
+        self._avg_latency = None
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        # futures of coroutines waiting for a slot, with their loops
+        self._async_waiters = collections.deque()
+
+    @property
+    def limit(self):
+        return max(int(self._limit), self.min_limit)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def queued(self):
+        return self._queued + len(self._async_waiters)
+
+    def try_acquire(self):
+        """Take a slot if one is free
+
+        @return bool
+        """
+        with self._cond:
+            if self._in_flight < self.limit:
+                self._in_flight += 1
+                return True
+            return False
+
+    def acquire(self, timeout=None):
+        """Take a slot, waiting for one to be free
+
+        @param float timeout    seconds to wait at most, None to wait forever
+        @return bool    False if the timeout ran out first
+        """
+        expires = None if timeout is None else monotonic() + timeout
+        with self._cond:
+            self._queued += 1
+            try:
+                while self._in_flight >= self.limit:
+                    if expires is None:
+                        self._cond.wait()
+                    else:
+                        remaining = expires - monotonic()
+                        if remaining <= 0:
+                            return False
+                        self._cond.wait(remaining)
+                self._in_flight += 1
+                return True
+            finally:
+                self._queued -= 1
+
+    def acquire_async(self):
+        """Take a slot from a coroutine
+
+        @return awaitable
+        """
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        with self._cond:
+            if self._in_flight < self.limit and not self._async_waiters:
+                self._in_flight += 1
+                future.set_result(None)
+            else:
+                self._async_waiters.append((loop, future))
+        return future
+
+    def release(self, latency=None, ok=True):
+        """Give back a slot and adjust the limit
+
+        @param float latency    seconds the request took, None if the slot
+                                    wasn't used and the limit shouldn't change
+        @param bool ok          False if the request failed or the server
+                                    said to back off
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if latency is None:
+                self._wake_waiters()
+                return
+            self._update_latency(latency)
+            now = monotonic()
+            if not ok or self._is_latency_high():
+                if now - self._last_decrease >= self.cooldown:
+                    self._last_decrease = now
+                    self._limit = max(self._limit * self.decrease_factor,
+                        self.min_limit)
+                    logger.info('Decreased concurrency limit to %d (ok=%s)',
+                        self.limit, ok)
+            else:
+                self._limit = min(self._limit + self.increase / self._limit,
+                    self.max_limit)
+            self._wake_waiters()
+
+    def _update_latency(self, latency):
+        self._latencies.append(latency)
+        if self._avg_latency is None:
+            self._avg_latency = latency
+        else:
+            self._avg_latency = 0.8 * self._avg_latency + 0.2 * latency
+
+    def _get_min_latency(self):
+        if not self._latencies:
+            return None
+        return min(self._latencies)
+
+    def _is_latency_high(self):
+        min_latency = self._get_min_latency()
+        return min_latency is not None and min_latency > 0 and \
+            self._avg_latency > min_latency * self.latency_tolerance
+
+    def _wake_waiters(self):
+        while self._in_flight < self.limit and self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            if future.cancelled():
+                continue
+            self._in_flight += 1
+            loop.call_soon_threadsafe(self._resolve_waiter, future)
+        self._cond.notify_all()
+
+    def _resolve_waiter(self, future):
+        if future.cancelled():
+            # the coroutine gave up while we were handing it the slot
+            self.release()
+        else:
+            future.set_result(None)
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                'concurrency_limit':    self.limit,
+                'in_flight':            self._in_flight,
+                'queued':               self.queued,
+                'avg_latency':          self._avg_latency,
+                'min_latency':          self._get_min_latency(),
+            }
+
+class RateLimitSlot(object):
+    """Holds a concurrency slot for one request, the request's response
+    status should be recorded before releasing it
+    """
+
+    BACKOFF_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(self, controller):
+        self._controller = controller
+        self._started = monotonic()
+        self.status_code = None
+
+    def release(self, error=None):
+        ok = error is None and self.status_code not in self.BACKOFF_STATUS_CODES
+        self._controller.release(monotonic() - self._started, ok)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release(exc_value)
+
+class RateLimiter(object):
+    """Per endpoint family request rate and concurrency limits
+
+    Each family (the Android, AJAX, manga and scraper APIs) gets a token
+    bucket for its request rate and an AimdController for how many requests
+    can be in flight at once.
+    """
+
+    FAMILY_ANDROID      = 'android'
+    FAMILY_AJAX         = 'ajax'
+    FAMILY_MANGA        = 'manga'
+    FAMILY_SCRAPER      = 'scraper'
+
+    # (requests per second, burst), CR doesn't publish its limits so these
+    # are conservative guesses
+    DEFAULT_RATES = {
+        FAMILY_ANDROID:     (10, 20),
+        FAMILY_AJAX:        (5, 10),
+        FAMILY_MANGA:       (5, 10),
+        FAMILY_SCRAPER:     (2, 4),
+    }
+
+    def __init__(self, rates=None, controller_args=None):
+        """
+        @param dict rates               {family: (rate, burst)}, merged over
+                                            DEFAULT_RATES
+        @param dict controller_args     kwargs for each family's
+                                            AimdController
+        """
+        family_rates = dict(self.DEFAULT_RATES)
+        family_rates.update(rates or {})
+        self._buckets = dict((family, TokenBucket(rate, burst)) \
+            for family, (rate, burst) in iteritems(family_rates))
+        self._controllers = dict((family, AimdController(**(controller_args or {}))) \
+            for family in family_rates)
+
+    def limit(self, family, timeout=None):
+        """Wait for the family's rate and concurrency limits to allow another
+        request
+
+        Example usage:
+            >>> with rate_limiter.limit(RateLimiter.FAMILY_ANDROID) as slot:
+            ...     resp = send_request()
+            ...     slot.status_code = resp.status_code
+
+        @param str family
+        @param float timeout    seconds to wait at most, None to wait forever
+        @return RateLimitSlot
+        @raises ApiTimeoutException if the limits don't allow a request in time
+        """
+        started = monotonic()
+        controller = self._controllers[family]
+        if not controller.acquire(timeout):
+            raise ApiTimeoutException(
+                'Timed out waiting for a {0} request slot'.format(family))
+        try:
+            # a request that's going to time out anyway shouldn't use up a
+            # token that another request could have had
+            delay = self._buckets[family].reserve(None if timeout is None \
+                else timeout - (monotonic() - started))
+            if delay is None:
+                raise ApiTimeoutException(
+                    'Timed out waiting for the {0} request rate'.format(family))
+            if delay > 0:
+                time.sleep(delay)
+        except BaseException:
+            controller.release()
+            raise
+        return RateLimitSlot(controller)
+
+    def get_bucket(self, family):
+        return self._buckets[family]
+
+    def get_controller(self, family):
+        return self._controllers[family]
+
+    def get_stats(self):
+        """Get the current limits and queue depth for each family
+
+        @return dict
+        """
+        stats = {}
+        for family, controller in iteritems(self._controllers):
+            bucket = self._buckets[family]
+            stats[family] = controller.get_stats()
+            stats[family].update({
+                'rate':     bucket.rate,
+                'burst':    bucket.burst,
+                'tokens':   bucket.tokens,
+            })
+        return stats
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_tz, mktime_tz
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+from crunchyroll.apis.errors import ApiCircuitOpenException
+from crunchyroll.apis.ratelimit import monotonic
+from crunchyroll.util import iteritems
+
+logger = logging.getLogger('crunchyroll.apis.retry')
+
+class RetryPolicy(object):
+    """When and how long to wait before retrying a failed request
+
+    Only requests that are safe to send twice are retried: GETs by default,
+    anything else only if the API method says it is idempotent. Delays grow
+    exponentially with full jitter so a burst of failing requests doesn't
+    retry in lockstep, and a Retry-After header from the server takes
+    precedence over the computed delay.
+    """
+
+    RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+    IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+    def __init__(self, max_attempts=3, backoff_base=0.5, backoff_max=30.0,
+            deadline=None, retry_status_codes=None, methods=None):
+        """
+        @param int max_attempts         total attempts including the first,
+                                            1 disables retrying
+        @param float backoff_base       seconds, the delay cap doubles with
+                                            each attempt starting from this
+        @param float backoff_max        longest delay to wait, a Retry-After
+                                            past this isn't retried at all
+        @param float deadline           seconds all attempts of one request
+                                            must fit in, None for no limit
+        @param set retry_status_codes   replaces RETRY_STATUS_CODES
+        @param set methods              HTTP methods that are always retried,
+                                            replaces IDEMPOTENT_METHODS
+        """
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.retry_status_codes = frozenset(self.RETRY_STATUS_CODES \
+            if retry_status_codes is None else retry_status_codes)
+        self.methods = frozenset(m.upper() for m in (self.IDEMPOTENT_METHODS \
+            if methods is None else methods))
+
+    def can_retry(self, method, idempotent=None):
+        """Check if a request may be sent more than once
+
+        @param str method
+        @param bool idempotent  set by API methods that know better than the
+                                    HTTP method, None to go by the HTTP method
+        @return bool
+        """
+        if self.max_attempts < 2:
+            return False
+        if idempotent is not None:
+            return idempotent
+        return method.upper() in self.methods
+
+    def should_retry_status(self, status_code):
+        return status_code in self.retry_status_codes
+
+    def get_delay(self, attempt, elapsed, retry_after=None):
+        """Get how long to wait before the next attempt
+
+        @param int attempt          number of attempts made so far
+        @param float elapsed        seconds since the first attempt started
+        @param str retry_after      Retry-After header value, if any
+        @return float|None  None if the request shouldn't be retried
+        """
+        if attempt >= self.max_attempts:
+            return None
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            delay = random.uniform(0,
+                min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+        elif delay > self.backoff_max:
+            logger.info('Not waiting %.1fs for Retry-After', delay)
+            return None
+        if self.deadline is not None and elapsed + delay >= self.deadline:
+            return None
+        return delay
+
+def parse_retry_after(value):
+    """Parse a Retry-After header, which is either a number of seconds or an
+    HTTP date
+
+    @param str value
+    @return float|None
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(mktime_tz(parsed) - time.time(), 0.0)
+
+class CircuitBreaker(object):
+    """Per host circuit breaker
+
+    After `failure_threshold` consecutive failures (network errors or 5xx
+    responses) requests to the host fail immediately with
+    ApiCircuitOpenException. Once `reset_timeout` seconds have passed a
+    single request is let through to probe the host, the circuit closes again
+    if it succeeds.
+    """
+
+    STATE_CLOSED    = 'closed'
+    STATE_OPEN      = 'open'
+    STATE_HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        # {host: [state, consecutive failures, when opened/last probed]}
+        self._hosts = {}
+
+    def _get_host(self, url):
+        return urlparse(url).netloc
+
+    def before_request(self, url):
+        """Check if a request to `url`'s host is allowed
+
+        @param str url
+        @raises ApiCircuitOpenException if the host is considered down
+        """
+        host = self._get_host(url)
+        with self._lock:
+            host_state = self._hosts.get(host)
+            if host_state is None or host_state[0] == self.STATE_CLOSED:
+                return
+            now = monotonic()
+            if now - host_state[2] < self.reset_timeout:
+                raise ApiCircuitOpenException(
+                    'Circuit open for {0}, failing fast'.format(host))
+            # let this request probe the host, others keep failing fast until
+            # it finishes or another reset_timeout passes
+            host_state[0] = self.STATE_HALF_OPEN
+            host_state[2] = now
+
+    def record_success(self, url):
+        host = self._get_host(url)
+        with self._lock:
+            host_state = self._hosts.get(host)
+            if host_state is not None:
+                if host_state[0] != self.STATE_CLOSED:
+                    logger.info('Circuit closed for %s', host)
+                host_state[0] = self.STATE_CLOSED
+                host_state[1] = 0
+
+    def record_failure(self, url):
+        host = self._get_host(url)
+        with self._lock:
+            host_state = self._hosts.setdefault(host,
+                [self.STATE_CLOSED, 0, 0.0])
+            host_state[1] += 1
+            if host_state[0] == self.STATE_HALF_OPEN or \
+                    host_state[1] >= self.failure_threshold:
+                if host_state[0] != self.STATE_OPEN:
+                    logger.warning('Circuit opened for %s after %d failures',
+                        host, host_state[1])
+                host_state[0] = self.STATE_OPEN
+                host_state[2] = monotonic()
+
+    def record_response(self, url, status_code):
+        if status_code >= 500:
+            self.record_failure(url)
+        else:
+            self.record_success(url)
+
+    def get_state(self, url):
+        with self._lock:
+            host_state = self._hosts.get(self._get_host(url))
+            return self.STATE_CLOSED if host_state is None else host_state[0]
+
+    def get_stats(self):
+        """Get the state of every host that has failed at some point
+
+        @return dict    {host: {'state': str, 'failures': int}}
+        """
+        with self._lock:
+            return dict((host, {'state': state, 'failures': failures}) \
+                for host, (state, failures, _) in iteritems(self._hosts))
@@ -20,6 +20,8 @@ import re
 import json
 
 from crunchyroll.apis import ApiInterface
+from crunchyroll.apis.ratelimit import RateLimiter
+from crunchyroll.apis.retry import RetryPolicy
 from crunchyroll.constants import SCRAPER
 from crunchyroll.apis.errors import *
 from crunchyroll.util import iteritems
@@ -28,26 +30,54 @@ class ScraperApi(ApiInterface):
     """Website scraper API
     """
 
-    def __init__(self, connector):
+    RATE_LIMIT_FAMILY = RateLimiter.FAMILY_SCRAPER
+
+    def __init__(self, connector, rate_limiter=None, retry_policy=None,
+            circuit_breaker=None):
+        """
+        @param requests.Session connector   usually the AJAX API's session so
+                                                the login cookies are sent
+        @param crunchyroll.apis.ratelimit.RateLimiter rate_limiter
+        @param crunchyroll.apis.retry.RetryPolicy retry_policy
+        @param crunchyroll.apis.retry.CircuitBreaker circuit_breaker
+        """
         self._connector = connector
+        self._rate_limiter = rate_limiter
+        self._retry_policy = retry_policy if retry_policy is not None \
+            else RetryPolicy()
+        self._circuit_breaker = circuit_breaker
 
     def get_media_formats(self, media_id):
         """CR doesn't seem to provide the video_format and video_quality params
         through any of the APIs so we have to scrape the video page
         """
-        url = (SCRAPER.API_URL + 'media-' + media_id).format(
-            protocol=SCRAPER.PROTOCOL_INSECURE)
-        format_pattern = re.compile(SCRAPER.VIDEO.FORMAT_PATTERN)
+        url = self._build_media_url(media_id)
         formats = {}
 
         for format, param in iteritems(SCRAPER.VIDEO.FORMAT_PARAMS):
-            resp = self._connector.get(url, params={param: '1'})
+            resp = self._send_request('GET', url, params={param: '1'})
             if not resp.ok:
                 continue
-            try:
-                match = format_pattern.search(resp.content)
-            except TypeError:
-                match = format_pattern.search(resp.text)
+            match = self._search_media_format(resp)
             if match:
-                formats[format] = (int(match.group(1)), int(match.group(2)))
+                formats[format] = match
         return formats
+
+    def _build_media_url(self, media_id):
+        return (SCRAPER.API_URL + 'media-' + media_id).format(
+            protocol=SCRAPER.PROTOCOL_INSECURE)
+
+    def _search_media_format(self, resp):
+        """Pull the (video_format, video_quality) pair out of a video page
+
+        @param requests.Response resp
+        @return tuple|None
+        """
+        format_pattern = re.compile(SCRAPER.VIDEO.FORMAT_PATTERN)
+        try:
+            match = format_pattern.search(resp.content)
+        except TypeError:
+            match = format_pattern.search(resp.text)
+        if match:
+            return (int(match.group(1)), int(match.group(2)))
+        return None
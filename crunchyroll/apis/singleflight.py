@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import logging
+import threading
+
+from crunchyroll.apis.deadline import get_remaining
+from crunchyroll.apis.errors import ApiTimeoutException
+from crunchyroll.util import iteritems
+
+logger = logging.getLogger('crunchyroll.apis.singleflight')
+
+def make_request_key(req_url, params):
+    """Build the key identifying identical requests
+
+    @param str req_url
+    @param dict params
+    @return tuple
+    """
+    return (req_url, tuple(sorted((k, str(v)) \
+        for k, v in iteritems(params or {}) if v is not None)))
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    """Make concurrent calls with the same key share a single call, every
+    caller gets its result (or its exception)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {
+            'calls':        0,
+            'coalesced':    0,
+        }
+
+    def do(self, key, func):
+        """Call `func` unless a call for `key` is already in flight, in which
+        case wait for that one to finish and use its result
+
+        @param hashable key
+        @param callable func
+        @return mixed
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                is_leader = True
+                self._stats['calls'] += 1
+            else:
+                is_leader = False
+                self._stats['coalesced'] += 1
+
+        if not is_leader:
+            logger.debug('Waiting on in-flight call: %r', key)
+            # the leader's call may have a longer deadline than ours
+            remaining = get_remaining()
+            if not call.done.wait(None if remaining is None \
+                    else max(remaining, 0)):
+                raise ApiTimeoutException(
+                    'Deadline exceeded waiting on in-flight call')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+class AsyncSingleFlight(object):
+    """asyncio version of `SingleFlight`, the call runs as its own task so
+    cancelling one of the callers doesn't cancel it for the others
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._stats = {
+            'calls':        0,
+            'coalesced':    0,
+        }
+
+    def do(self, key, coro_func):
+        """Run `coro_func()` unless a call for `key` is already in flight
+
+        @param hashable key
+        @param callable coro_func
+        @return awaitable
+        """
+        import asyncio
+
+        task = self._calls.get(key)
+        if task is None:
+            self._stats['calls'] += 1
+            task = self._calls[key] = asyncio.ensure_future(coro_func())
+
+            def forget(finished_task):
+                if self._calls.get(key) is finished_task:
+                    del self._calls[key]
+            task.add_done_callback(forget)
+        else:
+            logger.debug('Waiting on in-flight call: %r', key)
+            self._stats['coalesced'] += 1
+        return asyncio.shield(task)
+
+    def get_stats(self):
+        stats = dict(self._stats)
+        stats['in_flight'] = len(self._calls)
+        return stats
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Incremental parsing of listing responses
+
+The response body is read a chunk at a time and each element of the `data`
+list is decoded with JSONDecoder.raw_decode() as soon as all of it has
+arrived, so the first item is available before the rest of the body has been
+downloaded and only one element is held in memory at a time. The other keys
+of the response envelope (`error`, `code`, `message`) are still checked, an
+error response raises ApiError like a normal request would. The envelope's
+keys can come in any order though, so when `error` comes after the list the
+error is only known once the list has been read: the elements are yielded
+as they arrive and the ApiError is raised at the end, callers have to be
+ready to throw away what they've already been given.
+
+Only the stdlib decoder can parse a value out of a longer string, so the
+faster crunchyroll.jsonbackend backends aren't used here.
+"""
+
+import codecs
+import json
+import re
+
+from crunchyroll.apis.errors import ApiError, ApiBadResponseException
+
+# bytes read from the response at a time
+STREAM_CHUNK_SIZE = 16 * 1024
+
+_WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+# what can follow a complete value
+_DELIMITERS = frozenset(u' \t\n\r,:]}')
+
+class JsonListStream(object):
+    """Parser for a response that is either a `{"data": [...], ...}` envelope
+    or a bare list, iterating over it yields the elements of the list
+
+    An error in the envelope raises ApiError once it's been read, which may
+    be after some (or all) of the list has been yielded, an error seen
+    before the list means nothing is yielded.
+
+    Example usage:
+        >>> for item in JsonListStream(resp.iter_content(STREAM_CHUNK_SIZE)):
+        ...     print(item['media_id'])
+    """
+
+    def __init__(self, chunks, list_key='data'):
+        """
+        @param iterable chunks  response body as bytes
+        @param str list_key     envelope key of the list to stream
+        """
+        self._chunks = iter(chunks)
+        self._list_key = list_key
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buf = u''
+        self._pos = 0
+        self._eof = False
+        # every envelope key except the streamed list
+        self.envelope = {}
+
+    def _fill(self):
+        """Read another chunk into the buffer
+
+        @return bool    False if the body has been read completely
+        """
+        if self._eof:
+            return False
+        # drop what's been parsed already so the buffer doesn't grow with the
+        # size of the response
+        if self._pos:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        for chunk in self._chunks:
+            text = self._text_decoder.decode(chunk)
+            if text:
+                self._buf += text
+                return True
+        self._buf += self._text_decoder.decode(b'', True)
+        self._eof = True
+        return True
+
+    def _peek(self):
+        """Skip whitespace and get the next character, None at the end of the
+        body
+        """
+        while True:
+            self._pos = _WHITESPACE_RE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return None
+
+    def _expect(self, chars):
+        char = self._peek()
+        if char is None or char not in chars:
+            raise ApiBadResponseException(
+                'Expected one of {0!r} at {1!r}'.format(chars,
+                    self._buf[self._pos:self._pos + 40]))
+        self._pos += 1
+        return char
+
+    def _decode_value(self):
+        """Decode the next complete value, reading more of the body as needed
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if self._eof:
+                    raise ApiBadResponseException(
+                        'Invalid JSON at {0!r}'.format(
+                            self._buf[self._pos:self._pos + 40]))
+            else:
+                # a number at the end of what's been read so far might
+                # continue in the next chunk ("-1" of "-1.5e3")
+                if self._eof or (end < len(self._buf) and \
+                        self._buf[end] in _DELIMITERS):
+                    self._pos = end
+                    return value
+            self._fill()
+
+    def _iter_list(self):
+        """Yield the elements of the list whose opening [ was just read
+        """
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._decode_value()
+            if self._expect(',]') == ']':
+                return
+
+    def _check_envelope(self):
+        if self.envelope.get('error'):
+            raise ApiError('%s: %s' % (self.envelope.get('code'),
+                self.envelope.get('message')))
+
+    def __iter__(self):
+        start = self._expect('{[')
+        if start == '[':
+            for item in self._iter_list():
+                yield item
+            return
+        found_list = False
+        if self._peek() == '}':
+            self._pos += 1
+        else:
+            while True:
+                key = self._decode_value()
+                self._expect(':')
+                # an error response's data isn't what was asked for, it's
+                # parsed whole and never yielded
+                if key == self._list_key and not self.envelope.get('error') \
+                        and self._peek() == '[':
+                    self._pos += 1
+                    found_list = True
+                    for item in self._iter_list():
+                        yield item
+                else:
+                    self.envelope[key] = self._decode_value()
+                if self._expect(',}') == '}':
+                    break
+        self._check_envelope()
+        if not found_list:
+            raise ApiBadResponseException(
+                'Response has no {0} list'.format(self._list_key))
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Column oriented collection of media for filtering and sorting large episode
+listings
+
+The hot fields of each media item are pulled out into typed columns the first
+time they're used, filters and sorts work on the columns and only produce a
+new row selection, `Media` objects are only built for the rows that are
+actually read. numpy is used for the columns if it's installed, otherwise
+they are stdlib arrays and the comparisons are plain loops.
+
+Example usage:
+    >>> episodes = api.list_media_collection(series)
+    >>> free = episodes[episodes['free_available'] & ~episodes['clip']]
+    >>> free.sort_by('episode_number')[:10].to_list()
+"""
+
+import array
+import math
+import operator
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from crunchyroll.models import DictModel, Media
+
+NAN = float('nan')
+
+KIND_STR    = 'str'
+KIND_FLOAT  = 'float'
+KIND_BOOL   = 'bool'
+
+def _to_float(value):
+    if value is None or value == '':
+        return NAN
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+EPISODE_NUMBER_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)')
+
+def _to_sort_key(value):
+    # episode numbers are strings like '12', '12.5', '12.5a', 'SP1' or 'OVA',
+    # only a leading number gives a key so the others sort last
+    match = EPISODE_NUMBER_PATTERN.match(value or '')
+    if match is None:
+        return NAN
+    return float(match.group(1))
+
+def _to_bool(value):
+    if value in ('0', 'false', 'False'):
+        return False
+    return bool(value)
+
+class Mask(object):
+    """Row selection produced by comparing a column, combine with &, | and ~
+    """
+
+    __slots__ = ('values',)
+
+    def __init__(self, values):
+        self.values = values
+
+    def _combine(self, other, op):
+        other_values = other.values if isinstance(other, (Mask, Column)) \
+            else other
+        if numpy is not None:
+            return Mask(op(numpy.asarray(self.values, dtype=bool),
+                numpy.asarray(other_values, dtype=bool)))
+        return Mask([op(bool(a), bool(b)) \
+            for a, b in zip(self.values, other_values)])
+
+    def __and__(self, other):
+        return self._combine(other, operator.and_)
+
+    def __or__(self, other):
+        return self._combine(other, operator.or_)
+
+    def __xor__(self, other):
+        return self._combine(other, operator.xor)
+
+    def __invert__(self):
+        if numpy is not None:
+            return Mask(~numpy.asarray(self.values, dtype=bool))
+        return Mask([not v for v in self.values])
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return (bool(v) for v in self.values)
+
+    def count(self):
+        """Number of selected rows
+        """
+        if numpy is not None:
+            return int(numpy.count_nonzero(self.values))
+        return sum(1 for v in self.values if v)
+
+class Column(object):
+    """Values of one field for every row of a `MediaCollection`, comparing a
+    column gives a `Mask`
+    """
+
+    __slots__ = ('name', 'kind', 'values')
+
+    def __init__(self, name, kind, values):
+        self.name = name
+        self.kind = kind
+        self.values = values
+
+    def _coerce(self, other):
+        if self.kind == KIND_FLOAT:
+            return _to_float(other)
+        if self.kind == KIND_BOOL:
+            return _to_bool(other)
+        return other
+
+    def _compare(self, other, op):
+        other = self._coerce(other)
+        if numpy is not None and self.kind != KIND_STR:
+            return Mask(op(self.values, other))
+        return Mask([op(v, other) for v in self.values])
+
+    def __eq__(self, other):
+        return self._compare(other, operator.eq)
+
+    def __ne__(self, other):
+        if self.kind == KIND_FLOAT:
+            # NaN (missing) never equals anything
+            return ~self._compare(other, operator.eq)
+        return self._compare(other, operator.ne)
+
+    def __lt__(self, other):
+        return self._compare(other, operator.lt)
+
+    def __le__(self, other):
+        return self._compare(other, operator.le)
+
+    def __gt__(self, other):
+        return self._compare(other, operator.gt)
+
+    def __ge__(self, other):
+        return self._compare(other, operator.ge)
+
+    __hash__ = None
+
+    def __and__(self, other):
+        return self.as_mask() & other
+
+    def __or__(self, other):
+        return self.as_mask() | other
+
+    def __invert__(self):
+        return ~self.as_mask()
+
+    def isin(self, values):
+        """Select the rows whose value is one of `values`
+
+        @param iterable values
+        @return Mask
+        """
+        values = set(self._coerce(v) for v in values)
+        if numpy is not None and self.kind != KIND_STR:
+            return Mask(numpy.isin(self.values, list(values)))
+        return Mask([v in values for v in self.values])
+
+    def isnull(self):
+        """Select the rows that don't have a value for this field
+        """
+        if self.kind == KIND_FLOAT:
+            if numpy is not None:
+                return Mask(numpy.isnan(self.values))
+            return Mask([math.isnan(v) for v in self.values])
+        return Mask([v is None for v in self.values])
+
+    def as_mask(self):
+        if self.kind != KIND_BOOL:
+            raise TypeError('Only bool columns can be used as a mask: %s' % \
+                self.name)
+        return Mask(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def to_list(self):
+        return list(self.values)
+
+    def __repr__(self):
+        return '<Column(%s, %d rows)>' % (self.name, len(self.values))
+
+# columns computed from another field instead of read from the items,
+# name -> (source field, conversion)
+DERIVED = {
+    'episode_sort_key':     ('episode_number', _to_sort_key),
+}
+
+class _MediaStore(object):
+    """Rows and full-length columns shared by a collection and every
+    collection filtered, sorted or sliced from it
+    """
+
+    __slots__ = ('items', 'rows', 'columns')
+
+    def __init__(self, items):
+        self.items = items
+        self.rows = [None] * len(items)
+        self.columns = {}
+
+    def get_row(self, i):
+        row = self.rows[i]
+        if row is None:
+            item = self.items[i]
+            row = self.rows[i] = item if isinstance(item, DictModel) \
+                else Media(item)
+        return row
+
+    def get_values(self, name, kind):
+        values = self.columns.get(name)
+        if values is not None:
+            return values
+        field, convert = DERIVED.get(name, (name, None))
+        raw = [item.get(field) if isinstance(item, dict) \
+            else getattr(item, field) for item in self.items]
+        if convert is not None:
+            raw = [convert(v) for v in raw]
+        if kind == KIND_FLOAT:
+            raw = [_to_float(v) for v in raw]
+            values = numpy.array(raw, dtype=float) if numpy is not None \
+                else array.array('d', raw)
+        elif kind == KIND_BOOL:
+            raw = [_to_bool(v) for v in raw]
+            values = numpy.array(raw, dtype=bool) if numpy is not None \
+                else array.array('b', raw)
+        else:
+            values = raw
+        self.columns[name] = values
+        return values
+
+class MediaCollection(object):
+    """Media listing stored as columns, see the module docs
+
+    Indexing with an int gives a `Media`, with a slice, a `Mask` or a bool
+    column gives a new collection and with a field name gives a `Column`.
+    """
+
+    # fields that get typed columns, any other field can still be used as a
+    # column of plain values
+    COLUMNS = {
+        'media_id':             KIND_STR,
+        'series_id':            KIND_STR,
+        'collection_id':        KIND_STR,
+        'name':                 KIND_STR,
+        'media_type':           KIND_STR,
+        'episode_number':       KIND_STR,
+        'episode_sort_key':     KIND_FLOAT,
+        'duration':             KIND_FLOAT,
+        'playhead':             KIND_FLOAT,
+        'available':            KIND_BOOL,
+        'free_available':       KIND_BOOL,
+        'premium_available':    KIND_BOOL,
+        'clip':                 KIND_BOOL,
+    }
+
+    # fields that are sorted by another column instead of their own values
+    SORT_KEYS = {
+        'episode_number':       'episode_sort_key',
+    }
+
+    def __init__(self, items, _store=None, _index=None):
+        """
+        @param list items   raw media dicts or `Media` objects
+        """
+        self._store = _store if _store is not None else _MediaStore(list(items))
+        # row numbers in the store, None for all of them in order
+        self._index = _index
+
+    def _get_index(self):
+        if self._index is None:
+            return range(len(self._store.items))
+        return self._index
+
+    def _subset(self, index):
+        return MediaCollection(None, _store=self._store, _index=index)
+
+    def __len__(self):
+        if self._index is None:
+            return len(self._store.items)
+        return len(self._index)
+
+    def __iter__(self):
+        get_row = self._store.get_row
+        for i in self._get_index():
+            yield get_row(int(i))
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self._store.get_row(int(self._get_index()[key]))
+        if isinstance(key, slice):
+            index = self._get_index()[key]
+            if not isinstance(index, list) and \
+                    (numpy is None or not isinstance(index, numpy.ndarray)):
+                index = list(index)
+            return self._subset(index)
+        if isinstance(key, (Mask, Column)):
+            return self.filter(key)
+        return self.column(key)
+
+    def column(self, name):
+        """Get the values of a field for the rows in this collection
+
+        @param str name
+        @return Column
+        """
+        kind = self.COLUMNS.get(name, KIND_STR)
+        values = self._store.get_values(name, kind)
+        if self._index is not None:
+            if numpy is not None and kind != KIND_STR:
+                values = values[numpy.asarray(self._index, dtype=int)]
+            else:
+                values = [values[i] for i in self._index]
+        return Column(name, kind, values)
+
+    def filter(self, mask):
+        """Get the rows selected by `mask`
+
+        @param Mask mask    from comparing a column of this collection, or a
+                                bool column
+        @return MediaCollection
+        """
+        if isinstance(mask, Column):
+            mask = mask.as_mask()
+        if len(mask) != len(self):
+            raise ValueError('Mask has %d rows, collection has %d' % \
+                (len(mask), len(self)))
+        if numpy is not None:
+            positions = numpy.flatnonzero(numpy.asarray(mask.values,
+                dtype=bool))
+            index = positions if self._index is None \
+                else numpy.asarray(self._index, dtype=int)[positions]
+        else:
+            all_rows = self._get_index()
+            index = [all_rows[i] for i, selected in enumerate(mask.values) \
+                if selected]
+        return self._subset(index)
+
+    def where(self, **conditions):
+        """Get the rows where every given field has the given value
+
+        Example usage:
+            >>> episodes.where(free_available=True, clip=False)
+
+        @return MediaCollection
+        """
+        mask = None
+        for name, value in sorted(conditions.items()):
+            field_mask = self.column(name) == value
+            mask = field_mask if mask is None else mask & field_mask
+        if mask is None:
+            return self
+        return self.filter(mask)
+
+    def sort_by(self, name, reverse=False):
+        """Get the rows ordered by a field, rows without a value go last
+
+        Episode numbers are ordered by their leading number, ones without a
+        number (like 'OVA') count as not having a value.
+
+        @param str name
+        @param bool reverse
+        @return MediaCollection
+        """
+        column = self.column(self.SORT_KEYS.get(name, name))
+        index = self._get_index()
+        if numpy is not None and column.kind != KIND_STR:
+            values = numpy.asarray(column.values, dtype=float)
+            if column.kind == KIND_FLOAT and reverse:
+                # keep NaNs at the end
+                order = numpy.argsort(numpy.where(numpy.isnan(values),
+                    numpy.inf, -values), kind='stable')
+            else:
+                order = numpy.argsort(-values if reverse else values,
+                    kind='stable')
+            return self._subset(numpy.asarray(index, dtype=int)[order])
+        if column.kind == KIND_FLOAT:
+            present = [i for i in range(len(column)) \
+                if not math.isnan(column.values[i])]
+            missing = [i for i in range(len(column)) \
+                if math.isnan(column.values[i])]
+        else:
+            present = [i for i in range(len(column)) \
+                if column.values[i] is not None]
+            missing = [i for i in range(len(column)) \
+                if column.values[i] is None]
+        present.sort(key=lambda i: column.values[i], reverse=reverse)
+        return self._subset([index[i] for i in present + missing])
+
+    def to_list(self):
+        """Get the rows as a plain list of `Media`
+
+        @return list<crunchyroll.models.Media>
+        """
+        return list(self)
+
+    def __repr__(self):
+        return '<MediaCollection(%d rows)>' % len(self)
@@ -149,6 +149,8 @@ class SCRAPER(API):
 class META(API):
     MAX_SERIES          = 500
     MAX_MEDIA           = 1000
+    # default page size for the iter_* methods
+    PAGE_SIZE           = 100
 
     TYPE_ANIME          = ANDROID.MEDIA_TYPE_ANIME
     TYPE_DRAMA          = ANDROID.MEDIA_TYPE_DRAMA
@@ -163,6 +165,53 @@ class META(API):
     SORT_ASC            = ANDROID.FILTER_ASC
     SORT_DESC           = ANDROID.FILTER_DESC
 
+    # field sets for the `fields` param of the series/media listing and
+    # search methods, the models they return only have these fields
+    FIELDS_IDS          = (
+        ANDROID.FIELD.SERIES_ID,
+        ANDROID.FIELD.MEDIA_ID,
+    )
+    # enough to show a series or episode in a list
+    FIELDS_BROWSE       = FIELDS_IDS + (
+        ANDROID.FIELD.SERIES_NAME,
+        ANDROID.FIELD.SERIES_MEDIA_TYPE,
+        ANDROID.FIELD.SERIES_MEDIA_COUNT,
+        ANDROID.FIELD.SERIES_IN_QUEUE,
+        ANDROID.FIELD.SERIES_LANDSCAPE_IMAGE,
+        ANDROID.FIELD.SERIES_PORTRAIT_IMAGE,
+        ANDROID.FIELD.MEDIA_NAME,
+        ANDROID.FIELD.MEDIA_TYPE,
+        ANDROID.FIELD.MEDIA_EPISODE_NUMBER,
+        ANDROID.FIELD.MEDIA_SCREENSHOT_IMAGE,
+        ANDROID.FIELD.MEDIA_FREE_AVAILABLE,
+        ANDROID.FIELD.MEDIA_PREMIUM_AVAILABLE,
+    )
+    # enough to pick an episode and start playing it
+    FIELDS_PLAYBACK     = FIELDS_IDS + (
+        ANDROID.FIELD.SERIES_NAME,
+        ANDROID.FIELD.MEDIA_NAME,
+        ANDROID.FIELD.MEDIA_EPISODE_NUMBER,
+        ANDROID.FIELD.MEDIA_FREE_AVAILABLE,
+        ANDROID.FIELD.MEDIA_PREMIUM_AVAILABLE,
+        ANDROID.FIELD.MEDIA_PLAYHEAD,
+        ANDROID.FIELD.MEDIA_STREAM_DATA,
+    )
+
+    # models fetched with a field set fill in the rest when one is read, this
+    # many at a time from the same listing with this many requests at once
+    HYDRATE_BATCH_SIZE  = 10
+    HYDRATE_WORKERS     = 4
+    # concurrent requests for bulk subtitle fetching, and the most subtitles
+    # fetched but not yet handed back at once
+    SUBTITLE_FETCH_WORKERS  = 8
+    SUBTITLE_MAX_PENDING    = 32
+    # decrypted and formatted subtitles kept on disk, how long to wait on
+    # another process writing to the same store, and how long a fetched
+    # subtitle is trusted before it's fetched again
+    SUBTITLE_STORE_SIZE     = 256 * 1024 * 1024
+    SUBTITLE_STORE_TIMEOUT  = 30.0
+    SUBTITLE_STORE_MAX_AGE  = 7 * 24 * 60 * 60
+
     VIDEO = AJAX.VIDEO
 
     # normally you would need the player revision to generate this URL, but
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import logging
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from crunchyroll.apis.deadline import carry_deadline
+from crunchyroll.constants import META
+
+logger = logging.getLogger('crunchyroll.crawler')
+
+CrawlResult = namedtuple('CrawlResult', ['media_type', 'series', 'media', 'error'])
+
+class CatalogCrawler(object):
+    """Crawl the whole anime/drama catalog and the media of every series with
+    a pool of worker threads
+
+    The series listing is split into offset windows that are fetched
+    concurrently, and `list_media` is called for each new series as soon as
+    it shows up. Results are yielded as they complete, not in catalog order.
+
+    Example usage:
+        >>> crawler = CatalogCrawler(MetaApi(), workers=16)
+        >>> for result in crawler.crawl():
+        ...     print result.series.name, len(result.media or [])
+    """
+
+    def __init__(self, api, workers=8, window_size=META.PAGE_SIZE,
+            media_types=(META.TYPE_ANIME, META.TYPE_DRAMA), sort=META.SORT_ALPHA,
+            media_limit=META.MAX_MEDIA, max_pending=None):
+        """
+        @param crunchyroll.apis.meta.MetaApi api
+        @param int workers          number of concurrent requests
+        @param int window_size      number of series to fetch per request
+        @param list media_types     any of META.TYPE_*
+        @param str sort             series listing order, one of META.SORT_*
+        @param int media_limit      max number of media to fetch per series
+        @param int max_pending      most media listings submitted or waiting
+                                        to be handed back at once, twice
+                                        `workers` if not given
+        """
+        self._api = api
+        self.workers = workers
+        self.window_size = window_size
+        self.media_types = list(media_types)
+        self.sort = sort
+        self.media_limit = media_limit
+        self.max_pending = max(1, max_pending if max_pending is not None \
+            else 2 * workers)
+
+    def _list_series(self, media_type, offset):
+        if media_type == META.TYPE_ANIME:
+            list_func = self._api.list_anime_series
+        elif media_type == META.TYPE_DRAMA:
+            list_func = self._api.list_drama_series
+        else:
+            raise ValueError('Unknown media type: %r' % media_type)
+        return list_func(sort=self.sort, limit=self.window_size, offset=offset)
+
+    def _list_media(self, series):
+        return self._api.list_media(series, limit=self.media_limit)
+
+    def _get_series_key(self, series):
+        return tuple(sorted(self._api._get_series_query_dict(series).items()))
+
+    def crawl(self):
+        """Crawl the catalog
+
+        A window failing is fatal since the catalog would be incomplete, a
+        series' media failing is yielded as a result with `error` set.
+
+        @return generator<CrawlResult>
+        """
+        # do this up front, otherwise every worker would try to start its own
+        # session
+        if not self._api.session_started:
+            self._api.start_session()
+
+        seen_series = set()
+        # per media type, the next window offset or None once the listing
+        # has run out
+        next_offsets = dict((media_type, 0) for media_type in self.media_types)
+        # (media_type, series) waiting for a media listing slot
+        queued = deque()
+        pending = {}
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        def submit_more():
+            media_pending = sum(1 for job in pending.values() \
+                if job[0] == 'media')
+            while queued and media_pending < self.max_pending:
+                media_type, series = queued.popleft()
+                pending[executor.submit(carry_deadline(self._list_media),
+                    series)] = \
+                    ('media', media_type, series)
+                media_pending += 1
+            # keep up to `workers` windows in flight across media types, but
+            # only list more series once the ones found so far have room
+            if len(queued) >= self.max_pending:
+                return
+            windows_pending = len(pending) - media_pending
+            for media_type in self.media_types:
+                while next_offsets[media_type] is not None and \
+                        windows_pending < self.workers:
+                    offset = next_offsets[media_type]
+                    future = executor.submit(
+                        carry_deadline(self._list_series), media_type, offset)
+                    pending[future] = ('window', media_type, offset)
+                    next_offsets[media_type] = offset + self.window_size
+                    windows_pending += 1
+
+        try:
+            submit_more()
+            while pending:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = pending.pop(future)
+                    if job[0] == 'window':
+                        _, media_type, offset = job
+                        series_list = future.result()
+                        logger.debug('Got %d %s series at offset %d',
+                            len(series_list), media_type, offset)
+                        if len(series_list) < self.window_size:
+                            next_offsets[media_type] = None
+                        for series in series_list:
+                            series_key = self._get_series_key(series)
+                            if series_key in seen_series:
+                                continue
+                            seen_series.add(series_key)
+                            queued.append((media_type, series))
+                    else:
+                        _, media_type, series = job
+                        try:
+                            media, error = future.result(), None
+                        except Exception as err:
+                            logger.warning('Failed to list media for %r: %s',
+                                series, err)
+                            media, error = None, err
+                        yield CrawlResult(media_type, series, media, error)
+                submit_more()
+        finally:
+            # stopping early (or a window failing) shouldn't wait for the
+            # rest of the catalog to be fetched
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
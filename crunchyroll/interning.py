@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Value interning for models
+
+Every response decodes its own copy of values that repeat across the whole
+catalog: publisher names, media types, availability notes, dates, locale
+codes and identical image dicts. With an intern table enabled, the fields of
+each model that are declared in its INTERN and NESTED attributes share one
+copy of each value instead. It's off by default since it makes building
+models a little slower.
+
+Interned dicts are shared between models, so they must not be changed.
+
+Example usage:
+    >>> from crunchyroll import interning
+    >>> interning.enable()
+    >>> catalog = api.list_anime_series(limit=META.MAX_SERIES)
+    >>> interning.get_table().get_stats()['bytes_saved']
+"""
+
+import sys
+
+from crunchyroll.util import iteritems
+
+try:
+    _string_types = (basestring,)
+except NameError:
+    _string_types = (str,)
+
+class InternTable(object):
+    """Bounded table of shared values
+
+    Once `max_entries` values are in the table new values are no longer
+    added, the ones already in it keep being shared. Lookups don't lock, the
+    stats are approximate when several threads build models at once.
+    """
+
+    def __init__(self, max_entries=100000, max_length=256):
+        """
+        @param int max_entries  number of distinct values to keep
+        @param int max_length   longer strings aren't interned, they're
+                                    rarely repeated
+        """
+        self.max_entries = max_entries
+        self.max_length = max_length
+        self._strings = {}
+        # {hash of the items: dict}, keyed by hash so unique dicts don't
+        # cost a copy of their items as well
+        self._dicts = {}
+        self._hits = 0
+        self._misses = 0
+        self._rejected = 0
+        self._bytes_saved = 0
+
+    def _add(self, table, key, value):
+        if len(self._strings) + len(self._dicts) >= self.max_entries:
+            self._rejected += 1
+            return value
+        self._misses += 1
+        return table.setdefault(key, value)
+
+    def _intern_string(self, value):
+        existing = self._strings.get(value)
+        if existing is None:
+            if len(value) > self.max_length:
+                return value
+            return self._add(self._strings, value, value)
+        self._hits += 1
+        if existing is not value:
+            # json decoders already share the keys within a response
+            self._bytes_saved += sys.getsizeof(value)
+        return existing
+
+    def intern(self, value):
+        """Get the shared copy of a value
+
+        Strings are shared as is, dicts have their keys and values interned
+        and are shared whole if they only hold scalars. Anything else is
+        returned unchanged.
+
+        @param mixed value
+        @return mixed
+        """
+        if isinstance(value, _string_types):
+            return self._intern_string(value)
+        if isinstance(value, dict):
+            return self._intern_dict(value)
+        return value
+
+    def _intern_dict(self, value):
+        interned = {}
+        shareable = True
+        for k, v in iteritems(value):
+            if isinstance(v, _string_types):
+                v = self._intern_string(v)
+            elif isinstance(v, (dict, list)):
+                v = self.intern(v)
+                shareable = False
+            interned[self._intern_string(k)] = v
+        if not shareable:
+            return interned
+        key = hash(frozenset(iteritems(interned)))
+        existing = self._dicts.get(key)
+        if existing is None:
+            return self._add(self._dicts, key, interned)
+        # the hash could collide, and 1 == True == 1.0 so the types have to
+        # match as well
+        if existing == interned and all(type(existing[k]) is type(v) \
+                for k, v in iteritems(interned)):
+            self._hits += 1
+            self._bytes_saved += sys.getsizeof(interned)
+            return existing
+        return interned
+
+    def clear(self):
+        self._strings.clear()
+        self._dicts.clear()
+
+    def get_stats(self):
+        """
+        @return dict    hits, misses, values rejected because the table was
+                            full, entries, an estimate of the bytes saved by
+                            sharing values and the size of the table itself
+        """
+        return {
+            'hits':         self._hits,
+            'misses':       self._misses,
+            'rejected':     self._rejected,
+            'bytes_saved':  self._bytes_saved,
+            'entries':      len(self),
+            'table_bytes':  sys.getsizeof(self._strings) + \
+                sys.getsizeof(self._dicts),
+        }
+
+    def __len__(self):
+        return len(self._strings) + len(self._dicts)
+
+_table = None
+
+def get_table():
+    """
+    @return InternTable|None    the table models are interned with, None if
+                                    interning is off
+    """
+    return _table
+
+def set_table(table):
+    """Change the table models are interned with
+
+    @param InternTable|None table   None turns interning off
+    @return InternTable|None        the previous table
+    """
+    global _table
+    previous = _table
+    _table = table
+    return previous
+
+def enable(max_entries=100000, max_length=256):
+    """Start interning models with a new table
+
+    @return InternTable
+    """
+    table = InternTable(max_entries, max_length)
+    set_table(table)
+    return table
+
+def disable():
+    set_table(None)
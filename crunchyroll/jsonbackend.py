@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+JSON decoding backends for API responses
+
+The fastest installed library is used by default, in the order orjson,
+ujson, simplejson, then the stdlib json. Every backend decodes the raw
+response bytes, skipping the text decode (and encoding detection) that
+`requests.Response.json()` does first. Decoding errors are always
+ValueErrors.
+
+Example usage:
+    >>> from crunchyroll import jsonbackend
+    >>> jsonbackend.set_backend('json')
+    >>> api = AndroidApi(json_backend='orjson')
+"""
+
+import json
+import logging
+
+logger = logging.getLogger('crunchyroll.jsonbackend')
+
+class StdlibJsonBackend(object):
+    name = 'json'
+
+    def loads(self, content):
+        if isinstance(content, bytes) and not isinstance(content, str):
+            # json.loads() only takes bytes in py3.6+
+            content = content.decode('utf-8')
+        return json.loads(content)
+
+class OrjsonBackend(object):
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._loads = orjson.loads
+
+    def loads(self, content):
+        return self._loads(content)
+
+class UjsonBackend(object):
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._loads = ujson.loads
+
+    def loads(self, content):
+        return self._loads(content)
+
+class SimplejsonBackend(object):
+    name = 'simplejson'
+
+    def __init__(self):
+        import simplejson
+        self._loads = simplejson.loads
+
+    def loads(self, content):
+        return self._loads(content)
+
+BACKENDS = {
+    StdlibJsonBackend.name:     StdlibJsonBackend,
+    OrjsonBackend.name:         OrjsonBackend,
+    UjsonBackend.name:          UjsonBackend,
+    SimplejsonBackend.name:     SimplejsonBackend,
+}
+
+# fastest first
+PREFERENCE = ('orjson', 'ujson', 'simplejson', 'json')
+
+def make_backend(backend):
+    """Get a backend instance
+
+    @param str|object backend   one of BACKENDS or a backend instance
+    @return object
+    @raises ImportError if the backend's library isn't installed
+    """
+    if not isinstance(backend, str):
+        return backend
+    try:
+        backend_cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError('Unknown JSON backend: {0}'.format(backend))
+    return backend_cls()
+
+def _find_default_backend():
+    for name in PREFERENCE:
+        try:
+            return make_backend(name)
+        except ImportError:
+            continue
+
+_backend = _find_default_backend()
+
+def get_backend():
+    """
+    @return object  the backend used by APIs that weren't given one
+    """
+    return _backend
+
+def set_backend(backend):
+    """Change the default backend
+
+    @param str|object backend   one of BACKENDS or a backend instance
+    @return object              the previous backend
+    """
+    global _backend
+    previous = _backend
+    _backend = make_backend(backend)
+    logger.debug('Using %s JSON backend', _backend.name)
+    return previous
@@ -17,16 +17,23 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 import re
+import bisect
 import logging
 import functools
 
-from crunchyroll.util import parse_xml_string, return_collection, xml_node_to_string
-from crunchyroll.subtitles import SubtitleDecrypter, SRTFormatter, ASS4plusFormatter
+from crunchyroll.util import parse_xml_string, to_collection, \
+    xml_node_to_string, iteritems, cached_property, get_xml_backend
+from crunchyroll.subtitles import SubtitleDecrypter, SRTFormatter, \
+    ASS4plusFormatter, WebVTTFormatter, TTMLFormatter, CompiledSubtitle, \
+    format_subtitles
 from crunchyroll.constants import META
+from crunchyroll.interning import get_table as get_intern_table
 
 logger = logging.getLogger('crunchyroll.models')
 
 class DictModel(object):
+    __slots__ = ('_data',)
+
     def __init__(self, data):
         if not isinstance(data, dict):
             raise TypeError('DictModel can only be initialized with a dict')
@@ -48,7 +55,23 @@ class DictModel(object):
     def __repr__(self):
         return '<%s(%s)>' % (self.__class__.__name__, repr(self._data))
 
+    def to_dict(self):
+        return dict(self._data)
+
 class XmlModel(object):
+    """Wrapper around an ElementTree (or lxml) node, see
+    `crunchyroll.xmlbackend`
+
+    Lookups are memoized per node: the direct children are indexed by tag the
+    first time one is asked for and findall() results are kept by query, so
+    reading the same thing twice doesn't walk the document again. Models
+    built from another XmlModel share its caches. The node is assumed not to
+    change once it's wrapped.
+    """
+
+    # queries that are just a child tag name can use the child index
+    _CHILD_TAG_RE = re.compile(r'^[\w.-]+$')
+
     def __init__(self, node):
         try:
             is_basestring = isinstance(node, basestring)
@@ -62,14 +85,20 @@ class XmlModel(object):
         elif isinstance(node, XmlModel):
             logger.debug('Creating new %s with node=%r', self.__class__.__name__,
                 node)
+            self._queries = node._queries
             node = node._data
         elif node is None:
             raise ValueError('XmlModel node cannot be NoneType')
         self._data = node
+        if '_queries' not in self.__dict__:
+            # {query: [XmlModel]}, None holds the {tag: [XmlModel]} index
+            self._queries = {}
 
     def __getattr__(self, name):
         try:
-            return self._data.attrib.get(name)
+            # Element.get() rather than .attrib, lxml builds a new attrib
+            # proxy on every access
+            return self._data.get(name)
         except KeyError as err:
             raise AttributeError(err)
 
@@ -86,7 +115,14 @@ class XmlModel(object):
     __unicode__ = __str__
 
     def __getitem__(self, name):
-        return list(map(XmlModel, self.findall('./' + name)))
+        if self._CHILD_TAG_RE.match(name) is None:
+            return self.findall('./' + name)
+        children = self._queries.get(None)
+        if children is None:
+            children = self._queries[None] = {}
+            for child in get_xml_backend().iterchildren(self._data):
+                children.setdefault(child.tag, []).append(XmlModel(child))
+        return list(children.get(name, ()))
 
     @property
     def text(self):
@@ -97,7 +133,11 @@ class XmlModel(object):
         return self._data.tag
 
     def findall(self, query):
-        return list(map(XmlModel, self._data.findall(query)))
+        result = self._queries.get(query)
+        if result is None:
+            result = self._queries[query] = list(map(XmlModel,
+                get_xml_backend().findall(self._data, query)))
+        return list(result)
 
     def findfirst(self, query):
         try:
@@ -105,22 +145,498 @@ class XmlModel(object):
         except IndexError:
             return None
 
-class Series(DictModel):
+def compiled_model(cls):
+    """Build the slotted version of a `CompiledModel` subclass from its FIELDS
+    and NESTED declarations. Should be used as a class decorator.
+    """
+    namespace = dict(vars(cls))
+    namespace.pop('__dict__', None)
+    namespace.pop('__weakref__', None)
+    slot_names = {}
+    for name in cls.FIELDS:
+        slot_names[name] = name
+    for name, model_cls in iteritems(cls.NESTED):
+        slot_names[name] = '_n_' + name
+        namespace[name] = _nested_property(name, slot_names[name], model_cls)
+    namespace['__slots__'] = tuple(sorted(slot_names.values()))
+    namespace['_slot_names'] = slot_names
+    namespace['_intern_names'] = frozenset(cls.INTERN) | frozenset(cls.NESTED)
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+def _nested_property(name, slot_name, model_cls):
+    def getter(self):
+        try:
+            value = getattr(self, slot_name)
+        except AttributeError:
+            return self._get_missing(name)
+        if isinstance(value, dict):
+            # only build the sub-model the first time it's needed
+            value = model_cls(value)
+            setattr(self, slot_name, value)
+        return value
+    getter.__name__ = name
+    return property(getter)
+
+class FieldNotLoadedError(AttributeError):
+    """The model was fetched with a field set that doesn't include the field
+    being read
+    """
     pass
 
-class Chapter(DictModel):
-    pass
+class CompiledModel(DictModel):
+    """Model for API objects whose fields are known ahead of time
+
+    Known fields are stored in slots when the model is created so reading
+    them is a plain attribute lookup, nested objects are turned into their
+    own models the first time they are read and kept. Unknown fields are
+    still available (in `_data`) and, like with `DictModel`, reading a field
+    the API didn't send gives None. Attributes can't be set on these models.
+
+    Models fetched with a `fields` projection (see META.FIELDS_*) know which
+    fields they were loaded with. Reading one that wasn't loaded fetches the
+    rest of the fields if the model came from a MetaApi (see
+    crunchyroll.apis.hydration), otherwise it raises FieldNotLoadedError
+    instead of giving None.
+    """
+
+    __slots__ = ('_loaded', '_hydrator')
+
+    # plain fields
+    FIELDS = ()
+    # {field: model class} for fields holding nested objects
+    NESTED = {}
+    # fields whose values repeat across many objects, shared through the
+    # crunchyroll.interning table when it's enabled (nested objects always
+    # are)
+    INTERN = ()
+    # prefix of this model's fields in ANDROID.FIELD.*
+    FIELD_PREFIX = None
+    # {field: slot}, filled in by `compiled_model`
+    _slot_names = {}
+    _intern_names = frozenset()
+
+    def __init__(self, data, loaded_fields=None):
+        """
+        @param dict data
+        @param frozenset loaded_fields  names of the fields the response was
+                                            requested with, from
+                                            `get_loaded_fields`, None if it
+                                            has all of them
+        """
+        if isinstance(data, CompiledModel) and loaded_fields is None:
+            loaded_fields = data._loaded
+        if isinstance(data, DictModel):
+            data = data.to_dict()
+        if not isinstance(data, dict):
+            raise TypeError('%s can only be initialized with a dict' % \
+                self.__class__.__name__)
+        slot_names = self._slot_names
+        intern_table = get_intern_table()
+        intern_names = self._intern_names if intern_table is not None \
+            else ()
+        extra = None
+        for name, value in iteritems(data):
+            slot_name = slot_names.get(name)
+            if slot_name is None:
+                if extra is None:
+                    extra = {}
+                extra[name] = value
+            else:
+                if name in intern_names:
+                    value = intern_table.intern(value)
+                setattr(self, slot_name, value)
+        self._data = extra
+        self._loaded = loaded_fields
+
+    @classmethod
+    def get_loaded_fields(cls, fields):
+        """Get the names of this model's fields that a response requested
+        with a field set has
+
+        @param list<str> fields     ANDROID.FIELD.*
+        @return frozenset
+        """
+        prefix = '%s.' % cls.FIELD_PREFIX
+        loaded = set()
+        for field in fields:
+            if field.startswith(prefix):
+                loaded.add(field[len(prefix):])
+            elif '.' not in field:
+                # not specific to one kind of object, like `ordering`
+                loaded.add(field)
+        return frozenset(loaded)
+
+    @classmethod
+    def get_full_fields(cls):
+        """Get the field set that has all of this model's fields
+
+        @return list<str>   ANDROID.FIELD.*
+        """
+        return ['%s.%s' % (cls.FIELD_PREFIX, name) \
+            for name in sorted(cls._slot_names)]
+
+    def _set_fields(self, data):
+        """Fill in the fields of the full object after the model was created
+        with a field set, the ones it already has are kept
+
+        @param dict data
+        """
+        intern_table = get_intern_table()
+        for name, value in iteritems(data):
+            slot_name = self._slot_names.get(name)
+            if slot_name is None:
+                if self._data is None:
+                    self._data = {}
+                self._data.setdefault(name, value)
+                continue
+            try:
+                object.__getattribute__(self, slot_name)
+            except AttributeError:
+                if intern_table is not None and name in self._intern_names:
+                    value = intern_table.intern(value)
+                setattr(self, slot_name, value)
+        self._loaded = None
+        self._hydrator = None
+
+    def _get_missing(self, name):
+        """Get the value of a field the response didn't have
+        """
+        if self._loaded is not None and name not in self._loaded:
+            # only set on models that can be hydrated
+            hydrator = getattr(self, '_hydrator', None)
+            if hydrator is not None:
+                hydrator.hydrate(self)
+                return getattr(self, name)
+            raise FieldNotLoadedError(
+                '%s.%s was not loaded, it was fetched with fields: %s' % (
+                    self.__class__.__name__, name,
+                    ', '.join(sorted(self._loaded))))
+        return None
+
+    def _get_loaded(self, name):
+        """Get a field's value without ever fetching it
+
+        @raises FieldNotLoadedError if the model doesn't have the field
+        """
+        slot_name = self._slot_names.get(name)
+        if slot_name is not None:
+            try:
+                return object.__getattribute__(self, slot_name)
+            except AttributeError:
+                pass
+        elif self._data is not None and name in self._data:
+            return self._data[name]
+        raise FieldNotLoadedError('%s.%s was not loaded' % (
+            self.__class__.__name__, name))
 
-class Page(DictModel):
-    pass
+    def __getattr__(self, name):
+        # only called for fields that aren't in a slot
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self._slot_names or self._data is None \
+                or name not in self._data:
+            return self._get_missing(name)
+        item = self._data[name]
+        if isinstance(item, dict):
+            return DictModel(item)
+        return item
 
-class Media(DictModel):
-    pass
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __reduce__(self):
+        return (self.__class__, (self.to_dict(), self._loaded))
+
+    @property
+    def loaded_fields(self):
+        """
+        @return frozenset|None  the fields the model was fetched with, None if
+                                    it has all of them
+        """
+        return self._loaded
+
+    def to_dict(self):
+        """Get the fields as a dict again, the way the API sent them
+
+        @return dict
+        """
+        data = dict(self._data or {})
+        for name, slot_name in iteritems(self._slot_names):
+            try:
+                # skip __getattr__, unset fields should be left out
+                value = object.__getattribute__(self, slot_name)
+            except AttributeError:
+                continue
+            if isinstance(value, DictModel):
+                value = value.to_dict()
+            data[name] = value
+        return data
+
+    def __repr__(self):
+        return '<%s(%r)>' % (self.__class__.__name__, self.to_dict())
+
+class ModelMap(DictModel):
+    """Nested objects keyed by something other than a field name (like
+    locale codes), each one is turned into a VALUE_MODEL the first time it's
+    read
+    """
+
+    __slots__ = ('_models',)
+
+    VALUE_MODEL = DictModel
+
+    def __init__(self, data):
+        super(ModelMap, self).__init__(data)
+        self._models = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._models[name]
+        except KeyError:
+            pass
+        value = self._data.get(name)
+        if isinstance(value, dict):
+            value = self.VALUE_MODEL(value)
+        self._models[name] = value
+        return value
+
+    __getitem__ = __getattr__
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        return list(self._data.keys())
+
+@compiled_model
+class Image(CompiledModel):
+    FIELDS = ('thumb_url', 'small_url', 'medium_url', 'large_url', 'full_url',
+        'wide_url', 'widestar_url', 'fwide_url', 'fwidestar_url', 'width',
+        'height')
+
+@compiled_model
+class MangaLocale(CompiledModel):
+    FIELDS = ('name', 'description', 'thumb_url', 'full_url')
+
+class MangaLocaleMap(ModelMap):
+    __slots__ = ()
+    VALUE_MODEL = MangaLocale
+
+@compiled_model
+class PageLocale(CompiledModel):
+    FIELDS = ('encrypted_composed_image_url', 'encrypted_mobile_image_url',
+        'composed_image_url', 'mobile_image_url', 'width', 'height')
+
+class PageLocaleMap(ModelMap):
+    __slots__ = ()
+    VALUE_MODEL = PageLocale
+
+class ModelList(list):
+    """List of models with lookups by field value
+
+    The indexes behind the lookups are built the first time they are used and
+    thrown away whenever the list is changed, so callers that never look
+    anything up don't pay for them.
+    """
+
+    __slots__ = ('_indexes',)
+
+    def __init__(self, *pargs):
+        super(ModelList, self).__init__(*pargs)
+        self._indexes = None
+
+    def _get_index(self, field, key_func=None):
+        """Get the {value: item} index for a field, the first item wins if
+        several have the same value
+        """
+        if self._indexes is None:
+            self._indexes = {}
+        index = self._indexes.get((field, key_func))
+        if index is None:
+            index = {}
+            for item in self:
+                value = getattr(item, field)
+                if key_func is not None and value is not None:
+                    value = key_func(value)
+                index.setdefault(value, item)
+            self._indexes[(field, key_func)] = index
+        return index
+
+    def get_by(self, field, value):
+        """Find the item with a given field value
+
+        @param str field
+        @param mixed value
+        @return DictModel|None
+        """
+        return self._get_index(field).get(value)
+
+    def _get_by_id(self, field, value):
+        # ids are strings in some responses and ints in others
+        return self._get_index(field, str).get(str(value))
+
+def _invalidate_indexes(name):
+    method = getattr(list, name)
+    @functools.wraps(method)
+    def wrapper(self, *pargs, **kwargs):
+        self._indexes = None
+        return method(self, *pargs, **kwargs)
+    return wrapper
+
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__',
+        '__setslice__', '__delslice__', 'append', 'extend', 'insert', 'pop',
+        'remove', 'clear', 'sort', 'reverse'):
+    if hasattr(list, _name):
+        setattr(ModelList, _name, _invalidate_indexes(_name))
+
+def episode_number_key(episode_number):
+    """Get the sort key for an episode number, numeric ones ('1', '12.5') sort
+    by value, then the non-numeric ones ('SP1', 'OVA') by name, then missing
+
+    @param str episode_number
+    @return tuple
+    """
+    if episode_number is None:
+        return (2, '')
+    episode_number = str(episode_number).strip()
+    if not episode_number:
+        return (2, '')
+    try:
+        return (0, float(episode_number))
+    except ValueError:
+        return (1, episode_number)
+
+class SeriesList(ModelList):
+    __slots__ = ()
+
+    def get_by_id(self, series_id):
+        """
+        @param str series_id
+        @return Series|None
+        """
+        return self._get_by_id('series_id', series_id)
+
+class MediaList(ModelList):
+    __slots__ = ()
+
+    def get_by_id(self, media_id):
+        """
+        @param str media_id
+        @return Media|None
+        """
+        return self._get_by_id('media_id', media_id)
+
+    def _get_episode_index(self):
+        if self._indexes is None:
+            self._indexes = {}
+        index = self._indexes.get('episode_number')
+        if index is None:
+            # (keys, items) sorted by episode number, stable for equal keys
+            pairs = sorted(((episode_number_key(item.episode_number), i) \
+                for i, item in enumerate(self)))
+            index = self._indexes['episode_number'] = (
+                [key for key, _ in pairs], [self[i] for _, i in pairs])
+        return index
+
+    def get_by_episode_number(self, episode_number):
+        """Find an episode by number, '1', '01', 1 and 1.0 all match the
+        same episode, non-numeric numbers have to match exactly
+
+        @param str episode_number
+        @return Media|None
+        """
+        keys, items = self._get_episode_index()
+        key = episode_number_key(episode_number)
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key and key[0] != 2:
+            return items[i]
+        return None
+
+    def get_episode_range(self, start=None, stop=None):
+        """Get the episodes numbered from `start` to `stop` (inclusive) in
+        episode order, None leaves that end open
+
+        @param str start
+        @param str stop
+        @return list<Media>
+        """
+        keys, items = self._get_episode_index()
+        lo = 0 if start is None \
+            else bisect.bisect_left(keys, episode_number_key(start))
+        hi = bisect.bisect_left(keys, (2, '')) if stop is None \
+            else bisect.bisect_right(keys, episode_number_key(stop))
+        return items[lo:hi]
+
+    def sorted_by_episode_number(self):
+        """
+        @return list<Media>
+        """
+        return list(self._get_episode_index()[1])
+
+@compiled_model
+class Series(CompiledModel):
+    LIST_TYPE = SeriesList
+    FIELD_PREFIX = 'series'
+    FIELDS = ('series_id', 'collection_id', 'etype', 'name', 'description',
+        'url', 'media_type', 'media_count', 'publisher_name', 'year',
+        'in_queue', 'content_type', 'ordering')
+    INTERN = ('etype', 'media_type', 'publisher_name', 'year', 'content_type')
+    NESTED = {
+        'most_likely_media': DictModel,
+        'landscape_image':  Image,
+        'portrait_image':   Image,
+        'locale':           MangaLocaleMap,
+    }
+
+@compiled_model
+class Media(CompiledModel):
+    LIST_TYPE = MediaList
+    FIELD_PREFIX = 'media'
+    FIELDS = ('media_id', 'collection_id', 'series_id', 'etype', 'name',
+        'description', 'url', 'media_type', 'episode_number', 'duration',
+        'playhead', 'available', 'free_available', 'premium_available',
+        'availability_notes', 'available_time', 'free_available_time',
+        'premium_available_time', 'unavailable_time', 'created', 'clip',
+        'bif_url', 'series_name', 'collection_name')
+    INTERN = ('collection_id', 'series_id', 'etype', 'media_type',
+        'episode_number', 'availability_notes', 'available_time',
+        'free_available_time', 'premium_available_time', 'unavailable_time',
+        'created', 'series_name', 'collection_name')
+    NESTED = {
+        'screenshot_image': Image,
+        'stream_data':      DictModel,
+    }
+
+@compiled_model
+class Chapter(CompiledModel):
+    FIELDS = ('chapter_id', 'series_id', 'number', 'availability_start',
+        'availability_end', 'updated', 'published')
+    INTERN = ('series_id', 'availability_start', 'availability_end',
+        'updated', 'published')
+    NESTED = {
+        'locale':           MangaLocaleMap,
+    }
+
+@compiled_model
+class Page(CompiledModel):
+    FIELDS = ('page_id', 'chapter_id', 'number', 'image_url')
+    INTERN = ('chapter_id',)
+    NESTED = {
+        'locale':           PageLocaleMap,
+    }
 
 class SubtitleStub(XmlModel):
     LANG_UNKNOWN    = 'UNKNOWN'
 
-    @property
+    @cached_property
     def language(self):
         lang = re.search(r'^\[.*\]\s*(.*)', self.title)
         if lang:
@@ -130,7 +646,7 @@ class SubtitleStub(XmlModel):
         logger.debug('%r language: %r -> %r', self, self.title, lang_string)
         return lang_string
 
-    @property
+    @cached_property
     def is_default(self):
         return self.default == '1'
 
@@ -140,19 +656,56 @@ class Subtitle(XmlModel):
         self._decrypter = SubtitleDecrypter()
 
     def decrypt(self):
-        return StyledSubtitle(self._decrypter.decrypt(
-            self._decrypter._build_encryption_key(int(self.id)),
-            self['iv'][0].text.decode('base64'),
-            self['data'][0].text.decode('base64')))
+        return StyledSubtitle(self._decrypter.decrypt_subtitle(self))
 
 class StyledSubtitle(XmlModel):
+    def compile(self):
+        """Read the document into the form the formatters work from, only
+        done once however many formats are made
+
+        @return crunchyroll.subtitles.CompiledSubtitle
+        """
+        compiled = self.__dict__.get('_compiled')
+        if compiled is None:
+            compiled = self._compiled = CompiledSubtitle.from_styled(self)
+        return compiled
+
     def get_ass_formatted(self):
         formatter = ASS4plusFormatter()
-        return formatter.format(self)
+        return formatter.format(self.compile())
 
     def get_srt_formatted(self):
         formatter = SRTFormatter()
-        return formatter.format(self)
+        return formatter.format(self.compile())
+
+    def get_vtt_formatted(self):
+        formatter = WebVTTFormatter()
+        return formatter.format(self.compile())
+
+    def get_ttml_formatted(self):
+        formatter = TTMLFormatter()
+        return formatter.format(self.compile())
+
+    def get_formatted(self, formats):
+        """
+        @param list<str> formats    crunchyroll.subtitles.FORMATTERS names
+        @return dict                {format: bytes}
+        """
+        return format_subtitles(self.compile(), formats)
+
+    def write_ass_formatted(self, stream):
+        """
+        @param file stream  binary file-like object
+        @return int         bytes written
+        """
+        return ASS4plusFormatter().format_to(self.compile(), stream)
+
+    def write_srt_formatted(self, stream):
+        """
+        @param file stream  binary file-like object
+        @return int         bytes written
+        """
+        return SRTFormatter().format_to(self.compile(), stream)
 
 def require_not_upsell(func):
     @functools.wraps(func)
@@ -163,11 +716,11 @@ def require_not_upsell(func):
             return None
 
 class StreamInfo(XmlModel):
-    @property
+    @cached_property
     def is_upsell(self):
         return bool(self['upsell'])
 
-    @property
+    @cached_property
     def rtmp_data(self):
         data = {
             'url':         self.findfirst(
@@ -181,12 +734,12 @@ class StreamInfo(XmlModel):
         }
         return data
 
-    @property
+    @cached_property
     def duration(self):
         return float(self.findfirst(
             './/metadata/duration').text)
 
-    @property
+    @cached_property
     def resolution(self):
         width = self.findfirst(
             './/metadata/width').text
@@ -195,15 +748,16 @@ class StreamInfo(XmlModel):
         return (int(width), int(height))
 
 class MediaStream(XmlModel):
-    @property
+    @cached_property
     def stream_info(self):
-        return StreamInfo(self._data.findall('.//{default}preload/stream_info')[0])
+        return StreamInfo(self.findall('.//{default}preload/stream_info')[0])
 
-    @property
+    @cached_property
     def default_subtitles(self):
         return Subtitle(self.findfirst('.//{default}preload/subtitle'))
 
-    @property
-    @return_collection(SubtitleStub)
+    @cached_property
     def subtitle_stubs(self):
-        return self.findall('.//{default}preload/subtitles/subtitle')
+        # a tuple since every reader of the stream gets the same one
+        return tuple(to_collection(SubtitleStub,
+            self.findall('.//{default}preload/subtitles/subtitle')))
@@ -16,19 +16,36 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import base64
+import collections
+import io
 import math
 import hashlib
 import zlib
 import re
 import logging
 
-from tlslite.utils.cipherfactory import createAES
+from xml.sax.saxutils import escape, quoteattr
+
+from crunchyroll import aesbackend
 from crunchyroll.util import iteritems
 
 logger = logging.getLogger('crunchyroll.subtitles')
 
-def aes_decrypt(key, iv, data):
-    return str(createAES(key, iv).decrypt(data))
+def aes_decrypt(key, iv, data, backend=None):
+    """
+    @param bytes key
+    @param bytes iv
+    @param bytes data
+    @param str|object backend   crunchyroll.aesbackend backend, the default
+                                    one if not given
+    @return bytes
+    """
+    if backend is None:
+        backend = aesbackend.get_backend()
+    else:
+        backend = aesbackend.make_backend(backend)
+    return backend.decrypt(key, iv, data)
 
 class SubtitleDecrypter(object):
     """Decrypt Crunchyroll's encrypted subtitle data
@@ -48,28 +65,46 @@ class SubtitleDecrypter(object):
     HASH_SECRET_CHAR_OFFSET = 33
     HASH_SECRET_LENGTH      = 20
 
+    # keys only depend on the subtitle id, they're kept for this many ids
+    KEY_CACHE_SIZE          = 4096
+
+    # the hash secret is the same for every key, built the first time it's
+    # needed
+    _hash_secret = None
+    # {(subtitle_id, key_size): key}, shared by every decrypter
+    _key_cache = {}
+
+    def __init__(self, aes_backend=None):
+        """
+        @param str|object aes_backend   crunchyroll.aesbackend backend, the
+                                            default one if not given
+        """
+        self._aes_backend = None if aes_backend is None \
+            else aesbackend.make_backend(aes_backend)
+
     def decrypt_subtitle(self, subtitle):
         """Decrypt encrypted subtitle data in high level model object
 
         @param crunchyroll.models.Subtitle subtitle
-        @return str
+        @return bytes
         """
         return self.decrypt(self._build_encryption_key(int(subtitle.id)),
-            subtitle['iv'][0].text.decode('base64'),
-            subtitle['data'][0].text.decode('base64'))
+            base64.b64decode(subtitle['iv'][0].text),
+            base64.b64decode(subtitle['data'][0].text))
 
     def decrypt(self, encryption_key, iv, encrypted_data):
         """Decrypt encrypted subtitle data
 
-        @param int subtitle_id
-        @param str iv
-        @param str encrypted_data
-        @return str
+        @param bytes encryption_key
+        @param bytes iv
+        @param bytes encrypted_data
+        @return bytes
         """
 
-        logger.info('Decrypting subtitles with length (%d bytes), key=%r',
-            len(encrypted_data), encryption_key)
-        return zlib.decompress(aes_decrypt(encryption_key, iv, encrypted_data))
+        logger.debug('Decrypting subtitles with length (%d bytes)',
+            len(encrypted_data))
+        return zlib.decompress(aes_decrypt(encryption_key, iv, encrypted_data,
+            self._aes_backend))
 
     def _build_encryption_key(self, subtitle_id, key_size=ENCRYPTION_KEY_SIZE):
         """Generate the encryption key for a given media item
@@ -80,15 +115,28 @@ class SubtitleDecrypter(object):
 
         @param int subtitle_id
         @param int key_size
-        @return str
+        @return bytes
         """
 
+        cache_key = (subtitle_id, key_size)
+        try:
+            return self._key_cache[cache_key]
+        except KeyError:
+            pass
+        secret = SubtitleDecrypter._hash_secret
+        if secret is None:
+            secret = SubtitleDecrypter._hash_secret = \
+                self._build_hash_secret((1, 2)).encode('latin-1')
         # generate a 160-bit SHA1 hash
-        sha1_hash = hashlib.new('sha1', self._build_hash_secret((1, 2)) +
-            self._build_hash_magic(subtitle_id)).digest()
+        sha1_hash = hashlib.sha1(secret +
+            self._build_hash_magic(subtitle_id).encode('ascii')).digest()
         # pad to 256-bit hash for 32 byte key
-        sha1_hash += '\x00' * max(key_size - len(sha1_hash), 0)
-        return sha1_hash[:key_size]
+        sha1_hash += b'\x00' * max(key_size - len(sha1_hash), 0)
+        key = sha1_hash[:key_size]
+        if len(self._key_cache) >= self.KEY_CACHE_SIZE:
+            self._key_cache.clear()
+        self._key_cache[cache_key] = key
+        return key
 
     def _build_hash_magic(self, subtitle_id):
         """Build the other half of the encryption key hash
@@ -127,29 +175,221 @@ class SubtitleDecrypter(object):
             fbn_seq[2:]))
         return ''.join(hash_secret)
 
+SubtitleStyle = collections.namedtuple('SubtitleStyle', ['name', 'attrib',
+    'font_name', 'font_size', 'colour', 'bold', 'italic', 'underline',
+    'strikeout', 'alignment'])
+
+SubtitleEvent = collections.namedtuple('SubtitleEvent', ['id', 'attrib',
+    'start', 'end', 'style_name', 'style', 'name', 'margin_l', 'margin_r',
+    'margin_v', 'effect', 'text', 'lines'])
+
+class CompiledSubtitle(object):
+    """A styled subtitle document read once into what every formatter needs:
+    events in order with their times in milliseconds, their text cleaned of
+    ASS commands and their style looked up
+
+    Example usage:
+        >>> compiled = styled_subtitle.compile()
+        >>> srt = SRTFormatter().format(compiled)
+        >>> vtt = WebVTTFormatter().format(compiled)
+    """
+
+    ASS_CMD_PATTERN     = re.compile(r'{[^}]+}')
+    ASS_NEWLINE_PATTERN = re.compile(r'\\[nN]')
+    ASS_TIMESTAMP_PATTERN = re.compile(r'^(\d+):(\d+):(\d+)(?:\.(\d+))?$')
+
+    def __init__(self, info, styles, events):
+        """
+        @param dict info                        subtitle_script attributes
+        @param list<SubtitleStyle> styles       in document order
+        @param list<SubtitleEvent> events       in id order
+        """
+        self.info = info
+        self.styles = styles
+        self.events = events
+
+    def __repr__(self):
+        return '<%s(id=%s)>' % (self.__class__.__name__, self.id)
+
+    @property
+    def id(self):
+        return self.info.get('id')
+
+    @property
+    def title(self):
+        return self.info.get('title')
+
+    @classmethod
+    def from_styled(cls, styled_subtitle):
+        """
+        @param crunchyroll.models.StyledSubtitle styled_subtitle
+        @return CompiledSubtitle
+        """
+        styles = [cls._compile_style(dict(element._data.attrib)) \
+            for element in styled_subtitle.findall('.//styles/style')]
+        styles_by_name = dict((style.name, style) for style in styles)
+        events = [cls._compile_event(dict(element._data.attrib),
+                styles_by_name) \
+            for element in styled_subtitle.findall('.//events/event')]
+        events.sort(key=lambda event: event.id)
+        logger.debug('Compiled subtitles (id=%s): %d styles, %d events',
+            styled_subtitle.id, len(styles), len(events))
+        return cls(dict(styled_subtitle._data.attrib), styles, events)
+
+    @classmethod
+    def _compile_style(cls, attrib):
+        def flag(key):
+            # -1 is true in ASS
+            return attrib.get(key, '0') not in ('0', '')
+        try:
+            font_size = float(attrib['font_size'])
+        except (KeyError, ValueError):
+            font_size = None
+        try:
+            alignment = int(attrib.get('alignment', 2))
+        except ValueError:
+            alignment = 2
+        return SubtitleStyle(attrib.get('name'), attrib,
+            attrib.get('font_name'), font_size,
+            cls.parse_colour(attrib.get('primary_colour')), flag('bold'),
+            flag('italic'), flag('underline'), flag('strikeout'), alignment)
+
+    @classmethod
+    def _compile_event(cls, attrib, styles_by_name):
+        text = attrib.get('text') or u''
+        lines = tuple(cls.ASS_NEWLINE_PATTERN.split(
+            cls.ASS_CMD_PATTERN.sub(u'', text).replace(u'\\h', u'\xa0')))
+        style_name = attrib.get('style')
+        return SubtitleEvent(int(attrib['id']), attrib,
+            cls.parse_timestamp(attrib['start']),
+            cls.parse_timestamp(attrib['end']), style_name,
+            styles_by_name.get(style_name), attrib.get('name', u''),
+            attrib.get('margin_l', u''), attrib.get('margin_r', u''),
+            attrib.get('margin_v', u''), attrib.get('effect', u''), text,
+            lines)
+
+    @classmethod
+    def parse_timestamp(cls, timestamp):
+        """Turn an ASS timestamp into milliseconds
+
+        0:00:04.17 -> 4170
+
+        @param str timestamp
+        @return int
+        """
+        match = cls.ASS_TIMESTAMP_PATTERN.match(timestamp)
+        if match is None:
+            raise ValueError('Invalid subtitle timestamp: {0}'.format(
+                timestamp))
+        hours, minutes, seconds, fraction = match.groups()
+        return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 \
+            + int((fraction or '0').ljust(3, '0')[:3])
+
+    @staticmethod
+    def parse_colour(colour):
+        """Turn an ASS colour into RGBA
+
+        &H80FF0000 -> (0, 0, 255, 127), ASS puts the colours in BGR order and
+        the alpha is inverted
+
+        @param str colour   &HAABBGGRR, or a decimal number in ASS v4
+        @return tuple       (red, green, blue, alpha) or None
+        """
+        if not colour:
+            return None
+        try:
+            if colour.startswith('&H'):
+                value = int(colour[2:].rstrip('&'), 16)
+            else:
+                value = int(colour)
+        except ValueError:
+            return None
+        return (value & 0xFF, value >> 8 & 0xFF, value >> 16 & 0xFF,
+            0xFF - (value >> 24 & 0xFF))
+
+def split_milliseconds(milliseconds):
+    """
+    @param int milliseconds
+    @return tuple   (hours, minutes, seconds, milliseconds)
+    """
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return (hours, minutes, seconds, milliseconds)
+
+def compile_subtitle(subtitles):
+    """
+    @param crunchyroll.models.StyledSubtitle|CompiledSubtitle subtitles
+    @return CompiledSubtitle
+    """
+    if isinstance(subtitles, CompiledSubtitle):
+        return subtitles
+    return CompiledSubtitle.from_styled(subtitles)
+
 class SubtitleFormatter(object):
     """Base subtitle formatter class
+
+    Subclasses yield the document in pieces from `_iter_format`, `format`
+    joins them up while `format_to` writes them out as they're made.
     """
 
+    # encoded bytes collected before each write to the stream of `format_to`
+    WRITE_SIZE = 64 * 1024
+
     def format(self, subtitles):
         """Turn a string containing the subs xml document into the formatted
         subtitle string
 
-        @param str|crunchyroll.models.StyledSubtitle sub_xml_text
+        @param crunchyroll.models.StyledSubtitle|CompiledSubtitle subtitles
         @return str
         """
+        output = io.BytesIO()
+        self.format_to(subtitles, output)
+        return output.getvalue()
+
+    def format_to(self, subtitles, stream):
+        """Write the formatted subtitles to a binary stream a few events at a
+        time, so the whole formatted document is never held in memory
+
+        @param crunchyroll.models.StyledSubtitle|CompiledSubtitle subtitles
+        @param file stream  anything with a write(bytes) method
+        @return int         bytes written
+        """
         logger.debug('Formatting subtitles (id=%s) with %s',
             subtitles.id, self.__class__.__name__)
-        return self._format(subtitles).encode('utf-8')
+        written = 0
+        pending = []
+        pending_size = 0
+        for piece in self._iter_format(subtitles):
+            data = piece.encode('utf-8')
+            pending.append(data)
+            pending_size += len(data)
+            if pending_size >= self.WRITE_SIZE:
+                stream.write(b''.join(pending))
+                written += pending_size
+                pending = []
+                pending_size = 0
+        if pending:
+            stream.write(b''.join(pending))
+            written += pending_size
+        return written
+
+    def _iter_format(self, subtitles):
+        """Yield the formatted document in pieces, subclasses should override
+        this (or `_format` if they can only build the whole thing at once)
+
+        @param crunchyroll.models.StyledSubtitle|CompiledSubtitle subtitles
+        @return generator<str>
+        """
+        yield self._format(subtitles)
 
     def _format(self, styled_subtitle):
-        """Do the actual formatting on the parsed xml document, should be
-        overridden by subclasses
+        """Do the actual formatting on the parsed xml document
 
         @param crunchyroll.models.StyledSubtitle styled_subtitle
         @return str
         """
-        raise NotImplemented
+        raise NotImplementedError
 
 class ASS4Formatter(SubtitleFormatter):
     """Subtitle formatter for ASS v4 format
@@ -172,14 +412,29 @@ class ASS4Formatter(SubtitleFormatter):
     EVENT_FORMAT    = u'Dialogue: 0,{start},{end},{style},{name},{margin_l},' \
         '{margin_r},{margin_v},{effect},{text}'
 
-    def _format(self, styled_subtitle):
-        return '\n'.join([
-            self._format_header(styled_subtitle),
-            self._format_styles(styled_subtitle.findall('.//styles/style')),
-            self._format_events(styled_subtitle.findall('.//events/event')),
-        ])
-
-    def _format_header(self, subtitle_element):
+    def _iter_format(self, subtitles):
+        compiled = compile_subtitle(subtitles)
+        yield self._format_header(compiled.info)
+        yield u'\n'
+        for piece in self._iter_section(self.STYLE_HEADER, self.STYLE_KEYS,
+                compiled.styles, self._format_style):
+            yield piece
+        yield u'\n'
+        for piece in self._iter_section(self.EVENT_HEADER, self.EVENT_KEYS,
+                compiled.events, self._format_event):
+            yield piece
+
+    def _iter_section(self, header, keys, items, format_item):
+        """Yield a styles or events section a line at a time
+        """
+        yield u'{0}\n{1}\n'.format(header, keys)
+        for i, item in enumerate(items):
+            if i:
+                yield u'\n'
+            yield format_item(item)
+        yield u'\n'
+
+    def _format_header(self, info):
         header = u"""[Script Info]
 Title: {title}
 ScriptType: v4.00
@@ -190,39 +445,20 @@ Subtitle ID: {id}
 Language: {lang_string}
 Created: {created}
 """
-        return header.format(**subtitle_element._data.attrib)
-
-    def _format_styles(self, style_elements):
-        logger.debug('Formatting %d ASS style elements', len(style_elements))
-        style = '\n'.join([
-            self.STYLE_HEADER,
-            self.STYLE_KEYS,
-            '\n'.join(self._format_style(style) \
-                for style in style_elements),
-        ])
-        return style + '\n'
+        return header.format(**info)
 
-    def _format_style(self, style_element):
-        attrs = style_element._data.attrib.copy()
+    def _format_style(self, style):
+        attrs = dict(style.attrib)
         for (k, v) in iteritems(attrs):
             # wikipedia suggests that v4 uses b10, while v4+ uses b16
             if v.startswith('&H'):
                 attrs[k] = int(v[2:], 16)
         return self.STYLE_FORMAT.format(**attrs)
 
-    def _format_events(self, event_elements):
-        logger.debug('Formatting %d ASS event elements', len(event_elements))
-        event_elements.sort(key=lambda e: int(e.id))
-        events = '\n'.join([
-            self.EVENT_HEADER,
-            self.EVENT_KEYS,
-            '\n'.join(self._format_event(event) \
-                for event in event_elements),
-        ])
-        return events + '\n'
-
-    def _format_event(self, event_element):
-        return self.EVENT_FORMAT.format(**event_element._data.attrib)
+    def _format_event(self, event):
+        # the event is ASS already, its timestamps are passed through as they
+        # are rather than rebuilt from milliseconds
+        return self.EVENT_FORMAT.format(**event.attrib)
 
 class ASS4plusFormatter(ASS4Formatter):
     """Subtitle formatter for ASS v4+ format
@@ -230,7 +466,7 @@ class ASS4plusFormatter(ASS4Formatter):
 
     STYLE_HEADER    = u'[V4+ Styles]'
 
-    def _format_header(self, subtitle_element):
+    def _format_header(self, info):
         header = u"""[Script Info]
 Title: {title}
 ScriptType: v4.00+
@@ -241,47 +477,231 @@ Subtitle ID: {id}
 Language: {lang_string}
 Created: {created}
 """
-        return header.format(**subtitle_element._data.attrib)
+        return header.format(**info)
 
-    def _format_style(self, style_element):
-        return self.STYLE_FORMAT.format(**style_element._data.attrib)
+    def _format_style(self, style):
+        return self.STYLE_FORMAT.format(**style.attrib)
 
 class SRTFormatter(SubtitleFormatter):
     """Subtitle formatter for SRT (unstyled) format
     """
 
-    ASS_CMD_PATTERN     = re.compile(r'{[^}]+}')
-    ASS_NEWLINE_PATTERN = re.compile(r'(?:\\n|\\N)')
-
-    def _format(self, styled_subtitle):
-        events = styled_subtitle.findall('.//events/event')
-        logger.debug('Formatting %d SRT events', len(events))
-        events.sort(key=lambda e: e.id)
-        return '\n\n'.join(self._format_event(idx, event) \
-            for idx, event in enumerate(events, 1)) + '\n'
+    def _iter_format(self, subtitles):
+        for idx, event in enumerate(compile_subtitle(subtitles).events, 1):
+            if idx > 1:
+                yield u'\n\n'
+            yield self._format_event(idx, event)
+        yield u'\n'
 
     def _format_event(self, index, event):
-        return '\n'.join([
+        return u'\n'.join([
             str(index),
-            '{0} --> {1}'.format(
+            u'{0} --> {1}'.format(
                 self._format_timestamp(event.start),
                 self._format_timestamp(event.end)),
-            self._format_event_text(event),
+            # line breaks have always been dropped from SRT output
+            u''.join(event.lines),
         ])
 
-    def _format_event_text(self, event):
-        text = event._data.attrib.get('text')
-        text = self.ASS_CMD_PATTERN.sub('', text)
-        text = self.ASS_NEWLINE_PATTERN.sub('', text)
-        return text
-
-    def _format_timestamp(self, timestamp):
+    def _format_timestamp(self, milliseconds):
         """Format timestamp to what SRT wants
 
-        Turns a string like 0:00:04.17 -> 00:00:04,170
+        4170 -> 00:00:04,170
 
-        @param str timestamp
+        @param int milliseconds
         @return str
         """
-        return '{0:02d}:{1:02d}:{2:02d},{3:02d}0'.format(
-            *map(int, timestamp.replace('.', ':').split(':')))
+        return u'{0:02d}:{1:02d}:{2:02d},{3:03d}'.format(
+            *split_milliseconds(milliseconds))
+
+class WebVTTFormatter(SubtitleFormatter):
+    """Subtitle formatter for WebVTT, for HTML5 <track> elements
+
+    Styles become ::cue() classes, cues whose style is aligned to the top or
+    middle of the video are moved there
+    """
+
+    CLASS_NAME_PATTERN  = re.compile(r'[^\w-]', re.UNICODE)
+    # ASS v4+ alignment is laid out like a numpad
+    LINE_SETTINGS       = {0: u' line:0', 1: u' line:50%,center', 2: u''}
+    ALIGN_SETTINGS      = {0: u' align:left', 1: u'', 2: u' align:right'}
+
+    def _iter_format(self, subtitles):
+        compiled = compile_subtitle(subtitles)
+        yield u'WEBVTT\n'
+        class_names = {}
+        for style in compiled.styles:
+            class_names[style.name] = self._get_class_name(style.name)
+            yield u'\n' + self._format_style(class_names[style.name], style)
+        for event in compiled.events:
+            if any(event.lines):
+                yield u'\n' + self._format_event(event,
+                    class_names.get(event.style_name))
+
+    def _get_class_name(self, style_name):
+        class_name = self.CLASS_NAME_PATTERN.sub(u'_', style_name or u'')
+        if not class_name or class_name[0].isdigit() or class_name[0] == u'-':
+            class_name = u'_' + class_name
+        return class_name
+
+    def _format_style(self, class_name, style):
+        rules = []
+        if style.font_name:
+            rules.append(u'font-family: "{0}";'.format(
+                style.font_name.replace(u'"', u'')))
+        if style.colour is not None:
+            rules.append(u'color: rgba({0}, {1}, {2}, {3:.3g});'.format(
+                style.colour[0], style.colour[1], style.colour[2],
+                style.colour[3] / 255.0))
+        if style.bold:
+            rules.append(u'font-weight: bold;')
+        if style.italic:
+            rules.append(u'font-style: italic;')
+        decorations = [name for (name, flag) in \
+            [(u'underline', style.underline),
+                (u'line-through', style.strikeout)] if flag]
+        if decorations:
+            rules.append(u'text-decoration: {0};'.format(
+                u' '.join(decorations)))
+        return u'STYLE\n::cue(.{0}) {{\n{1}\n}}\n'.format(class_name,
+            u'\n'.join(u'  ' + rule for rule in rules))
+
+    def _format_event(self, event, class_name):
+        settings = u''
+        if event.style is not None:
+            row, column = divmod(event.style.alignment - 1, 3)
+            settings = self.LINE_SETTINGS.get(2 - row, u'') + \
+                self.ALIGN_SETTINGS.get(column, u'')
+        text = u'\n'.join(self._escape(line) for line in event.lines if line)
+        if class_name is not None:
+            text = u'<c.{0}>{1}</c>'.format(class_name, text)
+        return u'{0}\n{1} --> {2}{3}\n{4}\n'.format(event.id,
+            self._format_timestamp(event.start),
+            self._format_timestamp(event.end), settings, text)
+
+    def _escape(self, text):
+        return text.replace(u'&', u'&amp;').replace(u'<', u'&lt;').replace(
+            u'>', u'&gt;')
+
+    def _format_timestamp(self, milliseconds):
+        """4170 -> 00:00:04.170
+        """
+        return u'{0:02d}:{1:02d}:{2:02d}.{3:03d}'.format(
+            *split_milliseconds(milliseconds))
+
+class TTMLFormatter(SubtitleFormatter):
+    """Subtitle formatter for TTML, for HTML5 players that take it (through
+    a library or MSE based player)
+
+    Styles become TTML styles and the style's alignment picks the region the
+    text is shown in
+    """
+
+    HEADER          = u'<?xml version="1.0" encoding="UTF-8"?>\n' \
+        '<tt xmlns="http://www.w3.org/ns/ttml" ' \
+        'xmlns:tts="http://www.w3.org/ns/ttml#styling" ' \
+        'xmlns:ttp="http://www.w3.org/ns/ttml#parameter" ' \
+        'ttp:timeBase="media" xml:lang={lang}{extent}>\n'
+    REGIONS         = [(u'top', u'before'), (u'middle', u'center'),
+        (u'bottom', u'after')]
+    TEXT_ALIGN      = [u'left', u'center', u'right']
+
+    def _iter_format(self, subtitles):
+        compiled = compile_subtitle(subtitles)
+        yield self._format_header(compiled.info)
+        yield u'  <head>\n    <styling>\n'
+        style_ids = {}
+        for i, style in enumerate(compiled.styles, 1):
+            style_ids[style.name] = u's{0}'.format(i)
+            yield self._format_style(style_ids[style.name], style)
+        yield u'    </styling>\n    <layout>\n'
+        for (region, display_align) in self.REGIONS:
+            yield u'      <region xml:id="{0}" tts:origin="0% 0%" ' \
+                'tts:extent="100% 100%" tts:displayAlign="{1}" ' \
+                'tts:textAlign="center"/>\n'.format(region, display_align)
+        yield u'    </layout>\n  </head>\n  <body>\n    <div>\n'
+        for event in compiled.events:
+            if any(event.lines):
+                yield self._format_event(event,
+                    style_ids.get(event.style_name))
+        yield u'    </div>\n  </body>\n</tt>\n'
+
+    def _format_header(self, info):
+        lang_code = info.get('lang_code') or u''
+        if len(lang_code) == 4:
+            # enUS -> en-US
+            lang_code = u'{0}-{1}'.format(lang_code[:2], lang_code[2:])
+        extent = u''
+        if info.get('play_res_x') and info.get('play_res_y'):
+            extent = u' tts:extent="{0}px {1}px"'.format(info['play_res_x'],
+                info['play_res_y'])
+        return self.HEADER.format(lang=quoteattr(lang_code), extent=extent)
+
+    def _format_style(self, style_id, style):
+        attrs = [(u'xml:id', style_id)]
+        if style.font_name:
+            attrs.append((u'tts:fontFamily', style.font_name))
+        if style.font_size:
+            attrs.append((u'tts:fontSize', u'{0:g}px'.format(style.font_size)))
+        if style.colour is not None:
+            attrs.append((u'tts:color',
+                u'#{0:02x}{1:02x}{2:02x}{3:02x}'.format(*style.colour)))
+        if style.bold:
+            attrs.append((u'tts:fontWeight', u'bold'))
+        if style.italic:
+            attrs.append((u'tts:fontStyle', u'italic'))
+        if style.underline:
+            attrs.append((u'tts:textDecoration', u'underline'))
+        attrs.append((u'tts:textAlign',
+            self.TEXT_ALIGN[(style.alignment - 1) % 3]))
+        return u'      <style {0}/>\n'.format(u' '.join(
+            u'{0}={1}'.format(name, quoteattr(value)) \
+                for (name, value) in attrs))
+
+    def _format_event(self, event, style_id):
+        region = self.REGIONS[2][0]
+        if event.style is not None:
+            region = self.REGIONS[2 - min(2, max(0,
+                (event.style.alignment - 1) // 3))][0]
+        style = u'' if style_id is None else u' style="{0}"'.format(style_id)
+        return u'      <p begin="{0}" end="{1}" region="{2}"{3}>{4}</p>\n'.format(
+            self._format_timestamp(event.start),
+            self._format_timestamp(event.end), region, style,
+            u'<br/>'.join(escape(line) for line in event.lines if line))
+
+    def _format_timestamp(self, milliseconds):
+        """4170 -> 00:00:04.170
+        """
+        return u'{0:02d}:{1:02d}:{2:02d}.{3:03d}'.format(
+            *split_milliseconds(milliseconds))
+
+# formatters by the name used for them in bulk operations
+FORMATTERS = {
+    'ass4':     ASS4Formatter,
+    'ass':      ASS4plusFormatter,
+    'srt':      SRTFormatter,
+    'vtt':      WebVTTFormatter,
+    'ttml':     TTMLFormatter,
+}
+
+def get_formatter(name):
+    """
+    @param str name     one of FORMATTERS
+    @return SubtitleFormatter
+    """
+    try:
+        return FORMATTERS[name]()
+    except KeyError:
+        raise ValueError('Unknown subtitle format: {0}'.format(name))
+
+def format_subtitles(subtitles, formats):
+    """Format subtitles several ways, reading the document only once
+
+    @param crunchyroll.models.StyledSubtitle|CompiledSubtitle subtitles
+    @param list<str> formats    FORMATTERS names
+    @return dict                {format: bytes}
+    """
+    formatters = [(name, get_formatter(name)) for name in formats]
+    compiled = compile_subtitle(subtitles)
+    return dict((name, formatter.format(compiled)) \
+        for (name, formatter) in formatters)
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+On-disk store of decrypted and formatted subtitles
+
+Decrypted subtitle scripts are stored by the hash of their content, along
+with the formatted versions made from them, and subtitle ids point at the
+content they decrypted to so a subtitle that's been seen before doesn't need
+to be fetched, decrypted or formatted again. The store is an SQLite database,
+any number of threads and processes can use the same file. Once it holds more
+than `max_bytes` the least recently used scripts are evicted along with
+everything made from them. Subtitles do get fixed after they're published, so
+a subtitle id fetched more than `max_age` seconds ago is a miss and gets
+fetched again.
+
+Example usage:
+    >>> store = SubtitleStore('/var/cache/crunchyroll/subtitles.db')
+    >>> store.put(subtitle_id, script, {'srt': srt_bytes})
+    >>> store.get(subtitle_id, ['srt', 'ass'])
+    {'srt': b'...'}
+"""
+
+import contextlib
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from crunchyroll.constants import META
+
+logger = logging.getLogger('crunchyroll.subtitlestore')
+
+class SubtitleStore(object):
+    # the kind the decrypted script itself is stored as, everything else is
+    # a crunchyroll.subtitles.FORMATTERS name
+    SCRIPT = 'xml'
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS scripts ('
+            'subtitle_id INTEGER PRIMARY KEY, '
+            'content_hash TEXT NOT NULL, '
+            'fetched REAL NOT NULL DEFAULT 0)',
+        'CREATE INDEX IF NOT EXISTS scripts_content_hash '
+            'ON scripts (content_hash)',
+        'CREATE TABLE IF NOT EXISTS contents ('
+            'content_hash TEXT PRIMARY KEY, '
+            'size INTEGER NOT NULL, '
+            'last_used REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS contents_last_used '
+            'ON contents (last_used)',
+        'CREATE TABLE IF NOT EXISTS artifacts ('
+            'content_hash TEXT NOT NULL, '
+            'kind TEXT NOT NULL, '
+            'data BLOB NOT NULL, '
+            'PRIMARY KEY (content_hash, kind))',
+    ]
+
+    def __init__(self, path, max_bytes=META.SUBTITLE_STORE_SIZE,
+            timeout=META.SUBTITLE_STORE_TIMEOUT,
+            max_age=META.SUBTITLE_STORE_MAX_AGE):
+        """
+        @param str path         database file, created if it doesn't exist
+        @param int max_bytes    total size of the stored scripts and formatted
+                                    subtitles to evict down to
+        @param float timeout    seconds to wait for another process's write
+                                    to finish
+        @param float max_age    seconds after a subtitle was fetched to fetch
+                                    it again, None to keep it until it's
+                                    evicted
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.max_age = max_age
+        self._local = threading.local()
+        self._hits = 0
+        self._misses = 0
+        self._stale = 0
+        self._evicted = 0
+        with self._transaction() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            columns = [row[1] for row in conn.execute(
+                'PRAGMA table_info(scripts)')]
+            if 'fetched' not in columns:
+                # stores from before fetch times were kept, everything in
+                # them counts as stale
+                conn.execute('ALTER TABLE scripts '
+                    'ADD COLUMN fetched REAL NOT NULL DEFAULT 0')
+
+    def __getstate__(self):
+        # connections can't cross processes, the copy opens its own
+        return (self.path, self.max_bytes, self.timeout, self.max_age)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def _connect(self):
+        """Get this thread's connection, a new one after a fork
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # autocommit, transactions are started explicitly
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Take the write lock up front, so two processes that both read
+        before writing can't deadlock
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @staticmethod
+    def hash_script(script):
+        """
+        @param bytes script     decrypted subtitle script
+        @return str
+        """
+        return hashlib.sha256(script).hexdigest()
+
+    def get(self, subtitle_id, kinds):
+        """Get whatever is stored for a subtitle, and mark it recently used,
+        nothing if it was fetched more than `max_age` seconds ago
+
+        @param int subtitle_id
+        @param list<str> kinds  SCRIPT and/or FORMATTERS names
+        @return dict            {kind: bytes}, only the kinds that are stored
+        """
+        kinds = list(kinds)
+        conn = self._connect()
+        # plain reads don't block or wait on other processes, the script can
+        # only be evicted in between which makes this a miss
+        row = conn.execute(
+            'SELECT content_hash, fetched FROM scripts WHERE subtitle_id = ?',
+            (int(subtitle_id),)).fetchone()
+        if row is not None and self.max_age is not None and \
+                time.time() - row[1] > self.max_age:
+            self._stale += 1
+            row = None
+        if row is None or not kinds:
+            artifacts = {}
+        else:
+            artifacts = dict((kind, bytes(data)) for kind, data in conn.execute(
+                'SELECT kind, data FROM artifacts '
+                'WHERE content_hash = ? AND kind IN ({0})'.format(
+                    ', '.join('?' * len(kinds))),
+                [row[0]] + kinds))
+        if artifacts:
+            conn.execute(
+                'UPDATE contents SET last_used = ? WHERE content_hash = ?',
+                (time.time(), row[0]))
+        if len(artifacts) == len(kinds):
+            self._hits += 1
+        else:
+            self._misses += 1
+        return artifacts
+
+    def put(self, subtitle_id, script, artifacts=None, fetched=True):
+        """Store a decrypted script and anything formatted from it, then evict
+        the least recently used scripts if the store is over `max_bytes`
+
+        @param int subtitle_id
+        @param bytes script             decrypted subtitle script
+        @param dict artifacts           {FORMATTERS name: bytes}
+        @param bool fetched             False if the script came from the
+                                            store rather than a new fetch, the
+                                            subtitle's fetch time is kept
+        @return str                     the script's content hash
+        """
+        content_hash = self.hash_script(script)
+        artifacts = dict(artifacts or {})
+        artifacts[self.SCRIPT] = script
+        with self._transaction() as conn:
+            conn.execute('INSERT OR {0} INTO scripts '
+                '(subtitle_id, content_hash, fetched) VALUES (?, ?, ?)'.format(
+                    'REPLACE' if fetched else 'IGNORE'),
+                (int(subtitle_id), content_hash, time.time()))
+            for kind, data in artifacts.items():
+                conn.execute('INSERT OR REPLACE INTO artifacts '
+                    '(content_hash, kind, data) VALUES (?, ?, ?)',
+                    (content_hash, kind, sqlite3.Binary(data)))
+            size = conn.execute('SELECT SUM(LENGTH(data)) FROM artifacts '
+                'WHERE content_hash = ?', (content_hash,)).fetchone()[0]
+            conn.execute('INSERT OR REPLACE INTO contents '
+                '(content_hash, size, last_used) VALUES (?, ?, ?)',
+                (content_hash, size, time.time()))
+            self._evict(conn, content_hash)
+        return content_hash
+
+    def _evict(self, conn, keep_hash):
+        """Drop the least recently used content until the store fits, never
+        the content that was just stored
+        """
+        total = conn.execute('SELECT SUM(size) FROM contents').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for content_hash, size in conn.execute('SELECT content_hash, size '
+                'FROM contents ORDER BY last_used').fetchall():
+            if total <= self.max_bytes:
+                break
+            if content_hash == keep_hash:
+                continue
+            evicted.append((content_hash,))
+            total -= size
+        for table in ('scripts', 'artifacts', 'contents'):
+            conn.executemany('DELETE FROM {0} WHERE content_hash = ?'.format(
+                table), evicted)
+        self._evicted += len(evicted)
+        logger.debug('Evicted %d subtitle scripts, %d bytes left',
+            len(evicted), total)
+
+    def get_stats(self):
+        """
+        @return dict    this instance's hits (every kind asked for was
+                            stored), misses, stale subtitles (counted as
+                            misses too) and evictions, and the store's
+                            scripts and bytes
+        """
+        conn = self._connect()
+        scripts, size = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM contents').fetchone()
+        return {
+            'hits':     self._hits,
+            'misses':   self._misses,
+            'stale':    self._stale,
+            'evicted':  self._evicted,
+            'scripts':  scripts,
+            'bytes':    size,
+        }
+
+    def close(self):
+        """Close this thread's connection
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
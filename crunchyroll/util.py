@@ -19,7 +19,7 @@
 import logging
 import functools
 import pipes
-import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     from HTMLParser import HTMLParser
@@ -35,6 +35,7 @@ except ImportError:
         return iter(d.items(**kw))
 
 from crunchyroll.constants import ANDROID_MANGA
+from crunchyroll.xmlbackend import get_backend as get_xml_backend
 
 logger = logging.getLogger('crunchyroll.util')
 
@@ -44,32 +45,109 @@ _html_parser = HTMLParser()
 def html_unescape(html_string):
     return _html_parser.unescape(html_string)
 
+def to_collection(collection_type, items):
+    """
+    @param type collection_type     model class
+    @param iterable items           dicts or `collection_type` models
+    @return list
+    """
+    list_type = getattr(collection_type, 'LIST_TYPE', list)
+    return list_type(item if isinstance(item, collection_type) \
+        else collection_type(item) for item in items)
+
 def return_collection(collection_type):
     """Change method return value from raw API output to collection of models
+
+    The collection is a `collection_type.LIST_TYPE` if the model has one,
+    otherwise a plain list. Items that are already models are kept as is.
     """
     def outer_func(func):
         @functools.wraps(func)
         def inner_func(self, *pargs, **kwargs):
             result = func(self, *pargs, **kwargs)
-            return list(map(collection_type, result))
+            return to_collection(collection_type, result)
         return inner_func
     return outer_func
 
+class cached_property(object):
+    """Like property, but the value is computed on first access and stored on
+    the instance so later reads don't call the getter again
+    """
+
+    def __init__(self, func):
+        self.func = func
+        functools.update_wrapper(self, func)
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.func.__name__] = self.func(instance)
+        return value
+
+def iter_pages(fetch_page, page_size, limit=None, prefetch=True):
+    """Page through a listing, yielding each item as its page arrives
+
+    The first page is fetched in the calling thread, after that the next page
+    is fetched in the background while the current one is being consumed.
+
+    @param callable fetch_page  called with (offset, limit), should return a
+                                    list of items
+    @param int page_size
+    @param int limit            stop after this many items, None for all of them
+    @param bool prefetch
+    @return generator
+    """
+    # crunchyroll.apis imports this module
+    from crunchyroll.apis.deadline import carry_deadline
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+
+    def get_page_size(offset):
+        if limit is None:
+            return page_size
+        return min(page_size, limit - offset)
+
+    try:
+        offset = 0
+        if get_page_size(offset) <= 0:
+            return
+        page = fetch_page(offset, get_page_size(offset))
+        while page:
+            requested = get_page_size(offset)
+            offset += len(page)
+            next_page = None
+            if len(page) >= requested and get_page_size(offset) > 0:
+                if executor is not None:
+                    next_page = executor.submit(carry_deadline(fetch_page),
+                        offset, get_page_size(offset))
+                else:
+                    next_page = functools.partial(fetch_page, offset,
+                        get_page_size(offset))
+            for item in page:
+                yield item
+            if next_page is None:
+                break
+            page = next_page.result() if executor is not None else next_page()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
 def parse_xml_string(xml_string):
-    return ET.fromstring(xml_string)
+    return get_xml_backend().parse(xml_string)
 
 def xml_node_to_string(xml_node):
-    return ET.tostring(xml_node)
+    return get_xml_backend().tostring(xml_node)
 
 def format_rtmpdump_args(rtmp_data):
     arg_string = '-r {url} -W {swf_url} -T {token} -y {file} ' \
         '-p {page_url} -t {url}'
     return arg_string.format(**dict([(k, pipes.quote(v)) for (k,v) in rtmp_data.items()]))
 
+def decrypt_image_chunk(chunk, xor_mask=ANDROID_MANGA.XOR_MASK):
+    return bytes(bytearray(b ^ xor_mask for b in bytearray(chunk)))
+
 def decrypt_image_stream(image_handle, chunk_size=4 * 1024):
-    xor_mask = ANDROID_MANGA.XOR_MASK
     for chunk in image_handle.iter_content(chunk_size):
-        yield str(bytearray(b ^ xor_mask for b in bytearray(chunk)))
+        yield decrypt_image_chunk(chunk)
 
 # NullHandler was added in py2.7
 if hasattr(logging, 'NullHandler'):
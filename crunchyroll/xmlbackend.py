@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+XML parsing backends
+
+lxml is used when it's installed, with every query compiled to an XPath
+expression once and reused, otherwise the stdlib ElementTree. Both give
+ElementTree compatible nodes, so XmlModel doesn't care which one parsed its
+document.
+
+Example usage:
+    >>> from crunchyroll import xmlbackend
+    >>> xmlbackend.set_backend('etree')
+"""
+
+import logging
+import threading
+import xml.etree.ElementTree as ET
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+logger = logging.getLogger('crunchyroll.xmlbackend')
+
+class ElementTreeBackend(object):
+    """Stdlib xml.etree.ElementTree
+    """
+
+    name = 'etree'
+
+    def parse(self, xml_string):
+        return ET.fromstring(xml_string)
+
+    def tostring(self, node):
+        return ET.tostring(node)
+
+    def findall(self, node, query):
+        return node.findall(query)
+
+    def iterchildren(self, node):
+        # fromstring() doesn't keep comments or processing instructions
+        return iter(node)
+
+class LxmlBackend(object):
+    """lxml, queries are ElementPath strings like ElementTree's but are run as
+    compiled XPath
+    """
+
+    name = 'lxml'
+
+    def __init__(self):
+        if lxml_etree is None:
+            raise ImportError('lxml is not installed')
+        self._parser = lxml_etree.XMLParser(resolve_entities=False,
+            no_network=True, remove_comments=True, remove_pis=True)
+        self._lock = threading.Lock()
+        # {query: ETXPath|None}, None if the query isn't valid XPath and has
+        # to go through lxml's ElementPath instead
+        self._queries = {}
+
+    def parse(self, xml_string):
+        if not isinstance(xml_string, bytes):
+            # lxml refuses text with an encoding declaration
+            xml_string = xml_string.encode('utf-8')
+        # XMLParser isn't thread safe
+        with self._lock:
+            return lxml_etree.fromstring(xml_string, self._parser)
+
+    def tostring(self, node):
+        return lxml_etree.tostring(node)
+
+    def _compile(self, query):
+        try:
+            return self._queries[query]
+        except KeyError:
+            pass
+        try:
+            # ETXPath understands the {namespace}tag notation ElementTree
+            # queries use
+            compiled = lxml_etree.ETXPath(query)
+        except lxml_etree.XPathSyntaxError:
+            logger.debug('Not valid XPath, using findall(): %r', query)
+            compiled = None
+        self._queries[query] = compiled
+        return compiled
+
+    def findall(self, node, query):
+        if not isinstance(node, lxml_etree._Element):
+            # parsed by ElementTree before switching backends
+            return node.findall(query)
+        compiled = self._compile(query)
+        if compiled is None:
+            return node.findall(query)
+        return compiled(node)
+
+    def iterchildren(self, node):
+        if not isinstance(node, lxml_etree._Element):
+            return iter(node)
+        return node.iterchildren(lxml_etree.Element)
+
+BACKENDS = {
+    ElementTreeBackend.name:    ElementTreeBackend,
+    LxmlBackend.name:           LxmlBackend,
+}
+
+_backend = LxmlBackend() if lxml_etree is not None else ElementTreeBackend()
+
+def get_backend():
+    """
+    @return ElementTreeBackend|LxmlBackend
+    """
+    return _backend
+
+def set_backend(backend):
+    """Change the backend used to parse and query documents, nodes parsed
+    before the change can still be queried
+
+    @param str|object backend   one of BACKENDS or a backend instance
+    @return object              the previous backend
+    """
+    global _backend
+    previous = _backend
+    if isinstance(backend, str):
+        try:
+            backend = BACKENDS[backend]()
+        except KeyError:
+            raise ValueError('Unknown XML backend: {0}'.format(backend))
+    _backend = backend
+    logger.debug('Using %s XML backend', backend.name)
+    return previous
@@ -32,6 +32,7 @@ except IOError:
     requirements = [
         'requests',
         'tlslite',
+        'futures>=3.0.0; python_version < "3.0"',
     ]
 
 SETUP_ARGS = {
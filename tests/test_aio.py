@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import asyncio
+    from aiohttp import web
+    from crunchyroll.apis.aio import AsyncAndroidApi, AsyncAjaxApi, \
+        AsyncAndroidMangaApi, AsyncMetaApi, async_with_deadline
+except ImportError:
+    web = None
+
+from crunchyroll.apis.android import AndroidApi
+from crunchyroll.apis.cache import HttpCache
+from crunchyroll.apis.pool import ConnectionPool
+from crunchyroll.apis.retry import RetryPolicy
+from crunchyroll.apis.errors import *
+from crunchyroll.constants import META
+from crunchyroll.models import FieldNotLoadedError, Media, Series, Subtitle, \
+    SubtitleStub
+
+from tests.test_subtitles import SUBTITLE_SCRIPT, encrypt_subtitle
+
+skip_if_no_aiohttp = unittest.skipIf(web is None, 'aiohttp not available')
+
+def make_fake_android_api_handler(request_log):
+    async def handler(request):
+        api_method = request.match_info['api_method']
+        request_log.append(api_method)
+        if api_method == 'start_session':
+            data = {'session_id': 'test-session', 'country_code': 'US'}
+        elif api_method == 'list_media':
+            data = [{'media_id': request.query['series_id']}]
+        else:
+            return web.json_response(
+                {'error': True, 'code': 'bad_request', 'message': 'Bad request'})
+        return web.json_response({'error': False, 'code': 'ok', 'data': data})
+    return handler
+
+@skip_if_no_aiohttp
+class TestAsyncAndroidApi(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.request_log = []
+        app = web.Application()
+        app.router.add_route('*', '/{api_method}.0.json',
+            make_fake_android_api_handler(self.request_log))
+        self.runner = web.AppRunner(app)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        port = self.runner.addresses[0][1]
+
+        class LocalAsyncAndroidApi(AsyncAndroidApi):
+            def _build_request_url(self, secure, api_method, version):
+                return 'http://127.0.0.1:%d/%s.%d.json' % (port, api_method, version)
+        self.api_class = LocalAsyncAndroidApi
+        self.api = LocalAsyncAndroidApi()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.api.close())
+        self.loop.run_until_complete(self.runner.cleanup())
+        self.loop.close()
+
+    def test_methods_are_generated(self):
+        for name in ('start_session', 'list_series', 'list_media', 'info'):
+            self.assertTrue(hasattr(getattr(AndroidApi, name), 'api_method_args'))
+            self.assertTrue(asyncio.iscoroutinefunction(
+                getattr(AsyncAndroidApi, name)))
+
+    def test_concurrent_requests(self):
+        async def run():
+            await self.api.start_session()
+            return await asyncio.gather(*[self.api.list_media(series_id=i) \
+                for i in range(50)])
+        results = self.loop.run_until_complete(run())
+        self.assertTrue(self.api.session_started)
+        self.assertEqual(['%d' % i for i in range(50)],
+            [r[0]['media_id'] for r in results])
+
+    def test_identical_requests_coalesced(self):
+        async def run():
+            await self.api.start_session()
+            return await asyncio.gather(*[self.api.list_media(series_id=1) \
+                for i in range(20)])
+        results = self.loop.run_until_complete(run())
+        self.assertEqual(20, len(results))
+        self.assertEqual(['start_session', 'list_media'],
+            self.request_log)
+
+    def test_error_response(self):
+        with self.assertRaises(ApiError):
+            self.loop.run_until_complete(self.api.info(media_id=1))
+
+    def test_http_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            http_cache = HttpCache(os.path.join(cache_dir, 'http-cache.db'))
+            api = self.api_class(http_cache=http_cache)
+            async def run():
+                await api.start_session()
+                first = await api.list_media(series_id=1)
+                self.assertEqual(first, await api.list_media(series_id=1))
+                await api.close()
+            self.loop.run_until_complete(run())
+            self.assertEqual(['start_session', 'list_media'], self.request_log)
+            self.assertEqual(1, http_cache.get_stats()['hits'])
+            # the database was only used from the API's cache thread, not
+            # from the event loop
+            self.assertEqual(0, http_cache._local.db.total_changes)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_request_timeout(self):
+        async def slow_handler(request):
+            await asyncio.sleep(1)
+            return web.json_response({})
+        app = web.Application()
+        app.router.add_route('*', '/{api_method}.0.json', slow_handler)
+        runner = web.AppRunner(app)
+        self.loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        port = runner.addresses[0][1]
+        pool = ConnectionPool(read_timeout=0.05)
+        api = AsyncAndroidApi(pool=pool,
+            retry_policy=RetryPolicy(max_attempts=1))
+        api._build_request_url = lambda secure, api_method, version: \
+            'http://127.0.0.1:%d/%s.%d.json' % (port, api_method, version)
+        try:
+            with self.assertRaises(ApiTimeoutException):
+                self.loop.run_until_complete(api.start_session())
+        finally:
+            self.loop.run_until_complete(api.close())
+            self.loop.run_until_complete(pool.async_connector.close())
+            self.loop.run_until_complete(runner.cleanup())
+
+    def test_stream_rejected(self):
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(
+                self.api.list_media(series_id=1, stream=True))
+        self.assertEqual([], self.request_log)
+        # stream=False is the normal request, without a stream param
+        self.loop.run_until_complete(self.api.start_session())
+        self.loop.run_until_complete(
+            self.api.list_media(series_id=1, stream=False))
+        self.assertEqual(['start_session', 'list_media'], self.request_log)
+
+async def fake_manga_api_handler(request):
+    api_method = request.match_info['api_method']
+    if api_method == 'cr_start_session':
+        return web.json_response({'error': False, 'code': 'ok',
+            'data': {'session_id': 'manga-session', 'country_code': 'US'}})
+    elif api_method == 'list_series':
+        # this one is a bare list, without the envelope
+        return web.json_response([{'series_id': '1',
+            'session_id': request.query.get('session_id')}])
+    return web.json_response(
+        {'error': True, 'code': 'bad_request', 'message': 'Bad request'})
+
+async def fake_ajax_api_handler(request):
+    if request.query['req'] == 'RpcApiSubtitle_GetListing':
+        return web.Response(body=b'<subtitles><subtitle id="1"/></subtitles>',
+            headers={'Content-Type': 'text/xml'})
+    return web.Response(body=b'<html>Not found</html>',
+        headers={'Content-Type': 'text/html'})
+
+async def fake_info_handler(request):
+    if request.match_info['api_method'] == 'start_session':
+        data = {'session_id': 'test-session', 'country_code': 'US'}
+    elif request.match_info['api_method'] == 'list_media':
+        data = [{'media_id': str(i), 'name': 'Episode %d' % i} \
+            for i in range(1, 4)]
+    else:
+        media_id = request.query['media_id']
+        data = {'media_id': media_id, 'name': 'Episode ' + media_id,
+            'description': 'Description ' + media_id}
+    return web.json_response({'error': False, 'code': 'ok', 'data': data})
+
+@skip_if_no_aiohttp
+class TestAsyncApis(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.request_log = []
+
+        @web.middleware
+        async def log_request(request, handler):
+            self.request_log.append(request.path)
+            return await handler(request)
+        app = web.Application(middlewares=[log_request])
+        app.router.add_route('*', '/manga/{api_method}', fake_manga_api_handler)
+        app.router.add_route('*', '/ajax', fake_ajax_api_handler)
+        app.router.add_route('*', '/android/{api_method}.0.json',
+            fake_info_handler)
+        self.runner = web.AppRunner(app)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        self.base_url = 'http://127.0.0.1:%d' % self.runner.addresses[0][1]
+        self.apis = []
+
+    def tearDown(self):
+        for api in self.apis:
+            self.loop.run_until_complete(api.close())
+        self.loop.run_until_complete(self.runner.cleanup())
+        self.loop.close()
+
+    def point_at_server(self, api):
+        base_url = self.base_url
+        if isinstance(api, AsyncAndroidMangaApi):
+            api._build_request_url = lambda secure, api_method: \
+                '%s/manga/%s' % (base_url, api_method)
+        elif isinstance(api, AsyncAjaxApi):
+            api._build_request_url = lambda secure: base_url + '/ajax'
+        else:
+            api._build_request_url = lambda secure, api_method, version: \
+                '%s/android/%s.%d.json' % (base_url, api_method, version)
+        self.apis.append(api)
+        return api
+
+    def test_manga_session(self):
+        api = self.point_at_server(AsyncAndroidMangaApi())
+        self.assertFalse(api.session_started)
+        self.loop.run_until_complete(api.cr_start_session())
+        self.assertTrue(api.session_started)
+        # the session is sent along with the following requests
+        series = self.loop.run_until_complete(api.list_series())
+        self.assertEqual('manga-session', series[0]['session_id'])
+        with self.assertRaises(ApiError):
+            self.loop.run_until_complete(api.cr_logout())
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(api.list_series(stream=True))
+
+    def test_ajax_xml(self):
+        api = self.point_at_server(AsyncAjaxApi())
+        self.assertEqual(b'<subtitles><subtitle id="1"/></subtitles>',
+            self.loop.run_until_complete(api.Subtitle_GetListing(media_id=1)))
+        # anything that isn't XML is a bad response
+        with self.assertRaises(ApiBadResponseException):
+            self.loop.run_until_complete(api.Subtitle_GetXml(
+                subtitle_script_id=1))
+
+    def test_meta_session_shared(self):
+        api = AsyncMetaApi()
+        self.point_at_server(api._android_api)
+        self.point_at_server(api._manga_api)
+        self.point_at_server(api._ajax_api)
+        async def run():
+            return await asyncio.gather(*[api.list_media(
+                Series({'series_id': str(i)})) for i in range(50)])
+        self.assertEqual(50, len(self.loop.run_until_complete(run())))
+        self.assertEqual(1,
+            self.request_log.count('/android/start_session.0.json'))
+        self.assertEqual(1, self.request_log.count('/manga/cr_start_session'))
+        self.assertEqual(50,
+            self.request_log.count('/android/list_media.0.json'))
+
+    def test_meta_hydrate(self):
+        api = AsyncMetaApi(hydrate_workers=2)
+        self.point_at_server(api._android_api)
+        self.point_at_server(api._manga_api)
+        self.point_at_server(api._ajax_api)
+        async def run():
+            media = await api.list_media(Series({'series_id': '1'}),
+                fields=META.FIELDS_IDS)
+            with self.assertRaises(FieldNotLoadedError):
+                media[0].description
+            return await api.hydrate(media)
+        media = self.loop.run_until_complete(run())
+        self.assertTrue(api.session_started)
+        self.assertEqual(['Description 1', 'Description 2', 'Description 3'],
+            [m.description for m in media])
+        self.assertEqual([None] * 3, [m.loaded_fields for m in media])
+
+@skip_if_no_aiohttp
+class TestAsyncDeadline(unittest.TestCase):
+    def test_call_cancelled(self):
+        class SlowApi(object):
+            _timeout = None
+
+            @async_with_deadline
+            async def wait(self, seconds):
+                await asyncio.sleep(seconds)
+                return seconds
+
+        api = SlowApi()
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(0, loop.run_until_complete(api.wait(0, timeout=1)))
+            with self.assertRaises(ApiTimeoutException):
+                loop.run_until_complete(api.wait(10, timeout=0.05))
+        finally:
+            loop.close()
+
+@skip_if_no_aiohttp
+class TestAsyncMetaApi(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+        class SubtitleAsyncMetaApi(AsyncMetaApi):
+            async def get_subtitle_stubs(self, media_item):
+                await asyncio.sleep(0)
+                if media_item.media_id == '3':
+                    raise ApiNetworkException('listing failed')
+                return [SubtitleStub('<subtitle id="%s" title="[English (US)] '
+                    'English (US)" default="1"/>' % media_item.media_id)]
+
+            async def unfold_subtitle_stub(self, subtitle_stub):
+                await asyncio.sleep(0)
+                return Subtitle(encrypt_subtitle(int(subtitle_stub.id),
+                    SUBTITLE_SCRIPT))
+        self.api = SubtitleAsyncMetaApi()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.api.close())
+        self.loop.close()
+
+    def test_iter_subtitles(self):
+        async def run():
+            return [result async for result in self.api.iter_subtitles(
+                [Media({'media_id': str(i)}) for i in range(1, 6)],
+                formats=['srt', 'vtt'], processes=0)]
+        results = self.loop.run_until_complete(run())
+        self.assertEqual(5, len(results))
+        errors = [result for result in results if result.error is not None]
+        self.assertEqual(['3'], [result.media.media_id for result in errors])
+        for result in results:
+            if result.error is None:
+                self.assertIn(b'Hello', result.subtitles['srt'])
+                self.assertTrue(result.subtitles['vtt'].startswith(b'WEBVTT'))
+
+    def test_stop_early(self):
+        async def run():
+            results = self.api.iter_subtitles(
+                [Media({'media_id': str(i)}) for i in range(4, 100)],
+                processes=0, max_pending=2)
+            async for result in results:
+                break
+            await results.aclose()
+            return result
+        self.assertIsNone(self.loop.run_until_complete(run()).error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,890 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+try:
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from urllib.parse import urlparse, parse_qs
+
+from crunchyroll.apis.meta import MetaApi
+from crunchyroll.apis.android import AndroidApi
+from crunchyroll.apis.ajax import AjaxApi, make_ajax_api_method, \
+    is_read_only_method
+from crunchyroll.apis.cache import ResponseCache, HttpCache, CachedResponse
+from crunchyroll.apis.pool import ConnectionPool
+from crunchyroll.apis.singleflight import SingleFlight
+from crunchyroll.apis.ratelimit import TokenBucket, AimdController, RateLimiter
+from crunchyroll.apis.retry import RetryPolicy, CircuitBreaker, parse_retry_after
+from crunchyroll.apis.deadline import Deadline, get_remaining, \
+    check_deadline, carry_deadline
+from crunchyroll.apis.streaming import JsonListStream
+from crunchyroll.apis.hydration import Hydrator
+from crunchyroll.apis.errors import *
+from crunchyroll.constants import META
+from crunchyroll.models import Series, Media, Page, FieldNotLoadedError
+from crunchyroll.util import iter_pages
+from crunchyroll import jsonbackend
+
+class FakeApiRequestHandler(BaseHTTPRequestHandler):
+    """Answers every request with a successful Android API style response
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    ETAG = '"test-etag"'
+
+    def do_GET(self):
+        self.server.request_count += 1
+        self.server.paths.append(self.path)
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if self.server.failures_left > 0:
+            self.server.failures_left -= 1
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == self.ETAG:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.server.body or json.dumps({
+            'error': False,
+            'code': 'ok',
+            'data': {'session_id': 'test-session', 'country_code': 'US'},
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', self.ETAG)
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *pargs):
+        pass
+
+class FakeApiServer(ThreadingMixIn, HTTPServer):
+    # keep-alive connections left open by a test shouldn't block shutting
+    # down the server
+    daemon_threads = True
+
+class FakeApiServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeApiServer(('127.0.0.1', 0), FakeApiRequestHandler)
+        self.server.request_count = 0
+        self.server.paths = []
+        self.server.failures_left = 0
+        self.server.delay = 0
+        self.server.body = None
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def point_at_server(self, api):
+        url = 'http://127.0.0.1:%d/api' % self.server.server_address[1]
+        api._build_request_url = lambda *pargs: url
+        return api
+
+class TestConnectionPool(FakeApiServerTestCase):
+    def test_shared_between_apis(self):
+        pool = ConnectionPool(connect_timeout=1, read_timeout=1)
+        api = MetaApi(pool=pool)
+        self.point_at_server(api._android_api)
+        self.point_at_server(api._manga_api)
+        api.start_session()
+        for i in range(3):
+            api._android_api.list_series()
+        stats = list(api.get_connection_stats().values())
+        self.assertEqual(1, len(stats))
+        self.assertEqual(5, stats[0]['requests'])
+        self.assertEqual(1, stats[0]['connections'])
+        self.assertEqual(4, stats[0]['reused'])
+
+    def test_bad_pool_full_policy(self):
+        with self.assertRaises(ValueError):
+            ConnectionPool(pool_full='explode')
+
+class TestResponseCache(FakeApiServerTestCase):
+    def test_catalog_methods_cached(self):
+        cache = ResponseCache()
+        api = self.point_at_server(AndroidApi(cache=cache))
+        api.start_session()
+        first = api.list_series(media_type='anime')
+        api._state_params['session_id'] = 'other-session'
+        self.assertIs(first, api.list_series(media_type='anime'))
+        api.list_series(media_type='drama')
+        # start_session isn't a catalog method and shouldn't be cached
+        api.start_session()
+        api.start_session()
+        self.assertEqual(5, self.server.request_count)
+        stats = cache.get_stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(2, stats['misses'])
+        self.assertEqual(2, stats['entries'])
+
+    def test_user_fields(self):
+        cache = ResponseCache(ttls={'info': 60, 'list_media': 60})
+        self.assertNotIn('info', ResponseCache.DEFAULT_TTLS)
+        api = self.point_at_server(AndroidApi(cache=cache))
+        for auth in ('user-a', 'user-b'):
+            api._state_params['auth'] = auth
+            api.info(media_id=1, fields='media.media_id,media.playhead')
+            api.list_media(series_id=1, fields='media.name')
+        # the playhead is per user, the names are the same for everyone
+        self.assertEqual(3, self.server.request_count)
+        self.assertEqual(2, len([key for key in cache._entries \
+            if ('auth', 'user-a') in key[1] or ('auth', 'user-b') in key[1]]))
+
+    def test_expiry(self):
+        cache = ResponseCache(ttls={'list_series': -1})
+        api = self.point_at_server(AndroidApi(cache=cache))
+        api.list_series()
+        api.list_series()
+        self.assertEqual(2, self.server.request_count)
+        self.assertEqual(1, cache.get_stats()['expired'])
+
+    def test_entry_size(self):
+        self.server.body = json.dumps({'error': False, 'code': 'ok',
+            'data': [{'series_id': '1'}]}).encode('utf-8')
+        cache = ResponseCache()
+        api = self.point_at_server(AndroidApi(cache=cache))
+        build_request = api._build_request
+        def racing_build_request(*pargs, **kwargs):
+            req_func = build_request(*pargs, **kwargs)
+            def do_request():
+                result = req_func()
+                # another thread's request finishing in between
+                api._last_response = CachedResponse(200, {}, b'x' * 1000)
+                return result
+            return do_request
+        api._build_request = racing_build_request
+        api.list_series(media_type='anime')
+        self.assertEqual(len(self.server.body), cache.get_stats()['bytes'])
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(max_entries=2, max_bytes=100)
+        for key in 'abc':
+            cache.set(key, key, 60, 10)
+        with self.assertRaises(KeyError):
+            cache.get('a')
+        cache.get('b')
+        cache.set('d', 'd', 60, 85)
+        self.assertEqual('b', cache.get('b'))
+        with self.assertRaises(KeyError):
+            cache.get('c')
+        self.assertEqual(95, cache.get_stats()['bytes'])
+
+class TestHttpCache(FakeApiServerTestCase):
+    def setUp(self):
+        super(TestHttpCache, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.cache_dir, 'http-cache.db')
+
+    def tearDown(self):
+        super(TestHttpCache, self).tearDown()
+        shutil.rmtree(self.cache_dir)
+
+    def test_persists_between_instances(self):
+        api = self.point_at_server(AndroidApi(http_cache=HttpCache(self.cache_path)))
+        first = api.list_series(media_type='anime')
+        api = self.point_at_server(AndroidApi(http_cache=HttpCache(self.cache_path)))
+        self.assertEqual(first, api.list_series(media_type='anime'))
+        self.assertEqual(1, self.server.request_count)
+
+    def test_revalidation(self):
+        http_cache = HttpCache(self.cache_path, ttls={'list_series': -1})
+        api = self.point_at_server(AndroidApi(http_cache=http_cache))
+        first = api.list_series(media_type='anime')
+        self.assertEqual(first, api.list_series(media_type='anime'))
+        self.assertEqual(2, self.server.request_count)
+        stats = http_cache.get_stats()
+        self.assertEqual((0, 2, 1, 1), (stats['hits'], stats['misses'],
+            stats['expired'], stats['revalidated']))
+
+    def test_stats_threads(self):
+        http_cache = HttpCache(self.cache_path)
+        http_cache.set('key', CachedResponse(200, {}, b'{}'), 60)
+        def lookup():
+            for i in range(200):
+                http_cache.get('key')
+                http_cache.get('other')
+        threads = [threading.Thread(target=lookup) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = http_cache.get_stats()
+        self.assertEqual((800, 800), (stats['hits'], stats['misses']))
+
+    def test_user_fields(self):
+        self.assertNotIn('info', HttpCache.DEFAULT_TTLS)
+        http_cache = HttpCache(self.cache_path, ttls={'info': 60})
+        params = {'media_id': 1, 'fields': 'media.stream_data'}
+        keys = set(http_cache.make_key('GET', 'http://example.com/info',
+            dict(params, auth=auth)) for auth in ('user-a', 'user-b'))
+        self.assertEqual(2, len(keys))
+        params['fields'] = 'media.name'
+        keys = set(http_cache.make_key('GET', 'http://example.com/info',
+            dict(params, auth=auth)) for auth in ('user-a', 'user-b'))
+        self.assertEqual(1, len(keys))
+
+    def test_decoded_once(self):
+        decoded = []
+        class RecordingBackend(jsonbackend.StdlibJsonBackend):
+            def loads(self, content):
+                decoded.append(content)
+                return super(RecordingBackend, self).loads(content)
+        http_cache = HttpCache(self.cache_path)
+        api = self.point_at_server(AndroidApi(http_cache=http_cache,
+            json_backend=RecordingBackend()))
+        api.list_series()
+        # checking the response could be cached didn't decode it again
+        self.assertEqual(1, len(decoded))
+        self.assertEqual(1, http_cache.get_stats()['entries'])
+
+    def test_reads_dont_write(self):
+        http_cache = HttpCache(self.cache_path)
+        http_cache.set('key', CachedResponse(200, {}, b'{}'), 60)
+        db = http_cache._get_db()
+        changes = db.total_changes
+        for i in range(3):
+            self.assertIsNotNone(http_cache.get('key'))
+        self.assertEqual(changes, db.total_changes)
+        # an old access time is still updated
+        db.execute('UPDATE responses SET accessed = 0')
+        changes = db.total_changes
+        http_cache.get('key')
+        self.assertEqual(changes + 1, db.total_changes)
+
+    def test_prune(self):
+        http_cache = HttpCache(self.cache_path, max_bytes=64 * 1024,
+            compress_level=0)
+        for i in range(100):
+            http_cache.set(str(i), CachedResponse(200, {}, os.urandom(1024)),
+                60)
+            # checked once enough has been stored
+            self.assertLessEqual(http_cache.get_stats()['bytes'],
+                64 * 1024 + 64 * 1024 // HttpCache.PRUNE_FRACTION + 1100)
+        self.assertIsNone(http_cache.get('0'))
+        self.assertIsNotNone(http_cache.get('99'))
+
+    def test_uncached_methods(self):
+        http_cache = HttpCache(self.cache_path)
+        api = self.point_at_server(AndroidApi(http_cache=http_cache))
+        api.start_session()
+        api.start_session()
+        self.assertEqual(2, self.server.request_count)
+        self.assertEqual(0, http_cache.get_stats()['entries'])
+
+    def test_error_responses_not_stored(self):
+        http_cache = HttpCache(self.cache_path)
+        api = self.point_at_server(AndroidApi(http_cache=http_cache))
+        # errors come back as 200s
+        self.server.body = json.dumps({
+            'error': True,
+            'code': 'bad_session',
+            'message': 'Session is invalid',
+        }).encode('utf-8')
+        self.assertRaises(ApiError, api.list_series, media_type='anime')
+        self.assertEqual(0, http_cache.get_stats()['entries'])
+        self.server.body = None
+        api.list_series(media_type='anime')
+        self.assertEqual(2, self.server.request_count)
+        self.assertEqual(1, http_cache.get_stats()['entries'])
+
+class TestSingleFlight(unittest.TestCase):
+    def run_concurrently(self, single_flight, func, count=8):
+        results = []
+        errors = []
+        def caller():
+            try:
+                results.append(single_flight.do('key', func))
+            except Exception as err:
+                errors.append(err)
+        threads = [threading.Thread(target=caller) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_coalesced(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+        def slow_func():
+            calls.append(1)
+            release.wait(5)
+            return 'result'
+        # let all the callers pile up on the first call before it finishes
+        threading.Timer(0.2, release.set).start()
+        results, errors = self.run_concurrently(single_flight, slow_func)
+        self.assertEqual(1, len(calls))
+        self.assertEqual(['result'] * 8, results)
+        self.assertEqual({'calls': 1, 'coalesced': 7, 'in_flight': 0},
+            single_flight.get_stats())
+
+    def test_shared_error(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        def slow_failure():
+            release.wait(5)
+            raise ApiNetworkException('down')
+        threading.Timer(0.2, release.set).start()
+        results, errors = self.run_concurrently(single_flight, slow_failure)
+        self.assertEqual([], results)
+        self.assertEqual(8, len(errors))
+        self.assertEqual(1, single_flight.get_stats()['calls'])
+
+    def test_sequential_calls_not_coalesced(self):
+        single_flight = SingleFlight()
+        self.assertEqual(1, single_flight.do('key', lambda: 1))
+        self.assertEqual(2, single_flight.do('key', lambda: 2))
+
+class TestRateLimiter(FakeApiServerTestCase):
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        self.assertEqual(0, bucket.reserve())
+        self.assertEqual(0, bucket.reserve())
+        self.assertAlmostEqual(0.1, bucket.reserve(), places=2)
+        self.assertAlmostEqual(0.2, bucket.reserve(), places=2)
+
+    def test_timeout_keeps_token(self):
+        limiter = RateLimiter(rates={RateLimiter.FAMILY_AJAX: (1, 1)})
+        bucket = limiter.get_bucket(RateLimiter.FAMILY_AJAX)
+        with limiter.limit(RateLimiter.FAMILY_AJAX, 1):
+            pass
+        self.assertIsNone(bucket.reserve(0.5))
+        for i in range(3):
+            with self.assertRaises(ApiTimeoutException):
+                limiter.limit(RateLimiter.FAMILY_AJAX, 0.5)
+        # the requests that timed out didn't push the next one further back
+        self.assertAlmostEqual(1, bucket.reserve(), places=1)
+        controller = limiter.get_controller(RateLimiter.FAMILY_AJAX)
+        self.assertEqual(0, controller.in_flight)
+
+    def test_aimd_decrease_and_increase(self):
+        controller = AimdController(initial_limit=8, cooldown=0)
+        self.assertTrue(controller.try_acquire())
+        controller.release(0.1, ok=False)
+        self.assertEqual(4, controller.limit)
+        for i in range(8):
+            self.assertTrue(controller.try_acquire())
+            controller.release(0.1)
+        # +1 per limit's worth of successful requests
+        self.assertEqual(5, controller.limit)
+
+    def test_aimd_latency_baseline_moves(self):
+        controller = AimdController(initial_limit=8, cooldown=0,
+            latency_window=10)
+        for i in range(10):
+            self.assertTrue(controller.try_acquire())
+            controller.release(0.01)
+        # the server got slower for good
+        latencies = [0.1, 0.12, 0.08, 0.15] * 25
+        lowest = controller.limit
+        for latency in latencies:
+            self.assertTrue(controller.try_acquire())
+            controller.release(latency)
+            lowest = min(lowest, controller.limit)
+        self.assertLess(lowest, 8)
+        self.assertGreater(controller.limit, lowest)
+        self.assertEqual(0.08, controller.get_stats()['min_latency'])
+
+    def test_aimd_limits_concurrency(self):
+        controller = AimdController(initial_limit=2)
+        self.assertTrue(controller.try_acquire())
+        self.assertTrue(controller.try_acquire())
+        self.assertFalse(controller.try_acquire())
+        controller.release()
+        self.assertTrue(controller.try_acquire())
+
+    def test_backoff_status(self):
+        limiter = RateLimiter(controller_args={'initial_limit': 8, 'cooldown': 0})
+        with limiter.limit(RateLimiter.FAMILY_AJAX) as slot:
+            slot.status_code = 429
+        controller = limiter.get_controller(RateLimiter.FAMILY_AJAX)
+        self.assertEqual(4, controller.limit)
+        self.assertEqual(0, controller.in_flight)
+
+    def test_api_requests_limited(self):
+        limiter = RateLimiter(rates={RateLimiter.FAMILY_ANDROID: (20, 1)})
+        api = MetaApi(rate_limiter=limiter)
+        self.point_at_server(api._android_api)
+        started = time.time()
+        for i in range(3):
+            api._android_api.list_series()
+        # the first request uses the burst, the next two wait 50ms each
+        self.assertGreaterEqual(time.time() - started, 0.09)
+        stats = api.get_rate_limit_stats()
+        self.assertEqual(0, stats['android']['in_flight'])
+        self.assertEqual(20, stats['android']['rate'])
+        self.assertEqual(3, self.server.request_count)
+
+class TestRetryPolicy(FakeApiServerTestCase):
+    def test_idempotent_methods(self):
+        policy = RetryPolicy()
+        self.assertTrue(policy.can_retry('GET'))
+        self.assertFalse(policy.can_retry('POST'))
+        self.assertTrue(policy.can_retry('POST', idempotent=True))
+        self.assertFalse(RetryPolicy(max_attempts=1).can_retry('GET'))
+
+    def test_delay(self):
+        policy = RetryPolicy(max_attempts=3, backoff_base=1, deadline=10)
+        for i in range(10):
+            self.assertTrue(0 <= policy.get_delay(2, 0) <= 2)
+        self.assertEqual(5, policy.get_delay(1, 0, '5'))
+        # out of attempts, past the deadline, Retry-After too long
+        self.assertIsNone(policy.get_delay(3, 0))
+        self.assertIsNone(policy.get_delay(1, 8, '5'))
+        self.assertIsNone(policy.get_delay(1, 0, '3600'))
+
+    def test_parse_retry_after(self):
+        self.assertEqual(2, parse_retry_after('2'))
+        self.assertEqual(0, parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'))
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertIsNone(parse_retry_after(None))
+
+    def test_get_retried(self):
+        self.server.failures_left = 2
+        api = self.point_at_server(AndroidApi())
+        api.list_series()
+        self.assertEqual(3, self.server.request_count)
+
+    def test_gives_up(self):
+        self.server.failures_left = 5
+        api = self.point_at_server(AndroidApi(
+            retry_policy=RetryPolicy(max_attempts=2)))
+        with self.assertRaises(ApiBadResponseException):
+            api.list_series()
+        self.assertEqual(2, self.server.request_count)
+
+    def test_ajax_writes_not_retried(self):
+        class QueueAjaxApi(AjaxApi):
+            @make_ajax_api_method(AjaxApi.METHOD_POST)
+            def Queue_Add(self, req_func):
+                return req_func()
+        self.assertTrue(is_read_only_method('Subtitle_GetListing'))
+        self.assertFalse(is_read_only_method('Queue_Add'))
+        self.server.failures_left = 1
+        api = self.point_at_server(QueueAjaxApi())
+        with self.assertRaises(ApiBadResponseException):
+            api.Queue_Add(media_id=1)
+        self.assertEqual(1, self.server.request_count)
+        # reads are POSTs too but still retried
+        self.server.failures_left = 1
+        with self.assertRaises(ApiBadResponseException):
+            # the fake server doesn't answer with XML
+            api.Subtitle_GetListing(media_id=1)
+        self.assertEqual(3, self.server.request_count)
+
+class TestFieldProjection(FakeApiServerTestCase):
+    def setUp(self):
+        super(TestFieldProjection, self).setUp()
+        self.api = MetaApi()
+        self.point_at_server(self.api._android_api)
+        self.point_at_server(self.api._manga_api)
+        self.api.start_session()
+        self.server.body = json.dumps({
+            'error': False,
+            'code': 'ok',
+            'data': [{'media_id': '1', 'name': 'Episode 1'}],
+        }).encode('utf-8')
+
+    def get_fields_param(self):
+        query = parse_qs(urlparse(self.server.paths[-1]).query)
+        return query.get('fields', [None])[0]
+
+    def test_fields_sent(self):
+        series = Series({'series_id': '1'})
+        media = self.api.list_media(series, fields=META.FIELDS_IDS)
+        self.assertEqual(','.join(META.FIELDS_IDS), self.get_fields_param())
+        self.assertEqual('1', media.get_by_id('1').media_id)
+        self.assertEqual(Media.get_loaded_fields(META.FIELDS_IDS),
+            media[0].loaded_fields)
+
+        series_list = self.api.search_anime_series('Ep',
+            fields=META.FIELDS_BROWSE)
+        self.assertEqual(','.join(META.FIELDS_BROWSE), self.get_fields_param())
+        self.assertIsInstance(series_list[0], Series)
+
+    def test_default_fields(self):
+        media = self.api.list_media(Series({'series_id': '1'}))
+        self.assertIsNone(self.get_fields_param())
+        self.assertIsNone(media[0].loaded_fields)
+        self.assertIsNone(media[0].description)
+
+    def test_hydrated_through_info(self):
+        media = self.api.list_media(Series({'series_id': '1'}),
+            fields=META.FIELDS_IDS)
+        self.server.body = json.dumps({
+            'error': False,
+            'code': 'ok',
+            'data': {'media_id': '1', 'name': 'Other name',
+                'description': 'Something happens'},
+        }).encode('utf-8')
+        self.assertEqual('Something happens', media[0].description)
+        query = parse_qs(urlparse(self.server.paths[-1]).query)
+        self.assertEqual(['1'], query['media_id'])
+        self.assertIn('media.stream_data', query['fields'][0].split(','))
+        # what the listing sent is kept
+        self.assertEqual('Episode 1', media[0].name)
+        self.assertIsNone(media[0].loaded_fields)
+        self.assertIsNone(media[0].stream_data)
+
+    def test_fields_without_id(self):
+        media = self.api.list_media(Series({'series_id': '1'}),
+            fields=['media.name'])
+        self.assertEqual('media.name,' + ','.join(META.FIELDS_IDS),
+            self.get_fields_param())
+        self.server.body = json.dumps({
+            'error': False,
+            'code': 'ok',
+            'data': {'media_id': '1', 'description': 'Something happens'},
+        }).encode('utf-8')
+        self.assertEqual('Something happens', media[0].description)
+        self.assertEqual(['1'], parse_qs(urlparse(
+            self.server.paths[-1]).query)['media_id'])
+        # a response that left the id out anyway can't be hydrated
+        media = self.api._project(Media, [{'name': 'Episode 2'}],
+            ['media.name'])
+        paths = len(self.server.paths)
+        self.assertRaises(FieldNotLoadedError, getattr, media[0],
+            'description')
+        self.assertEqual(paths, len(self.server.paths))
+
+class TestHydrator(unittest.TestCase):
+    def setUp(self):
+        self.fetched = []
+        self.failing = set()
+        self.models = [Media({'media_id': str(i)},
+            Media.get_loaded_fields(META.FIELDS_IDS)) for i in range(25)]
+
+    def fetch(self, model):
+        self.fetched.append(model.media_id)
+        if model.media_id in self.failing:
+            raise ApiNetworkException('failed')
+        return {'media_id': model.media_id, 'name': 'Episode ' + model.media_id}
+
+    def test_batches(self):
+        Hydrator(self.fetch, batch_size=10, max_workers=4).add(self.models)
+        self.assertEqual('Episode 3', self.models[3].name)
+        self.assertEqual([str(i) for i in range(3, 13)], sorted(self.fetched,
+            key=int))
+        self.assertEqual('Episode 12', self.models[12].name)
+        self.assertIsNone(self.models[5].description)
+        self.assertEqual(10, len(self.fetched))
+        # the models before the one read are left for later
+        self.assertEqual('Episode 0', self.models[0].name)
+        self.assertEqual(20, len(self.fetched))
+
+    def test_concurrency_bounded(self):
+        active = [0]
+        seen = []
+        lock = threading.Lock()
+        def slow_fetch(model):
+            with lock:
+                active[0] += 1
+                seen.append(active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+            return self.fetch(model)
+        hydrator = Hydrator(slow_fetch, batch_size=10, max_workers=3)
+        hydrator.add(self.models)
+        hydrator.hydrate_many(self.models)
+        self.assertEqual(25, len(self.fetched))
+        self.assertEqual(3, max(seen))
+        self.assertTrue(all(model.loaded_fields is None \
+            for model in self.models))
+
+    def test_errors(self):
+        self.failing = set(['0', '1'])
+        Hydrator(self.fetch, batch_size=3).add(self.models)
+        self.assertRaises(ApiNetworkException, getattr, self.models[0], 'name')
+        self.assertIsNotNone(self.models[0].loaded_fields)
+        # a sibling's failure is only logged, it's tried again when it's read
+        self.assertEqual('Episode 2', self.models[2].name)
+        self.failing = set()
+        self.assertEqual('Episode 1', self.models[1].name)
+        self.assertEqual(['0', '1', '2', '1', '3', '4'], self.fetched)
+
+    def test_not_hydratable(self):
+        model = Media({'media_id': '1'}, Media.get_loaded_fields(META.FIELDS_IDS))
+        self.assertRaises(FieldNotLoadedError, getattr, model, 'name')
+
+class TestJsonBackend(FakeApiServerTestCase):
+    def get_available_backends(self):
+        backends = []
+        for name in jsonbackend.PREFERENCE:
+            try:
+                backends.append(jsonbackend.make_backend(name))
+            except ImportError:
+                pass
+        return backends
+
+    def test_backends(self):
+        content = json.dumps({'data': [{'name': u'\u3042', 'n': 1.5}]}).encode('utf-8')
+        backends = self.get_available_backends()
+        self.assertEqual(backends[0].name, jsonbackend.get_backend().name)
+        for backend in backends:
+            self.assertEqual(json.loads(content.decode('utf-8')),
+                backend.loads(content))
+            self.assertRaises(ValueError, backend.loads, b'<html>')
+        self.assertRaises(ValueError, jsonbackend.make_backend, 'yaml')
+
+    def test_per_api_backend(self):
+        decoded = []
+        class RecordingBackend(jsonbackend.StdlibJsonBackend):
+            def loads(self, content):
+                decoded.append(content)
+                return super(RecordingBackend, self).loads(content)
+        api = self.point_at_server(AndroidApi(json_backend=RecordingBackend()))
+        other_api = self.point_at_server(AndroidApi())
+        api.list_series()
+        other_api.list_series()
+        self.assertEqual(1, len(decoded))
+        self.assertIsInstance(decoded[0], bytes)
+
+        previous = jsonbackend.set_backend(RecordingBackend())
+        self.addCleanup(jsonbackend.set_backend, previous)
+        other_api.list_series()
+        self.assertEqual(2, len(decoded))
+
+class TestJsonListStream(FakeApiServerTestCase):
+    def split(self, content, size):
+        return [content[i:i + size] for i in range(0, len(content), size)]
+
+    def test_chunk_boundaries(self):
+        items = [{'name': u'\u3042\u3044', 'n': 12345}, 67890, u'x', None,
+            True, [1, [2]], -1.5e3]
+        content = json.dumps({'code': 'ok', 'data': items,
+            'error': False}).encode('utf-8')
+        for size in (1, 2, 3, 7, len(content)):
+            stream = JsonListStream(self.split(content, size))
+            self.assertEqual(items, list(stream))
+            self.assertEqual({'code': 'ok', 'error': False}, stream.envelope)
+
+    def test_bare_list(self):
+        self.assertEqual([1, 2], list(JsonListStream([b' [1', b',2] '])))
+        self.assertEqual([], list(JsonListStream([b'[]'])))
+        self.assertEqual([], list(JsonListStream([b'{"data": []}'])))
+
+    def test_first_item_before_end(self):
+        def chunks():
+            yield b'{"data": [{"id": 1}, '
+            raise AssertionError('read too far')
+        self.assertEqual({'id': 1}, next(iter(JsonListStream(chunks()))))
+
+    def test_error_envelope(self):
+        content = b'{"error": true, "code": "bad_request", "message": "Nope", ' \
+            b'"data": []}'
+        with self.assertRaises(ApiError):
+            list(JsonListStream(self.split(content, 5)))
+        with self.assertRaises(ApiError):
+            list(JsonListStream([b'{"data": [1], "error": true}']))
+        self.assertEqual([1, 2], list(JsonListStream(
+            [b'{"error": false, "data": [1, 2]}'])))
+
+    def test_bad_response(self):
+        for content in (b'<html>503</html>', b'{"data": [1, 2', b'{"data": null}',
+                b'{"data": [1 2]}', b''):
+            with self.assertRaises(ApiBadResponseException):
+                list(JsonListStream(self.split(content, 3)))
+
+    def test_api_stream(self):
+        items = [{'media_id': str(i)} for i in range(100)]
+        self.server.body = json.dumps({'error': False, 'code': 'ok',
+            'data': items}).encode('utf-8')
+        api = self.point_at_server(AndroidApi())
+        self.assertEqual(items, api.list_media(series_id=1))
+        stream = api.list_media(series_id=1, stream=True)
+        self.assertEqual(2, self.server.request_count)
+        self.assertEqual(items, list(stream))
+
+    def test_api_stream_error(self):
+        api = self.point_at_server(AndroidApi())
+        self.server.body = json.dumps({'data': [1, 2], 'ops': ['op'],
+            'error': False, 'code': 'ok'}).encode('utf-8')
+        self.assertEqual([1, 2], list(api.list_media(series_id=1,
+            stream=True)))
+        self.assertEqual(['op'], api._session_ops)
+        # an error after the list is raised once the list has been read
+        self.server.body = json.dumps({'data': [1, 2], 'error': True,
+            'code': 'bad_request', 'message': 'Bad'}).encode('utf-8')
+        received = []
+        with self.assertRaises(ApiError):
+            for item in api.list_media(series_id=1, stream=True):
+                received.append(item)
+        self.assertEqual([1, 2], received)
+        self.assertEqual(['op'], api._session_ops)
+
+class TestCircuitBreaker(FakeApiServerTestCase):
+    def test_opens_and_probes(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        url = 'http://example.com/api'
+        breaker.record_failure(url)
+        breaker.before_request(url)
+        breaker.record_failure(url)
+        with self.assertRaises(ApiCircuitOpenException):
+            breaker.before_request(url)
+        # other hosts aren't affected
+        breaker.before_request('http://example.org/api')
+        time.sleep(0.06)
+        breaker.before_request(url)
+        self.assertEqual(CircuitBreaker.STATE_HALF_OPEN, breaker.get_state(url))
+        # only the one probe is let through
+        with self.assertRaises(ApiCircuitOpenException):
+            breaker.before_request(url)
+        breaker.record_success(url)
+        self.assertEqual(CircuitBreaker.STATE_CLOSED, breaker.get_state(url))
+        breaker.before_request(url)
+
+    def test_fails_fast(self):
+        self.server.failures_left = 10
+        api = self.point_at_server(AndroidApi(
+            retry_policy=RetryPolicy(max_attempts=1),
+            circuit_breaker=CircuitBreaker(failure_threshold=2)))
+        for i in range(2):
+            with self.assertRaises(ApiBadResponseException):
+                api.list_series()
+        with self.assertRaises(ApiCircuitOpenException):
+            api.list_series()
+        self.assertEqual(2, self.server.request_count)
+
+    def test_one_failure_per_request(self):
+        self.server.failures_left = 10
+        breaker = CircuitBreaker(failure_threshold=2)
+        api = self.point_at_server(AndroidApi(
+            retry_policy=RetryPolicy(max_attempts=3), circuit_breaker=breaker))
+        with self.assertRaises(ApiBadResponseException):
+            api.list_series()
+        self.assertEqual(3, self.server.request_count)
+        self.assertEqual({'state': CircuitBreaker.STATE_CLOSED, 'failures': 1},
+            list(breaker.get_stats().values())[0])
+
+    def test_ignores_deadline_timeouts(self):
+        self.server.delay = 0.3
+        breaker = CircuitBreaker(failure_threshold=1)
+        api = self.point_at_server(AndroidApi(
+            pool=ConnectionPool(read_timeout=0.2),
+            retry_policy=RetryPolicy(max_attempts=1), circuit_breaker=breaker))
+        with self.assertRaises(ApiTimeoutException):
+            with Deadline(0.1):
+                api.list_series()
+        self.assertEqual({}, breaker.get_stats())
+        # the pool's own timeout does say something about the host
+        with self.assertRaises(ApiTimeoutException):
+            api.list_series()
+        self.assertEqual(CircuitBreaker.STATE_OPEN,
+            list(breaker.get_stats().values())[0]['state'])
+
+class TestDeadline(FakeApiServerTestCase):
+    def test_nested(self):
+        self.assertIsNone(get_remaining())
+        with Deadline(10):
+            with Deadline(60):
+                self.assertLessEqual(get_remaining(), 10)
+            with Deadline(None):
+                self.assertLessEqual(get_remaining(), 10)
+            with Deadline(0):
+                with self.assertRaises(ApiTimeoutException):
+                    check_deadline()
+        self.assertIsNone(get_remaining())
+
+    def test_budget_covers_session_start(self):
+        self.server.delay = 0.2
+        api = MetaApi(retry_policy=RetryPolicy(max_attempts=1))
+        self.point_at_server(api._android_api)
+        self.point_at_server(api._manga_api)
+        started = time.time()
+        # starting the sessions takes 0.4s of the budget, leaving too little
+        # for the actual request
+        with self.assertRaises(ApiTimeoutException):
+            api.list_anime_series(timeout=0.5)
+        self.assertLess(time.time() - started, 0.8)
+        self.assertTrue(api.session_started)
+
+    def test_default_timeout(self):
+        self.server.delay = 0.2
+        api = MetaApi(timeout=0.1)
+        self.point_at_server(api._android_api)
+        self.point_at_server(api._manga_api)
+        with self.assertRaises(ApiTimeoutException):
+            api.start_session()
+        self.assertTrue(api.start_session(timeout=1))
+
+    def test_carried_to_threads(self):
+        remaining = []
+        def fetch_page(offset, limit):
+            remaining.append(get_remaining())
+            return list(range(offset, min(offset + limit, 6)))
+        def fetch_model(model):
+            remaining.append(get_remaining())
+            return {'media_id': model.media_id}
+        with Deadline(10):
+            self.assertEqual(list(range(6)), list(iter_pages(fetch_page, 2)))
+            models = [Media({'media_id': str(i)},
+                Media.get_loaded_fields(META.FIELDS_IDS)) for i in range(3)]
+            Hydrator(fetch_model, max_workers=3).hydrate_many(models)
+        self.assertEqual(7, len(remaining))
+        for seconds in remaining:
+            self.assertIsNotNone(seconds)
+            self.assertLessEqual(seconds, 10)
+        self.assertIs(fetch_page, carry_deadline(fetch_page))
+
+    def test_page_stream(self):
+        api = MetaApi()
+        self.point_at_server(api._android_api)
+        self.point_at_server(api._manga_api)
+        api.start_session()
+        # goes through the retry policy like every other request
+        self.server.failures_left = 1
+        self.server.body = b'\x00' * 16
+        url = 'http://127.0.0.1:%d/page.jpg' % self.server.server_address[1]
+        page = Page({'page_id': '1', 'locale': {
+            'enUS': {'encrypted_composed_image_url': url}}})
+        self.assertEqual(16, len(b''.join(api.get_page_stream(page))))
+        self.assertEqual(['/page.jpg', '/page.jpg'],
+            [path for path in self.server.paths if path == '/page.jpg'])
+
+if __name__ == '__main__':
+    unittest.main()
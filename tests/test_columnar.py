@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from crunchyroll import columnar
+from crunchyroll.columnar import MediaCollection, Mask
+from crunchyroll.models import Media
+
+class TestMediaCollection(unittest.TestCase):
+    # column backend, the stdlib arrays here and numpy in the subclass
+    backend = None
+
+    def setUp(self):
+        self._numpy = columnar.numpy
+        columnar.numpy = self.backend
+        self.data = [
+            {'media_id': '1', 'episode_number': '3', 'free_available': True,
+                'clip': False, 'duration': 1420},
+            {'media_id': '2', 'episode_number': '1', 'free_available': False,
+                'clip': False, 'duration': 1440},
+            {'media_id': '3', 'episode_number': '', 'free_available': True,
+                'clip': True, 'duration': 90},
+            {'media_id': '4', 'episode_number': '2', 'free_available': True,
+                'clip': False},
+        ]
+        self.media = MediaCollection(self.data)
+
+    def tearDown(self):
+        columnar.numpy = self._numpy
+
+    def ids(self, collection):
+        return [m.media_id for m in collection]
+
+    def test_rows(self):
+        self.assertEqual(4, len(self.media))
+        self.assertIsInstance(self.media[0], Media)
+        self.assertIs(self.media[0], self.media[0])
+        self.assertEqual('4', self.media[-1].media_id)
+        self.assertEqual(['2', '3'], self.ids(self.media[1:3]))
+        self.assertEqual(self.ids(self.media), self.ids(self.media.to_list()))
+
+    def test_filter(self):
+        free = self.media[self.media['free_available'] & ~self.media['clip']]
+        self.assertEqual(['1', '4'], self.ids(free))
+        self.assertEqual(['2'], self.ids(self.media[self.media['duration'] > 1430]))
+        # strings are compared as numbers for numeric columns
+        self.assertEqual(['1', '4'],
+            self.ids(self.media[self.media['episode_sort_key'] >= '2']))
+        self.assertEqual(['3'],
+            self.ids(self.media[self.media['episode_sort_key'].isnull()]))
+        self.assertEqual(['2'],
+            self.ids(self.media[self.media['episode_number'] == '1']))
+        self.assertEqual(['1', '3'],
+            self.ids(self.media[self.media['media_id'].isin(['1', '3'])]))
+        self.assertEqual(['3'],
+            self.ids(self.media.where(free_available=True, clip=True)))
+
+    def test_filter_subset(self):
+        free = self.media.where(free_available=True)
+        mask = free['duration'] < 1000
+        self.assertIsInstance(mask, Mask)
+        self.assertEqual(1, mask.count())
+        self.assertEqual(['3'], self.ids(free[mask]))
+        self.assertRaises(ValueError, free.filter, self.media['clip'])
+        self.assertRaises(TypeError, self.media.filter, self.media['media_id'])
+
+    def test_sort(self):
+        self.assertEqual(['2', '4', '1', '3'],
+            self.ids(self.media.sort_by('episode_number')))
+        self.assertEqual(['1', '4', '2', '3'],
+            self.ids(self.media.sort_by('episode_number', reverse=True)))
+        free = self.media.where(free_available=True).sort_by('episode_number')
+        self.assertEqual(['4', '1'], self.ids(free[:2]))
+
+    def test_episode_numbers(self):
+        numbers = ['12.5a', 'OVA', '2', 'SP1', '12', '10', None]
+        media = MediaCollection([{'media_id': str(i), 'episode_number': n} \
+            for i, n in enumerate(numbers)])
+        self.assertEqual(numbers, media['episode_number'].to_list())
+        self.assertEqual(['2', '10', '12', '12.5a', 'OVA', 'SP1', None],
+            [m.episode_number for m in media.sort_by('episode_number')])
+        self.assertEqual(['12.5a', '12', '10', '2', 'OVA', 'SP1', None],
+            [m.episode_number for m in \
+                media.sort_by('episode_number', reverse=True)])
+        self.assertEqual(['1', '3'], self.ids(
+            media[media['episode_number'].isin(['OVA', 'SP1'])]))
+
+    def test_models(self):
+        media = [Media(d) for d in self.data]
+        collection = MediaCollection(media)
+        self.assertIs(media[2], collection[collection['clip']][0])
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestMediaCollectionNumpy(TestMediaCollection):
+    backend = numpy
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import threading
+import time
+import unittest
+
+from crunchyroll.apis.meta import MetaApi
+from crunchyroll.apis.errors import *
+from crunchyroll.constants import META
+from crunchyroll.crawler import CatalogCrawler
+from crunchyroll.models import Series, Media
+
+class FakeMetaApi(MetaApi):
+    """MetaApi with the network calls replaced by a fixed catalog
+    """
+
+    def __init__(self, catalog):
+        super(FakeMetaApi, self).__init__()
+        self._catalog = catalog
+        self.sessions_started = 0
+        self.media_listed = 0
+        self.media_delay = 0
+        self.lock = threading.Lock()
+
+    @property
+    def session_started(self):
+        return self.sessions_started > 0
+
+    def start_session(self):
+        self.sessions_started += 1
+
+    def _list_series(self, media_type, limit, offset):
+        if offset == 10 and self._catalog.get('broken_windows'):
+            raise ApiNetworkException('broken window')
+        return [Series(s) for s in self._catalog[media_type][offset:offset + limit]]
+
+    def list_anime_series(self, sort=META.SORT_ALPHA, limit=META.MAX_SERIES, offset=0):
+        return self._list_series(META.TYPE_ANIME, limit, offset)
+
+    def list_drama_series(self, sort=META.SORT_ALPHA, limit=META.MAX_SERIES, offset=0):
+        return self._list_series(META.TYPE_DRAMA, limit, offset)
+
+    def list_media(self, series, sort=META.SORT_DESC, limit=META.MAX_MEDIA, offset=0):
+        with self.lock:
+            self.media_listed += 1
+        time.sleep(self.media_delay)
+        if series.series_id == 'broken':
+            raise ApiNetworkException('broken series')
+        return [Media({'media_id': '%s-%d' % (series.series_id, i)}) \
+            for i in range(3)]
+
+class TestCatalogCrawler(unittest.TestCase):
+    def setUp(self):
+        self.catalog = {
+            META.TYPE_ANIME: [{'series_id': 'a%d' % i} for i in range(23)],
+            META.TYPE_DRAMA: [{'series_id': 'd%d' % i} for i in range(7)],
+        }
+
+    def test_crawl(self):
+        # the same series showing up twice should only be crawled once
+        self.catalog[META.TYPE_DRAMA].append({'series_id': 'a1'})
+        api = FakeMetaApi(self.catalog)
+        results = list(CatalogCrawler(api, workers=4, window_size=5).crawl())
+        self.assertEqual(1, api.sessions_started)
+        self.assertEqual(30, len(results))
+        self.assertEqual(set(['a%d' % i for i in range(23)] + \
+                ['d%d' % i for i in range(7)]),
+            set(r.series.series_id for r in results))
+        for result in results:
+            self.assertIsNone(result.error)
+            self.assertEqual(3, len(result.media))
+
+    def test_media_error(self):
+        self.catalog[META.TYPE_ANIME].append({'series_id': 'broken'})
+        results = list(CatalogCrawler(FakeMetaApi(self.catalog),
+            workers=2, window_size=10).crawl())
+        errors = [r for r in results if r.error is not None]
+        self.assertEqual(1, len(errors))
+        self.assertIsInstance(errors[0].error, ApiNetworkException)
+        self.assertIsNone(errors[0].media)
+
+    def test_stop_early(self):
+        api = FakeMetaApi(self.catalog)
+        api.media_delay = 0.05
+        results = CatalogCrawler(api, workers=2, window_size=5,
+            max_pending=3).crawl()
+        start = time.time()
+        next(results)
+        results.close()
+        # the other 29 series would take 0.7s on 2 workers
+        self.assertLess(time.time() - start, 0.4)
+        time.sleep(0.15)
+        # the one handed back, the ones submitted and nothing else
+        self.assertLessEqual(api.media_listed, 1 + 3)
+
+    def test_window_error(self):
+        self.catalog['broken_windows'] = True
+        api = FakeMetaApi(self.catalog)
+        api.media_delay = 0.05
+        start = time.time()
+        with self.assertRaises(ApiNetworkException):
+            list(CatalogCrawler(api, workers=2, window_size=5).crawl())
+        self.assertLess(time.time() - start, 0.4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import json
+import pickle
+import unittest
+
+from crunchyroll import interning, xmlbackend
+
+from crunchyroll.constants import META
+from crunchyroll.models import DictModel, Series, Media, Page, Image, \
+    MediaList, SeriesList, XmlModel, MediaStream, SubtitleStub, StyledSubtitle, \
+    FieldNotLoadedError
+from crunchyroll.util import return_collection
+
+class TestCompiledModels(unittest.TestCase):
+    def setUp(self):
+        self.media_data = {
+            'media_id':         '600001',
+            'name':             'Episode 1',
+            'screenshot_image': {'full_url': 'http://example.com/full.jpg'},
+            'some_new_field':   {'value': 1},
+        }
+
+    def test_fields(self):
+        media = Media(self.media_data)
+        self.assertEqual('600001', media.media_id)
+        self.assertEqual('600001', media['media_id'])
+        # known fields the API didn't send and unknown fields both give None
+        self.assertIsNone(media.episode_number)
+        self.assertIsNone(media.not_a_field)
+        self.assertEqual(1, media.some_new_field.value)
+        self.assertFalse(hasattr(media, '__dict__'))
+
+    def test_nested_models_cached(self):
+        media = Media(self.media_data)
+        self.assertIsInstance(media.screenshot_image, Image)
+        self.assertIs(media.screenshot_image, media.screenshot_image)
+        self.assertEqual('http://example.com/full.jpg',
+            media.screenshot_image.full_url)
+        self.assertIsNone(Series({'series_id': '1'}).portrait_image)
+
+    def test_locale_map(self):
+        page = Page({'page_id': '1', 'locale': {
+            'enUS': {'encrypted_composed_image_url': 'http://example.com/1'},
+        }})
+        self.assertEqual('http://example.com/1',
+            page.locale['enUS'].encrypted_composed_image_url)
+        self.assertIs(page.locale['enUS'], page.locale.enUS)
+        self.assertIn('enUS', page.locale)
+        self.assertIsNone(page.locale['jaJP'])
+
+    def test_round_trip(self):
+        media = Media(self.media_data)
+        self.assertEqual(self.media_data, media.to_dict())
+        self.assertEqual(self.media_data, Media(media).to_dict())
+        self.assertEqual(self.media_data,
+            pickle.loads(pickle.dumps(media)).to_dict())
+        self.assertEqual(self.media_data,
+            Media(DictModel(self.media_data)).to_dict())
+
+    def test_bad_data(self):
+        with self.assertRaises(TypeError):
+            Series(['not', 'a', 'dict'])
+
+class TestFieldProjection(unittest.TestCase):
+    def setUp(self):
+        self.loaded = Media.get_loaded_fields(META.FIELDS_BROWSE)
+        self.media = Media({
+            'media_id':         '600001',
+            'name':             'Episode 1',
+            'screenshot_image': {'full_url': 'http://example.com/full.jpg'},
+        }, self.loaded)
+
+    def test_loaded_fields(self):
+        self.assertIn('episode_number', self.loaded)
+        self.assertIn('screenshot_image', self.loaded)
+        self.assertNotIn('name', Series.get_loaded_fields(META.FIELDS_IDS))
+        self.assertEqual(frozenset(['media_id', 'ordering']),
+            Media.get_loaded_fields(['media.media_id', 'series.series_id',
+                'ordering']))
+        self.assertIsNone(Media({'media_id': '1'}).loaded_fields)
+
+    def test_unloaded_field(self):
+        self.assertEqual('Episode 1', self.media.name)
+        # requested but not sent
+        self.assertIsNone(self.media.episode_number)
+        with self.assertRaises(FieldNotLoadedError) as cm:
+            self.media.description
+        self.assertIn('Media.description', str(cm.exception))
+        self.assertRaises(FieldNotLoadedError, getattr, self.media,
+            'not_a_field')
+        self.assertFalse(hasattr(self.media, 'stream_data'))
+
+    def test_nested(self):
+        self.assertEqual('http://example.com/full.jpg',
+            self.media.screenshot_image.full_url)
+        media = Media({'media_id': '1'}, self.loaded)
+        self.assertIsNone(media.screenshot_image)
+        self.assertRaises(FieldNotLoadedError, getattr, media, 'stream_data')
+
+    def test_copies_keep_fields(self):
+        self.assertEqual(self.loaded, Media(self.media).loaded_fields)
+        self.assertEqual(self.loaded,
+            pickle.loads(pickle.dumps(self.media)).loaded_fields)
+        self.assertIs(self.media,
+            return_collection(Media)(lambda self: [self])(self.media)[0])
+
+class TestModelLists(unittest.TestCase):
+    def setUp(self):
+        @return_collection(Media)
+        def list_media(self):
+            return [
+                {'media_id': '10', 'episode_number': '2'},
+                {'media_id': '11', 'episode_number': 'SP1'},
+                {'media_id': '12', 'episode_number': '1'},
+                {'media_id': '13', 'episode_number': '12.5'},
+                {'media_id': '14', 'episode_number': ''},
+                {'media_id': '15', 'episode_number': '02'},
+            ]
+        self.media = list_media(None)
+
+    def ids(self, items):
+        return [m.media_id for m in items]
+
+    def test_list_type(self):
+        self.assertIsInstance(self.media, MediaList)
+        self.assertIsInstance(
+            return_collection(Series)(lambda self: [{'series_id': 1}])(None),
+            SeriesList)
+
+    def test_get_by_id(self):
+        self.assertEqual('12', self.media.get_by_id('12').media_id)
+        self.assertEqual('12', self.media.get_by_id(12).media_id)
+        self.assertIsNone(self.media.get_by_id('99'))
+        series = SeriesList([Series({'series_id': 5}), Series({'series_id': '6'})])
+        self.assertEqual(5, series.get_by_id('5').series_id)
+        self.assertEqual('6', series.get_by_id(6).series_id)
+
+    def test_episode_number(self):
+        self.assertEqual('12', self.media.get_by_episode_number(1).media_id)
+        self.assertEqual('12', self.media.get_by_episode_number('01').media_id)
+        # first one wins for duplicates
+        self.assertEqual('10', self.media.get_by_episode_number('2').media_id)
+        self.assertEqual('11', self.media.get_by_episode_number('SP1').media_id)
+        self.assertIsNone(self.media.get_by_episode_number('3'))
+        self.assertIsNone(self.media.get_by_episode_number(''))
+        self.assertEqual(['12', '10', '15', '13', '11', '14'],
+            self.ids(self.media.sorted_by_episode_number()))
+        self.assertEqual(['10', '15', '13'],
+            self.ids(self.media.get_episode_range(2, 13)))
+        self.assertEqual(['12', '10', '15', '13', '11'],
+            self.ids(self.media.get_episode_range()))
+
+    def test_invalidate(self):
+        self.assertIsNone(self.media.get_by_id('20'))
+        self.media.append(Media({'media_id': '20', 'episode_number': '3'}))
+        self.assertEqual('20', self.media.get_by_id('20').media_id)
+        self.assertEqual('20', self.media.get_by_episode_number(3).media_id)
+        del self.media[-1]
+        self.assertIsNone(self.media.get_by_id('20'))
+        self.media[0] = Media({'media_id': '21', 'episode_number': '2'})
+        self.assertEqual('21', self.media.get_by_episode_number(2).media_id)
+        self.assertEqual(6, len(pickle.loads(pickle.dumps(self.media))))
+
+MEDIA_STREAM_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<config xmlns:default="default">
+  <default:preload>
+    <stream_info>
+      <host>rtmpe://example.com/ondemand</host>
+      <file>mp4:video.mp4</file>
+      <token>abc</token>
+      <metadata><width>1280</width><height>720</height><duration>1420.5</duration></metadata>
+    </stream_info>
+    <subtitle id="1"><iv>aXY=</iv><data>ZGF0YQ==</data></subtitle>
+    <subtitles>
+      <subtitle id="1" title="[English (US)] English (US)" default="1"/>
+      <subtitle id="2" title="[Espanol] Espanol" default="0"/>
+    </subtitles>
+  </default:preload>
+</config>'''
+
+STYLED_SUBTITLE_XML = u'''<?xml version="1.0" encoding="UTF-8"?>
+<subtitle_script id="7" title="Episode 1" play_res_x="656" play_res_y="368"
+    lang_string="English (US)" created="2013-04-01T08:00:00-07:00" wrap_style="0">
+  <styles>
+    <style id="1" name="Default" font_name="Arial" font_size="20"
+        primary_colour="&amp;H00FFFFFF" secondary_colour="&amp;H000000FF"
+        outline_colour="&amp;H00000000" back_colour="&amp;H00000000" bold="0"
+        italic="0" underline="0" strikeout="0" scale_x="100" scale_y="100"
+        spacing="0" angle="0" border_style="1" outline="2" shadow="1"
+        alignment="2" margin_l="20" margin_r="20" margin_v="20" encoding="0"/>
+  </styles>
+  <events>
+    <event id="2" start="0:00:05.50" end="0:00:07.00" style="Default" name=""
+        margin_l="0000" margin_r="0000" margin_v="0000" effect=""
+        text="{\\i1}Second\\Nline{\\i0}"/>
+    <event id="1" start="0:00:01.00" end="0:00:03.25" style="Default" name=""
+        margin_l="0000" margin_r="0000" margin_v="0000" effect=""
+        text="First \u3042"/>
+  </events>
+</subtitle_script>'''
+
+class XmlModelTests(object):
+    """Run against every XML backend, see the subclasses below
+    """
+
+    BACKEND = None
+
+    def setUp(self):
+        self.addCleanup(xmlbackend.set_backend,
+            xmlbackend.set_backend(self.BACKEND))
+        self.stream = MediaStream(MEDIA_STREAM_XML)
+
+    def test_backend(self):
+        self.assertEqual(self.BACKEND, xmlbackend.get_backend().name)
+
+    def test_properties(self):
+        info = self.stream.stream_info
+        self.assertEqual('mp4:video.mp4', info.rtmp_data['file'])
+        self.assertEqual(1420.5, info.duration)
+        self.assertEqual((1280, 720), info.resolution)
+        self.assertFalse(info.is_upsell)
+        stubs = self.stream.subtitle_stubs
+        self.assertEqual(['English (US)', 'Espanol'],
+            [stub.language for stub in stubs])
+        self.assertEqual([True, False], [stub.is_default for stub in stubs])
+        self.assertEqual('1', self.stream.default_subtitles.id)
+
+    def test_memoized(self):
+        self.assertIs(self.stream.stream_info, self.stream.stream_info)
+        self.assertIs(self.stream.subtitle_stubs, self.stream.subtitle_stubs)
+        # shared between everything reading the stream, so it can't change
+        self.assertIsInstance(self.stream.subtitle_stubs, tuple)
+        info = self.stream.stream_info
+        self.assertIs(info.rtmp_data, info.rtmp_data)
+        self.assertIs(info['host'][0], info['host'][0])
+        self.assertIs(info.findfirst('.//width'), info.findfirst('.//width'))
+        # the returned lists are copies, the cached ones can't be changed
+        info['host'].pop()
+        self.assertEqual(1, len(info['host']))
+
+    def test_shared_cache(self):
+        node = XmlModel(MEDIA_STREAM_XML)
+        stubs = node.findall('.//{default}preload/subtitles/subtitle')
+        stub = SubtitleStub(stubs[0])
+        self.assertIs(stubs[0]._queries, stub._queries)
+        self.assertEqual([], stub['missing'])
+        self.assertEqual(2, len(node.findall('.//subtitles/subtitle')))
+
+    def test_subtitle_formats(self):
+        subtitle = StyledSubtitle(STYLED_SUBTITLE_XML)
+        srt = subtitle.get_srt_formatted().decode('utf-8')
+        self.assertEqual(u'1\n00:00:01,000 --> 00:00:03,250\nFirst \u3042\n\n'
+            u'2\n00:00:05,500 --> 00:00:07,000\nSecondline\n', srt)
+        ass = subtitle.get_ass_formatted().decode('utf-8')
+        self.assertIn(u'Subtitle ID: 7', ass)
+        self.assertIn(u'Style: Default, Arial, 20, &H00FFFFFF', ass)
+        self.assertIn(u'Dialogue: 0,0:00:01.00,0:00:03.25,Default,,0000,0000,'
+            u'0000,,First \u3042', ass)
+
+class TestXmlModelsElementTree(XmlModelTests, unittest.TestCase):
+    BACKEND = 'etree'
+
+@unittest.skipIf(xmlbackend.lxml_etree is None, 'lxml is not installed')
+class TestXmlModelsLxml(XmlModelTests, unittest.TestCase):
+    BACKEND = 'lxml'
+
+    def test_mixed_nodes(self):
+        xmlbackend.set_backend('etree')
+        stream = MediaStream(MEDIA_STREAM_XML)
+        xmlbackend.set_backend('lxml')
+        self.assertEqual((1280, 720), stream.stream_info.resolution)
+
+class TestInterning(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(interning.set_table, interning.get_table())
+        self.table = interning.enable(max_entries=10)
+
+    def make_series(self, i):
+        # decode each one separately like separate responses would be
+        return Series(json.loads(json.dumps({
+            'series_id':        str(i),
+            'publisher_name':   'Publisher',
+            'media_type':       'anime',
+            'year':             2013,
+            'name':             'Series %d' % i,
+            'landscape_image':  {'full_url': 'http://example.com/full.jpg',
+                'width': '640'},
+        })))
+
+    def test_shared(self):
+        first, second = self.make_series(1), self.make_series(2)
+        self.assertIs(first.publisher_name, second.publisher_name)
+        self.assertIs(first.media_type, second.media_type)
+        self.assertIs(first.to_dict()['landscape_image'],
+            second.to_dict()['landscape_image'])
+        # names aren't declared as repeating
+        self.assertIsNot(first.name, second.name)
+        self.assertEqual('http://example.com/full.jpg',
+            second.landscape_image.full_url)
+        stats = self.table.get_stats()
+        self.assertGreater(stats['hits'], 0)
+        self.assertGreater(stats['bytes_saved'], 0)
+
+    def test_dict_types(self):
+        self.assertIsNot(self.table.intern({'a': 1}), self.table.intern({'a': True}))
+        self.assertIs(True, self.table.intern({'a': True})['a'])
+
+    def test_bounded(self):
+        for i in range(20):
+            self.table.intern('value %d' % i)
+        self.assertEqual(10, len(self.table))
+        self.assertEqual(10, self.table.get_stats()['rejected'])
+        self.assertEqual('x' * 300, self.table.intern('x' * 300))
+        self.assertEqual(10, len(self.table))
+
+    def test_disabled(self):
+        interning.disable()
+        first, second = self.make_series(1), self.make_series(2)
+        self.assertIsNot(first.publisher_name, second.publisher_name)
+        self.assertEqual(0, self.table.get_stats()['hits'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import base64
+import binascii
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import xml.dom.minidom
+import zlib
+
+from tlslite.utils.cipherfactory import createAES
+
+from crunchyroll import aesbackend
+from crunchyroll.apis.errors import ApiNetworkException
+from crunchyroll.apis.pipeline import SubtitlePipeline
+from crunchyroll.models import Media, Subtitle, SubtitleStub, StyledSubtitle
+from crunchyroll.subtitlestore import SubtitleStore
+from crunchyroll.subtitles import SubtitleDecrypter, SubtitleFormatter, \
+    CompiledSubtitle, FORMATTERS
+
+SUBTITLE_SCRIPT = b'''<?xml version="1.0" encoding="UTF-8"?>
+<subtitle_script id="12345" title="Episode 1" play_res_x="656" play_res_y="368"
+    lang_string="English (US)" created="2013-04-01T08:00:00-07:00" wrap_style="0">
+  <styles/>
+  <events>
+    <event id="1" start="0:00:01.00" end="0:00:02.50" style="Default" name=""
+        margin_l="0000" margin_r="0000" margin_v="0000" effect="" text="Hello"/>
+  </events>
+</subtitle_script>'''
+
+def encrypt_subtitle(subtitle_id, script, iv=b'0123456789abcdef'):
+    """Build a Subtitle_GetXml response the way Crunchyroll would
+    """
+    data = zlib.compress(script)
+    data += b'\x00' * (-len(data) % 16)
+    key = SubtitleDecrypter()._build_encryption_key(subtitle_id)
+    encrypted = bytes(createAES(bytearray(key), bytearray(iv)).encrypt(
+        bytearray(data)))
+    return ('<subtitle id="%d"><iv>%s</iv><data>%s</data></subtitle>' % (
+        subtitle_id, base64.b64encode(iv).decode('ascii'),
+        base64.b64encode(encrypted).decode('ascii')))
+
+def get_available_backends():
+    backends = []
+    for name in aesbackend.PREFERENCE:
+        try:
+            backends.append(aesbackend.make_backend(name))
+        except ImportError:
+            pass
+    return backends
+
+class TestSubtitleDecrypter(unittest.TestCase):
+    def test_encryption_key(self):
+        decrypter = SubtitleDecrypter()
+        key = decrypter._build_encryption_key(12345)
+        self.assertEqual(b'081794dc6a34cc46bb349d3c23096321dd6372c2'
+            b'000000000000000000000000', binascii.hexlify(key))
+        self.assertIs(key, SubtitleDecrypter()._build_encryption_key(12345))
+        self.assertEqual(key[:16],
+            decrypter._build_encryption_key(12345, key_size=16))
+
+    def test_backends(self):
+        backends = get_available_backends()
+        self.assertEqual(backends[0].name, aesbackend.get_backend().name)
+        subtitle = Subtitle(encrypt_subtitle(12345, SUBTITLE_SCRIPT))
+        for backend in backends:
+            self.assertEqual(SUBTITLE_SCRIPT,
+                SubtitleDecrypter(backend).decrypt_subtitle(subtitle))
+        self.assertRaises(ValueError, aesbackend.make_backend, 'rot13')
+
+    def test_subtitle_model(self):
+        styled = Subtitle(encrypt_subtitle(12345, SUBTITLE_SCRIPT)).decrypt()
+        self.assertIsInstance(styled, StyledSubtitle)
+        self.assertEqual('Episode 1', styled.title)
+        self.assertIn(b'Hello', styled.get_srt_formatted())
+
+def make_script(event_count):
+    events = u''.join(
+        u'<event id="%d" start="0:%02d:%02d.00" end="0:%02d:%02d.50" '
+        u'style="Default" name="" margin_l="0000" margin_r="0000" '
+        u'margin_v="0000" effect="" text="{\\i1}Line %d \u2013 \u3042{\\i0}"/>' % (
+            i, i // 60, i % 60, i // 60, i % 60, i) \
+        for i in range(event_count))
+    return SUBTITLE_SCRIPT.replace(b'<events>',
+        b'<events>' + events.encode('utf-8'))
+
+class RecordingStream(object):
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+class TestSubtitleFormatter(unittest.TestCase):
+    def test_format_to(self):
+        styled = StyledSubtitle(make_script(500))
+        for name, formatter_cls in FORMATTERS.items():
+            formatter = formatter_cls()
+            output = io.BytesIO()
+            written = formatter.format_to(styled, output)
+            self.assertEqual(formatter.format(styled), output.getvalue())
+            self.assertEqual(len(output.getvalue()), written)
+            self.assertIn(u'Line 499 \u2013'.encode('utf-8'),
+                output.getvalue())
+
+    def test_chunked_writes(self):
+        styled = StyledSubtitle(make_script(500))
+        formatter = FORMATTERS['srt']()
+        formatter.WRITE_SIZE = 1024
+        stream = RecordingStream()
+        formatter.format_to(styled, stream)
+        self.assertGreater(len(stream.writes), 10)
+        # a write only goes over by the last event added to it
+        self.assertLess(max(len(data) for data in stream.writes), 1200)
+        self.assertEqual(formatter.format(styled), b''.join(stream.writes))
+
+    def test_whole_document_formatter(self):
+        class UpperFormatter(SubtitleFormatter):
+            def _format(self, styled_subtitle):
+                return styled_subtitle.title.upper()
+        output = io.BytesIO()
+        UpperFormatter().format_to(StyledSubtitle(SUBTITLE_SCRIPT), output)
+        self.assertEqual(b'EPISODE 1', output.getvalue())
+
+    def test_styled_subtitle(self):
+        styled = StyledSubtitle(SUBTITLE_SCRIPT)
+        output = io.BytesIO()
+        styled.write_srt_formatted(output)
+        self.assertEqual(b'1\n00:00:01,000 --> 00:00:02,500\nHello\n',
+            output.getvalue())
+        output = io.BytesIO()
+        styled.write_ass_formatted(output)
+        self.assertEqual(styled.get_ass_formatted(), output.getvalue())
+
+STYLED_SCRIPT = u'''<?xml version="1.0" encoding="UTF-8"?>
+<subtitle_script id="7" title="Episode 1" play_res_x="656" play_res_y="368"
+    lang_code="enUS" lang_string="English (US)"
+    created="2013-04-01T08:00:00-07:00" wrap_style="0">
+  <styles>
+    <style id="1" name="Sign Top" font_name="Arial" font_size="20"
+        primary_colour="&amp;H80FF8000" secondary_colour="&amp;H000000FF"
+        outline_colour="&amp;H00000000" back_colour="&amp;H00000000" bold="-1"
+        italic="0" underline="0" strikeout="0" scale_x="100" scale_y="100"
+        spacing="0" angle="0" border_style="1" outline="2" shadow="1"
+        alignment="8" margin_l="20" margin_r="20" margin_v="20" encoding="0"/>
+  </styles>
+  <events>
+    <event id="10" start="0:01:05.50" end="0:01:07.00" style="Sign Top"
+        name="" margin_l="0000" margin_r="0000" margin_v="0000" effect=""
+        text="{\\an8}Fish &amp; &lt;chips&gt;\\Nagain"/>
+    <event id="2" start="0:00:01.00" end="0:00:03.25" style="Missing"
+        name="" margin_l="0000" margin_r="0000" margin_v="0000" effect=""
+        text="Plain\\hline"/>
+  </events>
+</subtitle_script>'''
+
+class TestCompiledSubtitle(unittest.TestCase):
+    def setUp(self):
+        self.styled = StyledSubtitle(STYLED_SCRIPT)
+        self.compiled = self.styled.compile()
+
+    def test_compile(self):
+        self.assertIs(self.compiled, self.styled.compile())
+        self.assertEqual('7', self.compiled.id)
+        second, tenth = self.compiled.events
+        self.assertEqual((2, 1000, 3250), (second.id, second.start, second.end))
+        self.assertEqual((u'Plain\xa0line',), second.lines)
+        self.assertIsNone(second.style)
+        self.assertEqual((u'Fish & <chips>', u'again'), tenth.lines)
+        self.assertIs(self.compiled.styles[0], tenth.style)
+        self.assertEqual((u'Sign Top', 20.0, (0, 128, 255, 127), True, False, 8),
+            (tenth.style.name, tenth.style.font_size, tenth.style.colour,
+                tenth.style.bold, tenth.style.italic, tenth.style.alignment))
+        self.assertEqual(4170, CompiledSubtitle.parse_timestamp('0:00:04.17'))
+        self.assertRaises(ValueError, CompiledSubtitle.parse_timestamp, '4.17')
+
+    def test_formats(self):
+        formatted = self.styled.get_formatted(sorted(FORMATTERS))
+        for name, formatter_cls in FORMATTERS.items():
+            self.assertEqual(formatter_cls().format(self.styled),
+                formatted[name])
+        # by event id, not its string
+        self.assertTrue(formatted['srt'].startswith(
+            b'1\n00:00:01,000 --> 00:00:03,250\n'))
+        self.assertIn(b'Dialogue: 0,0:01:05.50,0:01:07.00,Sign Top,',
+            formatted['ass'])
+
+    def test_ass_unchanged(self):
+        # ASS timestamps are copied, not rebuilt from milliseconds
+        styled = StyledSubtitle(STYLED_SCRIPT.replace(u'0:01:07.00',
+            u'00:01:07.005'))
+        ass = styled.get_ass_formatted().decode('utf-8')
+        self.assertIn(u'\n[Events]\nFormat: Layer, Start, End, Style, Name, '
+            u'MarginL, MarginR, MarginV, Effect, Text\n'
+            u'Dialogue: 0,0:00:01.00,0:00:03.25,Missing,,0000,0000,0000,,'
+            u'Plain\\hline\n'
+            u'Dialogue: 0,0:01:05.50,00:01:07.005,Sign Top,,0000,0000,0000,,'
+            u'{\\an8}Fish & <chips>\\Nagain\n', ass)
+
+    def test_srt(self):
+        styled = StyledSubtitle(STYLED_SCRIPT.replace(u'0:01:07.00',
+            u'00:01:07.005'))
+        # numbered by event id, \h is a no-break space and \N is dropped
+        self.assertEqual(u'1\n00:00:01,000 --> 00:00:03,250\nPlain\xa0line\n'
+            u'\n2\n00:01:05,500 --> 00:01:07,005\nFish & <chips>again\n',
+            styled.get_srt_formatted().decode('utf-8'))
+
+    def test_vtt(self):
+        vtt = self.styled.get_vtt_formatted().decode('utf-8')
+        self.assertTrue(vtt.startswith(u'WEBVTT\n\nSTYLE\n::cue(.Sign_Top) {\n'))
+        self.assertIn(u'font-weight: bold;', vtt)
+        self.assertIn(u'color: rgba(0, 128, 255, 0.498);', vtt)
+        self.assertIn(u'\n2\n00:00:01.000 --> 00:00:03.250\nPlain\xa0line\n', vtt)
+        self.assertIn(u'\n10\n00:01:05.500 --> 00:01:07.000 line:0\n'
+            u'<c.Sign_Top>Fish &amp; &lt;chips&gt;\nagain</c>\n', vtt)
+
+    def test_ttml(self):
+        ttml = self.styled.get_ttml_formatted()
+        document = xml.dom.minidom.parseString(ttml)
+        self.assertEqual('en-US', document.documentElement.getAttribute('xml:lang'))
+        style = document.getElementsByTagName('style')[0]
+        self.assertEqual('#0080ff7f', style.getAttribute('tts:color'))
+        self.assertEqual('bold', style.getAttribute('tts:fontWeight'))
+        paragraphs = document.getElementsByTagName('p')
+        self.assertEqual(['00:00:01.000', '00:01:05.500'],
+            [p.getAttribute('begin') for p in paragraphs])
+        self.assertEqual(['bottom', 'top'],
+            [p.getAttribute('region') for p in paragraphs])
+        self.assertEqual(['', 's1'], [p.getAttribute('style') for p in paragraphs])
+        self.assertEqual(u'Fish & <chips>',
+            paragraphs[1].firstChild.data)
+        self.assertEqual(1, len(paragraphs[1].getElementsByTagName('br')))
+
+LANGUAGES = ['English (US)', 'Espanol', 'Francais (France)']
+
+class TestSubtitlePipeline(unittest.TestCase):
+    def setUp(self):
+        self.media_items = [Media({'media_id': str(i)}) for i in range(6)]
+        self.failing = set()
+        self.fetched = []
+        self.lock = threading.Lock()
+
+    def list_stubs(self, media):
+        if media.media_id in self.failing:
+            raise ApiNetworkException('listing failed')
+        return [SubtitleStub('<subtitle id="%d%d" title="[%s] %s" default="0"/>' % (
+            int(media.media_id) + 1, i, language, language)) \
+            for i, language in enumerate(LANGUAGES)]
+
+    def fetch_subtitle(self, stub):
+        with self.lock:
+            self.fetched.append(stub.id)
+        if stub.id in self.failing:
+            raise ApiNetworkException('fetch failed')
+        return Subtitle(encrypt_subtitle(int(stub.id),
+            SUBTITLE_SCRIPT.replace(b'12345', stub.id.encode('ascii'))))
+
+    def run_pipeline(self, **kwargs):
+        pipeline = SubtitlePipeline(self.list_stubs, self.fetch_subtitle,
+            **kwargs)
+        return list(pipeline.run(iter(self.media_items)))
+
+    def test_results(self):
+        results = self.run_pipeline(formats=['srt', 'ass'],
+            languages=LANGUAGES[:2], processes=2)
+        self.assertEqual(12, len(results))
+        for result in results:
+            self.assertIsNone(result.error)
+            self.assertIn(result.language, LANGUAGES[:2])
+            self.assertIn(b'Hello', result.subtitles['srt'])
+            self.assertIn(('Subtitle ID: %s' % result.stub.id).encode('ascii'),
+                result.subtitles['ass'])
+        self.assertEqual(set(media.media_id for media in self.media_items),
+            set(result.media.media_id for result in results))
+
+    def test_errors(self):
+        self.failing = set(['2', '10'])
+        results = self.run_pipeline(processes=0)
+        errors = [result for result in results if result.error is not None]
+        self.assertEqual(2, len(errors))
+        listing_error = [result for result in errors if result.stub is None][0]
+        self.assertEqual('2', listing_error.media.media_id)
+        self.assertEqual('10', [result for result in errors \
+            if result.stub is not None][0].stub.id)
+        self.assertEqual(14, len(results) - len(errors))
+        self.assertRaises(ValueError, SubtitlePipeline, self.list_stubs,
+            self.fetch_subtitle, formats=['sub'])
+
+    def test_bounded(self):
+        pipeline = SubtitlePipeline(self.list_stubs, self.fetch_subtitle,
+            processes=0, fetch_workers=2, max_pending=4)
+        results = pipeline.run(iter(self.media_items))
+        for handed_back in range(1, 6):
+            next(results)
+            self.assertLessEqual(len(self.fetched), handed_back + 4)
+        results.close()
+
+    def test_store(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = SubtitleStore(os.path.join(directory, 'subtitles.db'))
+        first = self.run_pipeline(formats=['srt'], processes=0, store=store)
+        self.assertEqual(18, len(self.fetched))
+        self.fetched = []
+        # every format is stored
+        second = self.run_pipeline(formats=['srt'], processes=0, store=store)
+        self.assertEqual([], self.fetched)
+        self.assertEqual(sorted((r.stub.id, r.subtitles['srt']) for r in first),
+            sorted((r.stub.id, r.subtitles['srt']) for r in second))
+        # the script is stored, only the formatting is done again
+        third = self.run_pipeline(formats=['srt', 'ass'], processes=0,
+            store=store.path)
+        self.assertEqual([], self.fetched)
+        for result in third:
+            self.assertIn(('Subtitle ID: %s' % result.stub.id).encode('ascii'),
+                result.subtitles['ass'])
+            self.assertEqual({'ass': result.subtitles['ass']},
+                store.get(result.stub.id, ['ass']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import multiprocessing
+import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from crunchyroll.subtitlestore import SubtitleStore
+
+def make_script(n):
+    return ('<subtitle_script id="%d">%s</subtitle_script>' % (n, 'x' * 100)
+        ).encode('ascii')
+
+def store_scripts(path, start):
+    """Worker process, stores and reads back scripts alongside the others
+    """
+    store = SubtitleStore(path)
+    for n in range(start, start + 20):
+        store.put(n, make_script(n), {'srt': b'srt %d' % n})
+        # one the other workers stored
+        store.get(n % 20, ['srt'])
+        if store.get(n, ['srt']) != {'srt': b'srt %d' % n}:
+            return False
+    return True
+
+class TestSubtitleStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'subtitles.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_get(self):
+        store = SubtitleStore(self.path)
+        content_hash = store.put(1, make_script(1), {'srt': b'1', 'ass': b'2'})
+        self.assertEqual(SubtitleStore.hash_script(make_script(1)),
+            content_hash)
+        self.assertEqual({'srt': b'1', 'xml': make_script(1)},
+            store.get(1, ['srt', 'xml']))
+        self.assertEqual({'ass': b'2'}, store.get(1, ['ass', 'ass4']))
+        self.assertEqual({}, store.get(2, ['srt']))
+        # other instances and reopened stores see the same thing
+        self.assertEqual({'ass': b'2'},
+            SubtitleStore(self.path).get(1, ['ass']))
+        stats = store.get_stats()
+        self.assertEqual((1, 2, 1), (stats['hits'], stats['misses'],
+            stats['scripts']))
+
+    def test_content_addressed(self):
+        store = SubtitleStore(self.path)
+        store.put(1, make_script(1), {'srt': b'1'})
+        # a different id that decrypted to the same script
+        store.put(2, make_script(1))
+        self.assertEqual({'srt': b'1'}, store.get(2, ['srt']))
+        self.assertEqual(1, store.get_stats()['scripts'])
+
+    def test_eviction(self):
+        size = len(make_script(1)) + 1
+        store = SubtitleStore(self.path, max_bytes=size * 2)
+        store.put(1, make_script(1), {'srt': b'1'})
+        store.put(2, make_script(2), {'srt': b'2'})
+        store.get(1, ['srt'])
+        store.put(3, make_script(3), {'srt': b'3'})
+        self.assertEqual({}, store.get(2, ['srt']))
+        self.assertEqual({'srt': b'1'}, store.get(1, ['srt']))
+        self.assertEqual({'srt': b'3'}, store.get(3, ['srt']))
+        stats = store.get_stats()
+        self.assertEqual((1, 2, size * 2), (stats['evicted'],
+            stats['scripts'], stats['bytes']))
+        # one script bigger than the store is still kept
+        store.put(4, make_script(4) * 3)
+        self.assertEqual([SubtitleStore.SCRIPT], list(store.get(4, ['xml'])))
+        self.assertEqual(1, store.get_stats()['scripts'])
+
+    def test_max_age(self):
+        store = SubtitleStore(self.path, max_age=60)
+        store.put(1, make_script(1), {'srt': b'1'})
+        self.assertEqual({'srt': b'1'}, store.get(1, ['srt']))
+        store._connect().execute('UPDATE scripts SET fetched = 0')
+        self.assertEqual({}, store.get(1, ['srt', 'xml']))
+        # formatting the stored script again doesn't make it fresh
+        store.put(1, make_script(1), {'ass': b'1'}, fetched=False)
+        self.assertEqual({}, store.get(1, ['srt']))
+        # the subtitle was fixed since it was stored
+        store.put(1, make_script(2), {'srt': b'2'})
+        self.assertEqual({'srt': b'2'}, store.get(1, ['srt']))
+        stats = store.get_stats()
+        self.assertEqual((2, 2, 2), (stats['hits'], stats['misses'],
+            stats['stale']))
+
+    def test_old_schema(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('CREATE TABLE scripts ('
+            'subtitle_id INTEGER PRIMARY KEY, content_hash TEXT NOT NULL)')
+        conn.execute('INSERT INTO scripts VALUES (1, ?)',
+            (SubtitleStore.hash_script(make_script(1)),))
+        conn.commit()
+        conn.close()
+        store = SubtitleStore(self.path)
+        self.assertEqual({}, store.get(1, ['xml']))
+        store.put(1, make_script(1))
+        self.assertEqual({'xml': make_script(1)}, store.get(1, ['xml']))
+
+    def test_processes(self):
+        store = SubtitleStore(self.path)
+        context = multiprocessing.get_context('spawn')
+        pool = context.Pool(4)
+        try:
+            results = pool.starmap(store_scripts,
+                [(self.path, start) for start in range(0, 80, 20)])
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual([True] * 4, results)
+        self.assertEqual(80, store.get_stats()['scripts'])
+        self.assertEqual({'srt': b'srt 79'},
+            pickle.loads(pickle.dumps(store)).get(79, ['srt']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Alex Headley  <aheadley@waysaboutstuff.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import unittest
+
+from crunchyroll.util import iter_pages
+
+class TestIterPages(unittest.TestCase):
+    def setUp(self):
+        self.items = list(range(25))
+        self.fetches = []
+
+    def fetch_page(self, offset, limit):
+        self.fetches.append((offset, limit))
+        return self.items[offset:offset + limit]
+
+    def test_all_pages(self):
+        for prefetch in (True, False):
+            self.fetches = []
+            self.assertEqual(self.items,
+                list(iter_pages(self.fetch_page, 10, prefetch=prefetch)))
+            self.assertEqual([(0, 10), (10, 10), (20, 10)], self.fetches)
+
+    def test_limit(self):
+        self.assertEqual(self.items[:15],
+            list(iter_pages(self.fetch_page, 10, limit=15)))
+        self.assertEqual([(0, 10), (10, 5)], self.fetches)
+
+    def test_exact_page_boundary(self):
+        self.items = list(range(20))
+        self.assertEqual(self.items, list(iter_pages(self.fetch_page, 10)))
+        self.assertEqual([(0, 10), (10, 10), (20, 10)], self.fetches)
+
+    def test_lazy(self):
+        pages = iter_pages(self.fetch_page, 10)
+        self.assertEqual([], self.fetches)
+        self.assertEqual(0, next(pages))
+        pages.close()
+
+if __name__ == '__main__':
+    unittest.main()